@@ -0,0 +1,123 @@
+import logging
+from dataclasses import asdict
+from typing import Optional
+from aiohttp import web
+from book.listing import listing_books
+from book.offer import Offer, offer_books
+from common.currency import APTOS_COIN, currency_name_of
+from common.progress import stream_tracker
+from config import config
+from feed.activity import COLLECTION, FEED_SIZE, TOKEN, USER, activity_feeds
+
+# listings returned at most by one request
+MAX_LISTINGS = 100
+
+
+def offer_payload(offer: Optional[Offer]) -> Optional[dict]:
+    if offer == None:
+        return None
+    return {**asdict(offer), 'price': f'{offer.price}'}
+
+
+def limit_of(request: web.Request) -> int:
+    try:
+        limit = int(request.query.get('limit', 20))
+    except ValueError:
+        raise web.HTTPBadRequest(text='limit must be an integer')
+    return max(1, min(limit, MAX_LISTINGS))
+
+
+# coin type the listings are priced in, APT by default
+def currency_of(request: web.Request) -> str:
+    return currency_name_of(request.query.get('currency', APTOS_COIN))
+
+
+# Small read API over the in-memory books and stream progress, answered
+# without a database or Redis round trip. Every response carries the chain
+# version of the last change applied to the structure it reads, 0 when
+# nothing changed since the worker loaded it. The activity feeds are read
+# from Redis, a cold feed is hydrated from MySQL by the read.
+class ReadApi:
+
+    def __init__(self) -> None:
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/collections/{id}/floor', self.floor),
+            web.get('/collections/{id}/listings', self.listings),
+            web.get('/collections/{id}/offers/best', self.best_offer_of_collection),
+            web.get('/tokens/{id}/offers/best', self.best_offer_of_token),
+            web.get('/collections/{id}/activity', self.activity_of_collection),
+            web.get('/tokens/{id}/activity', self.activity_of_token),
+            web.get('/users/{id}/activity', self.activity_of_user),
+            web.get('/streams', self.streams),
+        ])
+
+    async def run(self):
+        if config.read_api_port == 0:
+            return
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, port=config.read_api_port).start()
+        logging.info(f'[Read API]: listening on port {config.read_api_port}')
+
+    async def floor(self, request: web.Request) -> web.Response:
+        collection_id = request.match_info['id']
+        currency = currency_of(request)
+        floor_price = listing_books.floor(collection_id, currency)
+        return web.json_response({
+            'version': listing_books.version,
+            'collectionId': collection_id,
+            'currency': currency,
+            'floorPrice': None if floor_price == None else f'{floor_price}',
+            'listedCount': listing_books.count(collection_id),
+        })
+
+    async def listings(self, request: web.Request) -> web.Response:
+        collection_id = request.match_info['id']
+        currency = currency_of(request)
+        listings = listing_books.top(collection_id, limit_of(request), currency)
+        return web.json_response({
+            'version': listing_books.version,
+            'collectionId': collection_id,
+            'currency': currency,
+            'listings': [{'price': f'{price}', 'tokenId': token_id, 'seller': seller}
+                         for (price, token_id, seller) in listings],
+        })
+
+    async def best_offer_of_collection(self, request: web.Request) -> web.Response:
+        collection_id = request.match_info['id']
+        return web.json_response({
+            'version': offer_books.version,
+            'collectionId': collection_id,
+            'offer': offer_payload(offer_books.best_of_collection(collection_id)),
+        })
+
+    async def best_offer_of_token(self, request: web.Request) -> web.Response:
+        token_id = request.match_info['id']
+        return web.json_response({
+            'version': offer_books.version,
+            'tokenId': token_id,
+            'offer': offer_payload(offer_books.best_of_token(token_id)),
+        })
+
+    async def activity(self, request: web.Request, kind: str) -> web.Response:
+        id = request.match_info['id']
+        return web.json_response({
+            'id': id,
+            'activities': await activity_feeds.read(kind, id, min(limit_of(request), FEED_SIZE)),
+        })
+
+    async def activity_of_collection(self, request: web.Request) -> web.Response:
+        return await self.activity(request, COLLECTION)
+
+    async def activity_of_token(self, request: web.Request) -> web.Response:
+        return await self.activity(request, TOKEN)
+
+    async def activity_of_user(self, request: web.Request) -> web.Response:
+        return await self.activity(request, USER)
+
+    async def streams(self, request: web.Request) -> web.Response:
+        return web.json_response({'streams': stream_tracker.payload()})
+
+
+read_api = ReadApi()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import config
+from model.change import Change
+from model.event import Event
+
+# pyarrow is optional, the archive stays off without it
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FLUSH_INTERVAL = 60
+# rows buffered before a flush comes early
+FLUSH_ROWS = 50000
+RETRY_BACKOFF = 5
+METRICS_INTERVAL = 60
+
+# (module, day)
+Partition = Tuple[str, str]
+
+
+def schema():
+    return pa.schema([
+        ('field', pa.string()),
+        ('seqno', pa.int64()),
+        ('version', pa.int64()),
+        ('event_id', pa.string()),
+        ('type', pa.string()),
+        ('token_id', pa.string()),
+        ('collection_id', pa.string()),
+        ('price', pa.string()),
+        ('currency', pa.string()),
+        ('source', pa.string()),
+        ('destination', pa.string()),
+        # microseconds
+        ('timestamp', pa.int64()),
+        ('expiration', pa.int64()),
+        ('curation_index', pa.int64()),
+        # the event as fetched, for replays
+        ('event_type', pa.string()),
+        ('guid', pa.string()),
+        ('data', pa.string()),
+    ])
+
+
+def row_of(event_field: str, event: Event, change: Optional[Change]) -> dict:
+    row = {
+        'field': event_field,
+        'seqno': int(event.sequence_number),
+        'version': None if event.version == None else int(event.version),
+        'event_type': event.type,
+        'guid': json.dumps(event.guid),
+        'data': json.dumps(event.data),
+    }
+    if change != None:
+        row.update({
+            'event_id': change.event_id,
+            'type': change.type,
+            'token_id': change.token_id,
+            'collection_id': change.collection_id,
+            'price': change.price,
+            'currency': change.currency,
+            'source': change.source,
+            'destination': change.destination,
+            'timestamp': change.timestamp,
+            'expiration': change.expiration,
+            'curation_index': change.curation_index,
+        })
+    return row
+
+
+# Decoded events of every stream, appended once applied to Parquet files
+# partitioned by module and UTC day: <archive_path>/module=<module>/day=<day>/.
+# Each flush writes new files, named after the stream and seq no range they
+# hold; events applied again after a crash may be archived twice, readers
+# keep one row per stream and seq no.
+class EventArchive:
+
+    def __init__(self) -> None:
+        self.pending: Dict[Partition, List[dict]] = {}
+        self.rows = 0
+        self.wakeup = asyncio.Event()
+        # highest seq no archived per stream
+        self.heads: Dict[str, int] = {}
+        self.archived = 0
+        self.files = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    def enabled(self) -> bool:
+        return config.archive_path != '' and pa != None
+
+    # the applied events with the changes their observer committed, which
+    # carry the token and collection ids resolved in MySQL
+    def append(self, event_field: str, events: List[Event], changes: List[Change]):
+        if not self.enabled():
+            return
+        change_of = {change.seqno: change for change in changes}
+        for event in events:
+            row = row_of(event_field, event, change_of.get(int(event.sequence_number)))
+            at = time.time() if row.get('timestamp') == None else row['timestamp'] / 1000000
+            partition = (config.module_of(event.type), datetime.utcfromtimestamp(at).strftime('%Y-%m-%d'))
+            self.pending.setdefault(partition, []).append(row)
+            self.rows += 1
+        if self.rows >= FLUSH_ROWS:
+            self.wakeup.set()
+
+    async def run(self):
+        if config.archive_path != '' and pa == None:
+            logging.warning('[Archive]: pyarrow is not installed, events are not archived')
+        if not self.enabled():
+            return
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            pending = self.pending
+            self.pending = {}
+            self.rows = 0
+            try:
+                await asyncio.to_thread(self.flush, pending)
+            except Exception as err:
+                self.failures += 1
+                for partition, rows in pending.items():
+                    self.pending[partition] = rows + self.pending.get(partition, [])
+                    self.rows += len(rows)
+                logging.error(f'[Archive]: Failed to write {len(pending)} partitions: {err}')
+                await asyncio.sleep(RETRY_BACKOFF)
+            self.report()
+
+    def flush(self, pending: Dict[Partition, List[dict]]):
+        for (module, day), rows in pending.items():
+            directory = os.path.join(config.archive_path, f'module={module}', f'day={day}')
+            os.makedirs(directory, exist_ok=True)
+            by_field: Dict[str, List[dict]] = {}
+            for row in rows:
+                by_field.setdefault(row['field'], []).append(row)
+            for event_field, field_rows in by_field.items():
+                first, last = field_rows[0]['seqno'], field_rows[-1]['seqno']
+                name = f'{event_field}-{first:012d}-{last:012d}.parquet'
+                # written aside then renamed, readers never see a partial file
+                # (dot files are skipped by pyarrow datasets)
+                hidden = os.path.join(directory, f'.{name}.tmp')
+                pq.write_table(pa.Table.from_pylist(field_rows, schema=schema()), hidden)
+                os.replace(hidden, os.path.join(directory, name))
+                self.heads[event_field] = max(last, self.heads.get(event_field, last))
+                self.archived += len(field_rows)
+                self.files += 1
+
+    # events of a stream from seq no `start` on, for the journal to replay
+    # from instead of the node
+    def read(self, event_field: str, start: int, limit: int) -> List[Event]:
+        if not self.enabled() or self.heads.get(event_field, -1) < start:
+            return []
+        table = load(ds.field('field') == event_field, ds.field('seqno') >= start)
+        table = table.sort_by('seqno').slice(0, limit)
+        return [Event(sequence_number=f"{row['seqno']}", type=row['event_type'], data=json.loads(row['data']),
+                      version=None if row['version'] == None else f"{row['version']}", guid=json.loads(row['guid']))
+                for row in table.to_pylist()]
+
+    def open(self):
+        if not self.enabled() or not os.path.isdir(config.archive_path):
+            return
+        # heads from the file names, <field>-<first>-<last>.parquet
+        for (_, _, names) in os.walk(config.archive_path):
+            for name in names:
+                if name.endswith('.parquet') and not name.startswith('.'):
+                    (event_field, _, last) = name[:-len('.parquet')].rsplit('-', 2)
+                    self.heads[event_field] = max(int(last), self.heads.get(event_field, -1))
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Archive]: archived {self.archived} events in {self.files} files, failures {self.failures}, pending {self.rows}')
+
+
+PARTITIONS = ['module', 'day']
+
+
+# archived rows matching all `filters`, one per event; `module` and `day`
+# filters prune the partitions read
+def load(*filters, columns: Optional[List[str]] = None):
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITIONS]), flavor='hive')
+    dataset = ds.dataset(config.archive_path, format='parquet', partitioning=partitioning,
+                         schema=pa.unify_schemas([schema(), partitioning.schema]))
+    expression = None
+    for item in filters:
+        expression = item if expression == None else expression & item
+    table = dataset.to_table(filter=expression, columns=None if columns == None else list({*columns, 'field', 'seqno'}))
+    if table.num_rows == 0:
+        return table
+    # a replay may have archived an event twice
+    keys = pc.binary_join_element_wise(table['field'], pc.cast(table['seqno'], pa.string()), ':')
+    (_, first) = unique_indices(keys)
+    return table.take(first)
+
+
+def unique_indices(keys):
+    (values, index) = np.unique(keys.to_numpy(zero_copy_only=False), return_index=True)
+    return (values, pa.array(np.sort(index)))
+
+
+event_archive = EventArchive()
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from datetime import datetime
+from common.activity import ACTIVITY_TABLE, month_of
+from common.db import connect_db, prisma_client
+from scheduler.partitions import MAX_PARTITION, PARTITIONS_AHEAD, activity_partitions, definition_of
+
+# Partitions AptosActivity by month of txTimestamp, from the month of its
+# oldest activity to PARTITIONS_AHEAD months ahead, plus the catch-all one;
+# the worker maintains them from there (scheduler/partitions.py). Push the
+# schema first, the primary key must hold txTimestamp. The table is copied,
+# run it with the worker stopped.
+
+
+async def main():
+    await connect_db()
+
+    if len(await activity_partitions.partitions()) > 0:
+        logging.info(f'[Partitions]: {ACTIVITY_TABLE} is partitioned already')
+        return
+    rows = await prisma_client.query_raw(
+        f"SELECT CAST(MIN(txTimestamp) AS CHAR) AS oldest FROM {ACTIVITY_TABLE}")
+    now = datetime.now()
+    first = now if rows[0]['oldest'] == None else datetime.fromisoformat(rows[0]['oldest'])
+    months = []
+    month = month_of(first)
+    while month <= month_of(now, PARTITIONS_AHEAD):
+        months.append(month)
+        month = month_of(month, 1)
+    await prisma_client.execute_raw(
+        f"ALTER TABLE {ACTIVITY_TABLE} PARTITION BY RANGE COLUMNS(txTimestamp) "
+        f"({', '.join(definition_of(month) for month in months)}, "
+        f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE))")
+    logging.info(f'[Partitions]: partitioned {ACTIVITY_TABLE} in {len(months)} months')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='activity_partitions.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from archive.events import load
+from common.currency import APTOS_COIN, currencies, currency_name_of
+from common.db import connect_db, prisma_client
+from common.keys import leaderboard_key
+from common.redis import redis_async
+from stats.collection import DAY, WEEK
+from stats.leaderboard import BUCKET_PATTERNS, BUCKET_TTL, BUYERS, COLLECTIONS, SELLERS
+from stats.rollup import GRANULARITIES
+
+# Rebuilds the collection volumes and stats, the rollups and the leaderboards
+# from the event archive (see archive/events.py) instead of the MySQL tables,
+# with the aggregates computed by Arrow over whole columns. Needs pyarrow and
+# numpy, which are not in requirements.txt: `pip install pyarrow numpy`. Run
+# it with the worker stopped; the archive must cover the history that is
+# rebuilt.
+
+SALES = ['buy', 'accept_offer']
+PRICE = pa.decimal128(38, 0)
+MICROS = 1000000
+# microseconds of each rollup and leaderboard bucket
+ROLLUP_UNITS = {'MINUTE': 60 * MICROS, 'HOUR': 3600 * MICROS, 'DAY': DAY * MICROS}
+LEADERBOARD_UNITS = {'h': 3600 * MICROS, 'd': DAY * MICROS}
+CHUNK_SIZE = 500
+
+UPSERT_STATS = """
+INSERT INTO CollectionStats (collectionId, volume, volume24h, volume7d, sales, updatedAt)
+VALUES {values}
+ON DUPLICATE KEY UPDATE
+    volume = VALUES(volume),
+    volume24h = VALUES(volume24h),
+    volume7d = VALUES(volume7d),
+    sales = VALUES(sales),
+    updatedAt = VALUES(updatedAt)
+"""
+
+INSERT_VOLUMES = """
+INSERT INTO CollectionVolume (collectionId, currencyId, volume, sales)
+VALUES {values}
+"""
+
+RESET_STATS = "UPDATE CollectionStats SET volume = '0', volume24h = '0', volume7d = '0', sales = 0 {where}"
+
+SYNC_COLLECTION = "UPDATE Collection c JOIN CollectionStats s ON s.collectionId = c.id SET c.volume = s.volume {where}"
+
+INSERT_ROLLUPS = """
+INSERT INTO CollectionRollup (collectionId, currencyId, granularity, bucket, volume, sales, minPrice, maxPrice, listings)
+VALUES {values}
+"""
+
+
+def load_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Archive rebuild',
+        description='Rebuild the collection stats, rollups and leaderboards from the event archive')
+    parser.add_argument('job', choices=['stats', 'rollups', 'leaderboards'])
+    parser.add_argument('--collection')
+    return parser.parse_args()
+
+
+def chunks(rows: List, size: int = CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+# archived events of `types`, with a collection and a timestamp, of
+# `collection` only when given
+def events_of(types: List[str], columns: List[str], collection: Optional[str]):
+    filters = [ds.field('type').isin(types), ~ds.field('collection_id').is_null(), ~ds.field('timestamp').is_null()]
+    if collection is not None:
+        filters.append(ds.field('collection_id') == collection)
+    table = load(*filters, columns=columns)
+    if 'price' in columns:
+        table = table.set_column(table.schema.get_field_index('price'), 'price',
+                                 pc.cast(pc.fill_null(table['price'], '0'), PRICE))
+    if 'currency' in columns:
+        table = table.set_column(table.schema.get_field_index('currency'), 'currency',
+                                 pc.fill_null(table['currency'], ''))
+    return table
+
+
+# volume of the sales per collection since `since` (microseconds)
+def volumes_of(sales, since: int) -> Dict[str, Tuple[int, int]]:
+    if since > 0:
+        sales = sales.filter(pc.greater(sales['timestamp'], since))
+    grouped = sales.group_by('collection_id').aggregate([('price', 'sum'), ('price', 'count')])
+    return {collection_id: (int(volume), count) for (collection_id, volume, count) in zip(
+        grouped['collection_id'].to_pylist(), grouped['price_sum'].to_pylist(), grouped['price_count'].to_pylist())}
+
+
+# volume and sales per collection and currency id, the stats in APT
+async def rebuild_stats(collection: Optional[str]):
+    sales = events_of(SALES, ['collection_id', 'currency', 'price', 'timestamp'], collection)
+    ids = {currency: await currencies.id_of(currency) for currency in pc.unique(sales['currency']).to_pylist()}
+    aptos_coin_id = await currencies.id_of(APTOS_COIN)
+    grouped = sales.group_by(['collection_id', 'currency']).aggregate([('price', 'sum'), ('price', 'count')])
+    volumes: Dict[Tuple[str, int], List[int]] = {}
+    for row in grouped.to_pylist():
+        volume = volumes.setdefault((row['collection_id'], ids[row['currency']]), [0, 0])
+        volume[0] += int(row['price_sum'])
+        volume[1] += row['price_count']
+    volume_rows = [(collection_id, currency_id, f'{volume}', count)
+                   for (collection_id, currency_id), (volume, count) in volumes.items()]
+
+    apt = sales.filter(pc.is_in(sales['currency'], value_set=pa.array(
+        [currency for currency, id in ids.items() if id == aptos_coin_id], pa.string())))
+    now = int(time.time() * MICROS)
+    totals = volumes_of(apt, 0)
+    days = volumes_of(apt, now - DAY * MICROS)
+    weeks = volumes_of(apt, now - WEEK * MICROS)
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    rows = [(collection_id, f'{volume}', f'{days.get(collection_id, (0, 0))[0]}',
+             f'{weeks.get(collection_id, (0, 0))[0]}', count, updated_at)
+            for collection_id, (volume, count) in totals.items()]
+
+    where = ''
+    args_of_where = []
+    if collection is not None:
+        where = 'WHERE collectionId = ?'
+        args_of_where = [collection]
+    # floor price and listed count are left to the listing book of the worker
+    async with prisma_client.tx(timeout=600000) as transaction:
+        await transaction.execute_raw(f'DELETE FROM CollectionVolume {where}', *args_of_where)
+        for chunk in chunks(volume_rows):
+            await transaction.execute_raw(
+                INSERT_VOLUMES.format(values=', '.join(['(?, ?, ?, ?)'] * len(chunk))),
+                *[value for row in chunk for value in row])
+        await transaction.execute_raw(RESET_STATS.format(where=where), *args_of_where)
+        for chunk in chunks(rows):
+            await transaction.execute_raw(
+                UPSERT_STATS.format(values=', '.join(['(?, ?, ?, ?, ?, ?)'] * len(chunk))),
+                *[value for row in chunk for value in row])
+        synced = await transaction.execute_raw(
+            SYNC_COLLECTION.format(where=where.replace('collectionId', 'c.id')), *args_of_where)
+    logging.info(
+        f'[Archive rebuild]: rebuilt {len(volume_rows)} volumes, stats of {len(rows)} collections from {sales.num_rows} sales, '
+        f'synced {synced} collections')
+
+
+async def rebuild_rollups(collection: Optional[str]):
+    events = events_of(['list', *SALES], ['collection_id', 'currency', 'type', 'price', 'timestamp'], collection)
+    ids = {currency: await currencies.id_of(currency) for currency in pc.unique(events['currency']).to_pylist()}
+    sale = np.isin(events['type'].to_numpy(zero_copy_only=False), SALES)
+
+    where = ''
+    args_of_where = []
+    if collection is not None:
+        where = 'AND collectionId = ?'
+        args_of_where = [collection]
+    for granularity, (_, pattern) in GRANULARITIES.items():
+        unit = ROLLUP_UNITS[granularity]
+        table = events.append_column('bucket', pa.array(events['timestamp'].to_numpy() // unit * unit))
+        sales = table.filter(pa.array(sale)).group_by(['collection_id', 'currency', 'bucket']).aggregate(
+            [('price', 'sum'), ('price', 'count'), ('price', 'min'), ('price', 'max')])
+        listings = table.filter(pa.array(~sale)).group_by(['collection_id', 'currency', 'bucket']).aggregate(
+            [('type', 'count')])
+
+        rollups: Dict[Tuple[str, str, int], List] = {}
+        for row in sales.to_pylist():
+            rollups[(row['collection_id'], row['currency'], row['bucket'])] = [
+                f"{row['price_sum']}", row['price_count'], f"{row['price_min']}", f"{row['price_max']}", 0]
+        for row in listings.to_pylist():
+            key = (row['collection_id'], row['currency'], row['bucket'])
+            rollups.setdefault(key, ['0', 0, None, None, 0])[4] = row['type_count']
+        rows = [(collection_id, ids[currency], granularity,
+                 datetime.utcfromtimestamp(bucket / MICROS).strftime(pattern), *values)
+                for (collection_id, currency, bucket), values in rollups.items()]
+
+        async with prisma_client.tx(timeout=600000) as transaction:
+            deleted = await transaction.execute_raw(
+                f'DELETE FROM CollectionRollup WHERE granularity = ? {where}', granularity, *args_of_where)
+            for chunk in chunks(rows):
+                await transaction.execute_raw(
+                    INSERT_ROLLUPS.format(values=', '.join(['(?, ?, ?, ?, ?, ?, ?, ?, ?)'] * len(chunk))),
+                    *[value for row in chunk for value in row])
+        logging.info(
+            f'[Archive rebuild]: rebuilt {granularity} rollups, deleted {deleted} rows, inserted {len(rows)} rows')
+
+
+async def rebuild_leaderboards(collection: Optional[str]):
+    if collection is not None:
+        raise Exception('[Archive rebuild]: leaderboards are rebuilt for all collections')
+    sales = events_of(SALES, ['collection_id', 'currency', 'source', 'destination', 'price', 'timestamp'], collection)
+    # the boards rank APT sales only, as the worker does
+    sales = sales.filter(pc.is_in(sales['currency'], value_set=pa.array(
+        [currency for currency in pc.unique(sales['currency']).to_pylist()
+         if currency_name_of(currency) == APTOS_COIN], pa.string())))
+    sales = sales.set_column(sales.schema.get_field_index('price'), 'price', pc.cast(sales['price'], pa.float64()))
+    now = int(time.time() * MICROS)
+    written = 0
+    async with redis_async.pipeline(transaction=False) as pipe:
+        for granularity, unit in LEADERBOARD_UNITS.items():
+            ttl = BUCKET_TTL[granularity] * MICROS
+            # buckets the worker would not have expired yet
+            recent = sales.filter(pc.greater(sales['timestamp'], now - ttl - unit))
+            recent = recent.append_column('bucket', pa.array(recent['timestamp'].to_numpy() // unit * unit))
+            for (board, member) in ((COLLECTIONS, 'collection_id'), (BUYERS, 'destination'), (SELLERS, 'source')):
+                table = recent.set_column(recent.schema.get_field_index(member), member,
+                                          pc.fill_null(recent[member], ''))
+                grouped = table.group_by(['bucket', member]).aggregate([('price', 'sum')])
+                boards: Dict[int, Dict[str, float]] = {}
+                for (bucket, name, volume) in zip(grouped['bucket'].to_pylist(), grouped[member].to_pylist(),
+                                                   grouped['price_sum'].to_pylist()):
+                    boards.setdefault(bucket, {})[name] = volume
+                for bucket, scores in boards.items():
+                    key = leaderboard_key(board, granularity, datetime.utcfromtimestamp(
+                        bucket / MICROS).strftime(BUCKET_PATTERNS[granularity]))
+                    pipe.delete(key)
+                    pipe.zadd(key, scores)
+                    # expires as if its last sale had just been applied at the end of the bucket
+                    pipe.expire(key, max(1, (bucket + unit + ttl - now) // MICROS))
+                    written += 1
+        await pipe.execute()
+    logging.info(f'[Archive rebuild]: rebuilt {written} leaderboard buckets from {sales.num_rows} sales')
+
+
+async def main():
+    args = load_args()
+    await connect_db()
+    if args.job == 'stats':
+        await rebuild_stats(args.collection)
+    elif args.job == 'rollups':
+        await rebuild_rollups(args.collection)
+    else:
+        await rebuild_leaderboards(args.collection)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='archive_rebuild.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from common.activity import activity_source
+from common.currency import APTOS_COIN, CURRENCY_NAME_SQL, currencies
+from common.db import connect_db, prisma_client
+from stats.rollup import GRANULARITIES
+
+# Rebuilds CollectionRollup from AptosActivity, one granularity per
+# transaction. Activities without a currency id are resolved by their coin
+# type, those without one either (written before coin types were recorded)
+# count as APT. Activities hold the local time of the worker, bucketed in UTC
+# at the current offset of this process as the worker does, so run it in the
+# time zone of the worker. Run it with the worker stopped, or rows the worker
+# adds meanwhile are counted twice.
+
+REBUILD_ROLLUPS = """
+INSERT INTO CollectionRollup (collectionId, currencyId, granularity, bucket, volume, sales, minPrice, maxPrice, listings)
+SELECT collectionId, COALESCE(x.currencyId, c.id, ?) AS rollupCurrencyId, ?, DATE_FORMAT(CONVERT_TZ(txTimestamp, ?, '+00:00'), ?) AS rollupBucket,
+    COALESCE(SUM(CASE WHEN txType = 'SALE' THEN CAST(price AS DECIMAL(38,0)) END), 0),
+    SUM(txType = 'SALE'),
+    MIN(CASE WHEN txType = 'SALE' THEN CAST(price AS DECIMAL(38,0)) END),
+    MAX(CASE WHEN txType = 'SALE' THEN CAST(price AS DECIMAL(38,0)) END),
+    SUM(txType = 'LIST')
+FROM {activities} x
+LEFT JOIN Currency c ON c.name = {currency_name}
+WHERE txType IN ('SALE', 'LIST') {where}
+GROUP BY collectionId, rollupCurrencyId, rollupBucket
+"""
+
+
+def load_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Collection rollups rebuild',
+        description='Rebuild the minute, hour and day rollups from the activities')
+    parser.add_argument('--collection')
+    parser.add_argument('--granularity', choices=list(GRANULARITIES.keys()))
+    return parser.parse_args()
+
+
+# offset of the local time as +HH:MM, for CONVERT_TZ
+def local_offset() -> str:
+    minutes = int(datetime.now().astimezone().utcoffset().total_seconds()) // 60
+    sign = '-' if minutes < 0 else '+'
+    return f'{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}'
+
+
+async def main():
+    await connect_db()
+
+    where = ''
+    args_of_where = []
+    if args.collection is not None:
+        where = 'AND collectionId = ?'
+        args_of_where = [args.collection]
+
+    aptos_coin_id = await currencies.id_of(APTOS_COIN)
+    granularities = GRANULARITIES.keys() if args.granularity is None else [args.granularity]
+    for granularity in granularities:
+        (pattern, _) = GRANULARITIES[granularity]
+        async with prisma_client.tx(timeout=600000) as transaction:
+            deleted = await transaction.execute_raw(
+                f'DELETE FROM CollectionRollup WHERE granularity = ? {where}', granularity, *args_of_where)
+            rebuilt = await transaction.execute_raw(
+                REBUILD_ROLLUPS.format(activities=activity_source(), where=where,
+                                       currency_name=CURRENCY_NAME_SQL.format(column='x.currency')),
+                aptos_coin_id, granularity, local_offset(), pattern, *args_of_where)
+        logging.info(
+            f'[Rollup]: rebuilt {granularity} rollups, deleted {deleted} rows, inserted {rebuilt} rows')
+
+
+global args
+if __name__ == "__main__":
+    args = load_args()
+    logging.basicConfig(
+        filename='collection_rollups.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import logging
+from common.activity import activity_source
+from common.currency import APTOS_COIN, currencies
+from common.db import connect_db, prisma_client
+from stats.collection import DAY, WEEK, datetime_since
+
+# Rebuilds CollectionVolume, CollectionStats and Collection.volume/floorPrice
+# from AptosActivity and AptosOrder; the stats are in APT, activities without
+# a currency id are counted as APT. Run it with the worker stopped, the worker
+# loads the rebuilt stats when it starts.
+
+REBUILD_VOLUMES = """
+INSERT INTO CollectionVolume (collectionId, currencyId, volume, sales)
+SELECT collectionId, COALESCE(currencyId, ?) AS volumeCurrencyId, SUM(CAST(price AS DECIMAL(38,0))), COUNT(*)
+FROM {activities} x WHERE txType = 'SALE' {where}
+GROUP BY collectionId, volumeCurrencyId
+"""
+
+REBUILD_STATS = """
+INSERT INTO CollectionStats (collectionId, floorPrice, volume, volume24h, volume7d, sales, listedCount, updatedAt)
+SELECT c.id,
+    CAST(COALESCE(o.floorPrice, 0) AS CHAR),
+    CAST(COALESCE(v.volume, 0) AS CHAR),
+    CAST(COALESCE(a.volume24h, 0) AS CHAR),
+    CAST(COALESCE(a.volume7d, 0) AS CHAR),
+    COALESCE(v.sales, 0),
+    COALESCE(o.listedCount, 0),
+    NOW(3)
+FROM Collection c
+LEFT JOIN (
+    SELECT collectionId,
+        SUM(CASE WHEN txTimestamp > ? THEN CAST(price AS DECIMAL(38,0)) ELSE 0 END) AS volume24h,
+        SUM(CASE WHEN txTimestamp > ? THEN CAST(price AS DECIMAL(38,0)) ELSE 0 END) AS volume7d
+    FROM AptosActivity WHERE txType = 'SALE' AND txTimestamp > ? AND COALESCE(currencyId, ?) = ? GROUP BY collectionId
+) a ON a.collectionId = c.id
+LEFT JOIN CollectionVolume v ON v.collectionId = c.id AND v.currencyId = ?
+LEFT JOIN (
+    SELECT collectionId, MIN(CAST(price AS DECIMAL(38,0))) AS floorPrice, COUNT(*) AS listedCount
+    FROM AptosOrder WHERE status = 'LISTING' GROUP BY collectionId
+) o ON o.collectionId = c.id
+{where}
+ON DUPLICATE KEY UPDATE
+    floorPrice = VALUES(floorPrice),
+    volume = VALUES(volume),
+    volume24h = VALUES(volume24h),
+    volume7d = VALUES(volume7d),
+    sales = VALUES(sales),
+    listedCount = VALUES(listedCount),
+    updatedAt = VALUES(updatedAt)
+"""
+
+SYNC_COLLECTION = """
+UPDATE Collection c JOIN CollectionStats s ON s.collectionId = c.id
+SET c.volume = s.volume, c.floorPrice = s.floorPrice, c.floorPriceValue = CAST(s.floorPrice AS DECIMAL(38,0))
+{where}
+"""
+
+
+def load_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Collection stats reconciliation',
+        description='Rebuild the collection stats from the activities and orders')
+    parser.add_argument('--collection')
+    return parser.parse_args()
+
+
+async def main():
+    await connect_db()
+
+    where = ''
+    args_of_where = []
+    if args.collection is not None:
+        where = 'WHERE c.id = ?'
+        args_of_where = [args.collection]
+    aptos_coin_id = await currencies.id_of(APTOS_COIN)
+
+    async with prisma_client.tx(timeout=600000) as transaction:
+        await transaction.execute_raw(
+            f"DELETE FROM CollectionVolume {where.replace('c.id', 'collectionId')}", *args_of_where)
+        volumes = await transaction.execute_raw(
+            REBUILD_VOLUMES.format(activities=activity_source(), where=where.replace('WHERE c.id', 'AND collectionId')),
+            aptos_coin_id, *args_of_where)
+        rebuilt = await transaction.execute_raw(
+            REBUILD_STATS.format(where=where), datetime_since(DAY), datetime_since(WEEK), datetime_since(WEEK),
+            aptos_coin_id, aptos_coin_id, aptos_coin_id, *args_of_where)
+        synced = await transaction.execute_raw(
+            SYNC_COLLECTION.format(where=where), *args_of_where)
+    logging.info(
+        f'[Collection stats]: rebuilt {volumes} volume rows, {rebuilt} stats rows, synced {synced} collections')
+
+
+global args
+if __name__ == "__main__":
+    args = load_args()
+    logging.basicConfig(
+        filename='collection_stats.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+from common.db import connect_db, prisma_client
+
+# Fills CurationOffer/CurationExhibit.tokenId and collectionId for the rows
+# written before the observers stored them, with the same sha256 keys as
+# primary_key_of_token/primary_key_of_collection. Updates in chunks so it can
+# run alongside the worker.
+
+CHUNK_SIZE = 1000
+
+FILL_TOKEN_IDS = """
+UPDATE {table} SET
+    tokenId = SHA2(CONCAT(tokenCreator, '::', collection, '::', tokenName), 256),
+    collectionId = SHA2(CONCAT(tokenCreator, '::', collection), 256)
+WHERE tokenId = '' LIMIT {chunk}
+"""
+
+
+async def main():
+    await connect_db()
+
+    for table in ['CurationOffer', 'CurationExhibit']:
+        total = 0
+        while True:
+            filled = await prisma_client.execute_raw(FILL_TOKEN_IDS.format(table=table, chunk=CHUNK_SIZE))
+            total += filled
+            if filled < CHUNK_SIZE:
+                break
+        logging.info(f'[Curation token ids]: {total} {table} rows filled')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='curation_token_ids.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from common.db import connect_db, prisma_client
+from config import config
+
+# Fills GalleryStats for every gallery from its rows, including those of
+# exhibits and offers recorded before it existed. The observers then move the
+# figures by the rows each event changes (see stats/gallery.py); run it with
+# the worker stopped, a delta applied while a gallery is recomputed is lost.
+
+REFRESH_GALLERY_STATS = (
+    "INSERT INTO GalleryStats (root, galleryIndex, listing, frozen, sold, redeemed, pendingOffers, volume, commission) "
+    "SELECT x.root, x.galleryIndex, "
+    "(SELECT COUNT(*) FROM CurationExhibit e WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'listing'), "
+    "(SELECT COUNT(*) FROM CurationExhibit e WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'frozen'), "
+    "(SELECT COUNT(*) FROM CurationExhibit e WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'sold'), "
+    "(SELECT COUNT(*) FROM CurationExhibit e WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'redeemed'), "
+    "(SELECT COUNT(*) FROM CurationOffer o WHERE o.root = x.root AND o.galleryIndex = x.galleryIndex AND o.status = 'pending'), "
+    "CAST((SELECT COALESCE(SUM(CAST(e.price AS DECIMAL(38,0))), 0) FROM CurationExhibit e "
+    "WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'sold') AS CHAR), "
+    # commissionFeeRate is the fee rate times 10^8
+    "CAST((SELECT COALESCE(SUM(FLOOR(CAST(e.price AS DECIMAL(38,0)) * CAST(e.commissionFeeRate AS DECIMAL(38,0)) / 100000000)), 0) "
+    "FROM CurationExhibit e WHERE e.root = x.root AND e.galleryIndex = x.galleryIndex AND e.status = 'sold') AS CHAR) "
+    "FROM ({galleries}) x "
+    "ON DUPLICATE KEY UPDATE listing = VALUES(listing), frozen = VALUES(frozen), sold = VALUES(sold), "
+    "redeemed = VALUES(redeemed), pendingOffers = VALUES(pendingOffers), volume = VALUES(volume), commission = VALUES(commission)")
+
+GALLERIES = """
+SELECT CAST(`index` AS CHAR) AS galleryIndex, root FROM CurationGallery WHERE root = ?
+UNION SELECT galleryIndex, root FROM CurationExhibit WHERE root = ?
+UNION SELECT galleryIndex, root FROM CurationOffer WHERE root = ?
+"""
+
+
+async def main():
+    await connect_db()
+
+    root = config.curation.address()
+    refreshed = await prisma_client.execute_raw(
+        REFRESH_GALLERY_STATS.format(galleries=f'SELECT DISTINCT g.root, g.galleryIndex FROM ({GALLERIES}) g'),
+        root, root, root)
+    logging.info(f'[Gallery stats]: {refreshed} rows written')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='gallery_stats.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,33 @@
+import asyncio
+import logging
+from common.db import connect_db, prisma_client
+
+# Rebuilds OwnerHolding and OwnerPortfolio from AptosToken.owner. Run it with
+# the worker stopped, the observers move the counters from there on.
+
+REBUILD_HOLDINGS = """
+INSERT INTO OwnerHolding (owner, collectionId, count)
+SELECT owner, collectionId, COUNT(*) FROM AptosToken WHERE owner <> '' GROUP BY owner, collectionId
+"""
+
+REBUILD_PORTFOLIOS = """
+INSERT INTO OwnerPortfolio (owner, tokens, collections)
+SELECT owner, SUM(count), SUM(count > 0) FROM OwnerHolding GROUP BY owner
+"""
+
+
+async def main():
+    await connect_db()
+
+    async with prisma_client.tx(timeout=600000) as transaction:
+        await transaction.execute_raw("DELETE FROM OwnerHolding")
+        await transaction.execute_raw("DELETE FROM OwnerPortfolio")
+        holdings = await transaction.execute_raw(REBUILD_HOLDINGS)
+        portfolios = await transaction.execute_raw(REBUILD_PORTFOLIOS)
+    logging.info(f'[Holdings]: {holdings} holdings of {portfolios} owners rebuilt')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='owner_holdings.log', level=logging.INFO)
+    asyncio.run(main())
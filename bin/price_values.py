@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import logging
+from common.currency import CURRENCY_NAME_SQL
+from common.db import connect_db, prisma_client
+
+# Fills the numeric price columns and currency ids of the rows written before
+# the observers stored them. Walks each table by primary key in chunks, each
+# chunk its own short statement, so it can run alongside the worker and be
+# stopped and started again at any time.
+
+CHUNK_SIZE = 2000
+# pause between chunks, leaves room to the worker and the replicas
+PAUSE = 0.05
+
+PRICE_VALUE = "CASE WHEN {column} REGEXP '^[0-9]+$' THEN CAST({column} AS DECIMAL(38,0)) END"
+CURRENCY_ID = "(SELECT c.id FROM Currency c WHERE c.name = " + CURRENCY_NAME_SQL.format(column='r.currency') + ")"
+
+# table, price column, numeric column, has a currency column
+TABLES = [
+    ('AptosOrder', 'price', 'priceValue', True),
+    ('AptosOffer', 'price', 'priceValue', True),
+    ('AptosActivity', 'price', 'priceValue', True),
+    ('CurationExhibit', 'price', 'priceValue', False),
+    ('Collection', 'floorPrice', 'floorPriceValue', False),
+]
+
+REGISTER_CURRENCIES = "INSERT IGNORE INTO Currency (name) SELECT DISTINCT " + \
+    CURRENCY_NAME_SQL.format(column='currency') + " FROM {table}"
+
+
+def load_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Price values backfill',
+        description='Fill the numeric price columns and currency ids of existing rows')
+    parser.add_argument('--table', choices=[table for (table, _, _, _) in TABLES])
+    return parser.parse_args()
+
+
+async def backfill(table: str, price: str, value: str, currency: bool):
+    if currency:
+        registered = await prisma_client.execute_raw(REGISTER_CURRENCIES.format(table=table))
+        logging.info(f'[Price values]: {registered} currencies registered from {table}')
+
+    assignments = f"r.{value} = {PRICE_VALUE.format(column=f'r.{price}')}"
+    if currency:
+        assignments += f", r.currencyId = {CURRENCY_ID}"
+    update = (f"UPDATE {table} r SET {assignments} "
+              f"WHERE r.id > ? AND r.id <= ? AND (r.{value} IS NULL{' OR r.currencyId IS NULL' if currency else ''})")
+
+    last = ''
+    filled = 0
+    while True:
+        rows = await prisma_client.query_raw(
+            f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT {CHUNK_SIZE}", last)
+        if len(rows) == 0:
+            break
+        upper = rows[-1]['id']
+        filled += await prisma_client.execute_raw(update, last, upper)
+        last = upper
+        await asyncio.sleep(PAUSE)
+    logging.info(f'[Price values]: {filled} {table} rows filled')
+
+
+async def main():
+    args = load_args()
+    await connect_db()
+
+    for (table, price, value, currency) in TABLES:
+        if args.table == None or args.table == table:
+            await backfill(table, price, value, currency)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='price_values.log', level=logging.INFO)
+    asyncio.run(main())
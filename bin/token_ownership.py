@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from common.activity import activity_source
+from common.db import connect_db, prisma_client
+from observer.ownership import CLOSE_INTERVALS
+
+# Backfills TokenOwnership from the sales recorded before it existed: an
+# interval per SALE activity (txHash holds the event version), one from
+# version 0 for the holder before the first sale of each token, then closes
+# them in version order. Safe to run again and alongside the worker.
+
+SALE_INTERVALS = """
+INSERT IGNORE INTO TokenOwnership (id, tokenId, collectionId, owner, fromVersion, fromTime)
+SELECT a.id, a.tokenId, a.collectionId, a.`to`, CAST(a.txHash AS UNSIGNED), a.txTimestamp
+FROM {activities} a WHERE a.txType = 'SALE'
+"""
+
+FIRST_INTERVALS = """
+INSERT IGNORE INTO TokenOwnership (id, tokenId, collectionId, owner, fromVersion)
+SELECT SHA2(CONCAT(t.id, '::0'), 256), t.id, t.collectionId, COALESCE(a.`from`, t.owner), 0
+FROM AptosToken t
+LEFT JOIN (
+    SELECT tokenId, MIN(CAST(txHash AS UNSIGNED)) AS version FROM {activities} x WHERE txType = 'SALE' GROUP BY tokenId
+) f ON f.tokenId = t.id
+LEFT JOIN {activities} a ON a.tokenId = t.id AND a.txType = 'SALE' AND CAST(a.txHash AS UNSIGNED) = f.version
+WHERE NOT EXISTS (
+    SELECT 1 FROM TokenOwnership o WHERE o.tokenId = t.id AND (f.version IS NULL OR o.fromVersion < f.version)
+)
+"""
+
+
+async def main():
+    await connect_db()
+
+    sales = await prisma_client.execute_raw(SALE_INTERVALS.format(activities=activity_source()))
+    logging.info(f'[Ownership]: {sales} intervals from sales')
+    first = await prisma_client.execute_raw(FIRST_INTERVALS.format(activities=activity_source()))
+    logging.info(f'[Ownership]: {first} intervals of the first holders')
+    closed = await prisma_client.execute_raw(CLOSE_INTERVALS.format(
+        tokens='SELECT tokenId FROM TokenOwnership WHERE toVersion IS NULL'))
+    logging.info(f'[Ownership]: {closed} intervals closed')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='token_ownership.log', level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+import logging
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from common.currency import APTOS_COIN, currency_name_of
+from common.db import prisma_client
+from model.change import Change
+
+# (price, token id, seller)
+Listing = Tuple[int, str, str]
+
+
+def price_of(listing: Listing) -> int:
+    return listing[0]
+
+
+# Active listings of a collection in one currency sorted by integer price,
+# searched by bisect
+@dataclass
+class ListingBook:
+    collection_id: str
+    currency: str
+    listings: List[Listing] = field(default_factory=list)
+    # price of each listing by (token id, seller), to find it in the sorted list
+    prices: Dict[Tuple[str, str], int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.listings)
+
+    def add(self, token_id: str, seller: str, price: int):
+        self.remove(token_id, seller)
+        insort(self.listings, (price, token_id, seller))
+        self.prices[(token_id, seller)] = price
+
+    def remove(self, token_id: str, seller: str) -> bool:
+        price = self.prices.pop((token_id, seller), None)
+        if price == None:
+            return False
+        del self.listings[bisect_left(self.listings, (price, token_id, seller))]
+        return True
+
+    def floor(self) -> Optional[int]:
+        return self.listings[0][0] if len(self.listings) > 0 else None
+
+    # listings priced at or below `price`
+    def depth(self, price: int) -> int:
+        return bisect_right(self.listings, price, key=price_of)
+
+    def top(self, n: int) -> List[Listing]:
+        return self.listings[:n]
+
+
+# Listing books of every collection and currency, updated from committed
+# list, delist and buy changes and warmed from the listing orders at start.
+# Prices of different coins are not comparable, reads default to APT.
+class ListingBooks:
+
+    def __init__(self) -> None:
+        # books of each collection by normalized currency name
+        self.books: Dict[str, Dict[str, ListingBook]] = {}
+        # chain version of the last change applied, 0 right after load
+        self.version = 0
+
+    def book(self, collection_id: str, currency: str) -> ListingBook:
+        books = self.books.setdefault(collection_id, {})
+        book = books.get(currency)
+        if book == None:
+            book = ListingBook(collection_id, currency)
+            books[currency] = book
+        return book
+
+    # a token listed again in another coin leaves the book of the previous one
+    def add(self, collection_id: str, currency: str, token_id: str, seller: str, price: int):
+        self.remove(collection_id, token_id, seller)
+        self.book(collection_id, currency_name_of(currency)).add(token_id, seller, price)
+
+    def remove(self, collection_id: str, token_id: str, seller: str):
+        for book in self.books.get(collection_id, {}).values():
+            if book.remove(token_id, seller):
+                return
+
+    def apply(self, change: Change):
+        if change.collection_id == None:
+            return
+        if change.type == 'list':
+            self.add(change.collection_id, change.currency or '',
+                     change.token_id, change.source, int(change.price or 0))
+        elif change.type == 'delist' or change.type == 'buy':
+            self.remove(change.collection_id, change.token_id, change.source)
+        else:
+            return
+        self.version = max(self.version, change.version)
+
+    async def load(self):
+        rows = await prisma_client.query_raw(
+            "SELECT collectionId, tokenId, seller, price, currency FROM AptosOrder WHERE status = 'LISTING'")
+        for row in rows:
+            self.add(row['collectionId'], row['currency'] or '',
+                     row['tokenId'], row['seller'], int(row['price'] or 0))
+        logging.info(
+            f'[Listing book]: loaded {len(rows)} listings of {len(self.books)} collections')
+
+    # plain values for book/snapshot.py
+    def dump(self) -> dict:
+        return {
+            'version': self.version,
+            'books': {collection_id: {currency: book.listings for currency, book in books.items()}
+                      for collection_id, books in self.books.items()},
+        }
+
+    def restore(self, dumped: dict):
+        self.version = dumped['version']
+        self.books = {}
+        for collection_id, books in dumped['books'].items():
+            for currency, listings in books.items():
+                book = self.book(collection_id, currency)
+                book.listings = listings
+                book.prices = {(token_id, seller): price for (price, token_id, seller) in listings}
+
+    # reads leave the books of unknown collections and currencies out
+    def floor(self, collection_id: str, currency: str = APTOS_COIN) -> Optional[int]:
+        book = self.books.get(collection_id, {}).get(currency_name_of(currency))
+        return None if book == None else book.floor()
+
+    def depth(self, collection_id: str, price: int, currency: str = APTOS_COIN) -> int:
+        book = self.books.get(collection_id, {}).get(currency_name_of(currency))
+        return 0 if book == None else book.depth(price)
+
+    def top(self, collection_id: str, n: int, currency: str = APTOS_COIN) -> List[Listing]:
+        book = self.books.get(collection_id, {}).get(currency_name_of(currency))
+        return [] if book == None else book.top(n)
+
+    # listings of the collection in every currency
+    def count(self, collection_id: str) -> int:
+        return sum([len(book) for book in self.books.get(collection_id, {}).values()])
+
+
+listing_books = ListingBooks()
@@ -0,0 +1,174 @@
+import heapq
+import logging
+import time
+from bisect import insort
+from dataclasses import astuple, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from common.db import prisma_client
+from model.change import Change
+
+# heaps are rebuilt from the open offers once closed entries outnumber them
+COMPACT_MIN_ENTRIES = 64
+
+
+def microseconds_of(value: str) -> int:
+    return round(datetime.fromisoformat(value).timestamp() * 1000000)
+
+
+@dataclass
+class Offer:
+    id: str
+    token_id: str
+    collection_id: str
+    offerer: str
+    price: int
+    # microseconds
+    opened_at: int
+    ended_at: int
+
+    def expired(self, now: int) -> bool:
+        return self.ended_at <= now
+
+
+# (-price, opened at, offer id), the best bid on top
+Bid = Tuple[int, int, str]
+
+
+# Open offers by price per token and per collection, closed and expired ones
+# are dropped lazily when they reach the top of a heap.
+class OfferBooks:
+
+    def __init__(self) -> None:
+        self.offers: Dict[str, Offer] = {}
+        self.tokens: Dict[str, List[Bid]] = {}
+        self.collections: Dict[str, List[Bid]] = {}
+        # open offers of an offerer on a token, by opened at
+        self.offerers: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        # chain version of the last change applied, 0 right after load
+        self.version = 0
+
+    def add(self, offer: Offer):
+        if offer.id in self.offers:
+            return
+        self.offers[offer.id] = offer
+        bid = (-offer.price, offer.opened_at, offer.id)
+        heapq.heappush(self.tokens.setdefault(offer.token_id, []), bid)
+        heapq.heappush(self.collections.setdefault(offer.collection_id, []), bid)
+        insort(self.offerers.setdefault((offer.token_id, offer.offerer), []),
+               (offer.opened_at, offer.id))
+
+    def close(self, offer_id: str):
+        offer = self.offers.get(offer_id)
+        if offer == None:
+            return
+        self.remove(offer)
+        self.compact(self.tokens, offer.token_id)
+        self.compact(self.collections, offer.collection_id)
+
+    # its bids left in the heaps are dropped when they reach the top
+    def remove(self, offer: Offer):
+        del self.offers[offer.id]
+        key = (offer.token_id, offer.offerer)
+        opened = self.offerers[key]
+        opened.remove((offer.opened_at, offer.id))
+        if len(opened) == 0:
+            del self.offerers[key]
+
+    def compact(self, heaps: Dict[str, List[Bid]], key: str):
+        bids = heaps.get(key)
+        if bids == None or len(bids) < COMPACT_MIN_ENTRIES:
+            return
+        alive = [bid for bid in bids if bid[2] in self.offers]
+        if len(alive) * 2 < len(bids):
+            heapq.heapify(alive)
+            heaps[key] = alive
+
+    # the offer an accept or cancel event of `offerer` refers to: the last
+    # one opened at or before the event, None when it is not in the book
+    def resolve(self, token_id: str, offerer: str, timestamp: int) -> Optional[Offer]:
+        for (opened_at, offer_id) in reversed(self.offerers.get((token_id, offerer), [])):
+            if opened_at <= timestamp:
+                return self.offers[offer_id]
+        return None
+
+    def best(self, heaps: Dict[str, List[Bid]], key: str) -> Optional[Offer]:
+        bids = heaps.get(key)
+        if bids == None:
+            return None
+        now = round(time.time() * 1000000)
+        while len(bids) > 0:
+            offer = self.offers.get(bids[0][2])
+            if offer != None and not offer.expired(now):
+                return offer
+            heapq.heappop(bids)
+            if offer != None:
+                # expired, out of the other heap and the offerer index as well
+                self.remove(offer)
+        del heaps[key]
+        return None
+
+    def best_of_token(self, token_id: str) -> Optional[Offer]:
+        return self.best(self.tokens, token_id)
+
+    def best_of_collection(self, collection_id: str) -> Optional[Offer]:
+        return self.best(self.collections, collection_id)
+
+    def apply(self, change: Change):
+        if change.token_id == None:
+            return
+        if change.type == 'create_offer':
+            self.add(Offer(
+                id=change.event_id,
+                token_id=change.token_id,
+                collection_id=change.collection_id,
+                offerer=change.source,
+                price=int(change.price or 0),
+                opened_at=change.timestamp,
+                ended_at=change.expiration,
+            ))
+        elif change.type == 'cancel_offer' or change.type == 'accept_offer':
+            offerer = change.source if change.type == 'cancel_offer' else change.destination
+            offer = self.resolve(change.token_id, offerer, change.timestamp)
+            if offer != None:
+                self.close(offer.id)
+        else:
+            return
+        self.version = max(self.version, change.version)
+
+    async def load(self):
+        rows = await prisma_client.query_raw(
+            "SELECT id, tokenId, collectionId, offerer, price, CAST(openedAt AS CHAR) AS openedAt, CAST(endedAt AS CHAR) AS endedAt "
+            "FROM AptosOffer WHERE status = 'CREATED' AND endedAt > ?",
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'))
+        for row in rows:
+            self.add(Offer(
+                id=row['id'],
+                token_id=row['tokenId'],
+                collection_id=row['collectionId'],
+                offerer=row['offerer'],
+                price=int(row['price'] or 0),
+                opened_at=microseconds_of(row['openedAt']),
+                ended_at=microseconds_of(row['endedAt']),
+            ))
+        logging.info(f'[Offer book]: loaded {len(rows)} open offers')
+
+    # plain values for book/snapshot.py
+    def dump(self) -> dict:
+        return {
+            'version': self.version,
+            'offers': [astuple(offer) for offer in self.offers.values()],
+            'tokens': self.tokens,
+            'collections': self.collections,
+            'offerers': self.offerers,
+        }
+
+    def restore(self, dumped: dict):
+        self.version = dumped['version']
+        self.offers = {values[0]: Offer(*values) for values in dumped['offers']}
+        self.tokens = dumped['tokens']
+        self.collections = dumped['collections']
+        self.offerers = dumped['offerers']
+
+
+offer_books = OfferBooks()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import mmap
+import os
+import pickle
+import time
+from typing import Dict, List, Optional, Tuple
+from book.listing import listing_books
+from book.offer import offer_books
+from common.progress import OFFSET_FIELDS, PAGE_SIZE
+from config import config
+from model.change import Change
+from model.state import Offset
+from observer.mapping import changes_of_applied
+from scheduler.expiry import expiry_scheduler
+from subject.subject import Subject
+
+# bumped whenever a dumped structure changes shape, older snapshots are ignored
+FORMAT = b'imart-snapshot-2\n'
+SNAPSHOT_INTERVAL = 300
+METRICS_INTERVAL = 60
+
+# stream of each change type the snapshotted structures apply
+SNAPSHOT_FIELDS = {
+    'list': 'list_token_events',
+    'delist': 'delist_token_events',
+    'buy': 'buy_token_events',
+    'create_offer': 'offer_token_events',
+    'cancel_offer': 'cancel_offer_events',
+    'accept_offer': 'accept_offer_events',
+    'exhibit_list': 'exhibit_listed_events',
+    'curation_offer_create': 'offer_created_events',
+}
+# (event handle, subject, observer) of a stream, to replay it
+Replay = Tuple[str, Subject, object]
+
+
+def apply_all(change: Change):
+    listing_books.apply(change)
+    offer_books.apply(change)
+    expiry_scheduler.apply(change)
+
+
+# Periodic snapshots of the listing books, the offer books and the expiry heap
+# in one file, tagged with the seq no of the last event of each stream they
+# reflect. At start the snapshot is mapped and loaded, and only the events
+# after its watermarks, up to the offsets committed in MySQL, are fetched and
+# applied to them in chain version order; without a usable snapshot they are
+# loaded from MySQL as before.
+class IndexSnapshots:
+
+    def __init__(self) -> None:
+        # seq no of the last event of each stream applied to the structures
+        self.watermarks: Dict[str, int] = {}
+        self.written = 0
+        self.failures = 0
+        self.size = 0
+        self.reported_at = time.monotonic()
+
+    def enabled(self) -> bool:
+        return config.snapshot_path != ''
+
+    # the structures were loaded from MySQL at `offset`
+    def start(self, offset: Offset):
+        self.watermarks = {event_field: getattr(offset, OFFSET_FIELDS[event_field])
+                           for event_field in SNAPSHOT_FIELDS.values()}
+
+    def apply(self, change: Change):
+        event_field = SNAPSHOT_FIELDS.get(change.type)
+        if event_field != None:
+            self.watermarks[event_field] = max(change.seqno, self.watermarks.get(event_field, -1))
+
+    # taken between two awaits, the structures and watermarks agree
+    def capture(self) -> bytes:
+        return FORMAT + pickle.dumps({
+            'watermarks': dict(self.watermarks),
+            'listing_books': listing_books.dump(),
+            'offer_books': offer_books.dump(),
+            'expiry': expiry_scheduler.dump(),
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write(self, snapshot: bytes):
+        temporary = f'{config.snapshot_path}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(snapshot)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, config.snapshot_path)
+
+    def read(self) -> Optional[dict]:
+        if not os.path.exists(config.snapshot_path):
+            return None
+        with open(config.snapshot_path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if mapped[:len(FORMAT)] != FORMAT:
+                    logging.warning(f'[Snapshot]: {config.snapshot_path} has another format, ignored')
+                    return None
+                with memoryview(mapped) as view, view[len(FORMAT):] as body:
+                    return pickle.loads(body)
+
+    async def run(self):
+        if not self.enabled():
+            return
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                snapshot = self.capture()
+                await asyncio.to_thread(self.write, snapshot)
+                self.written += 1
+                self.size = len(snapshot)
+            except Exception as err:
+                self.failures += 1
+                logging.error(f'[Snapshot]: Failed to write {config.snapshot_path}: {err}')
+            self.report()
+
+    # True once the structures are restored up to `offset`, False to load them from MySQL
+    async def restore(self, offset: Offset, replays: Dict[str, Replay]) -> bool:
+        if not self.enabled():
+            return False
+        try:
+            snapshot = await asyncio.to_thread(self.read)
+            if snapshot == None:
+                return False
+            watermarks = snapshot['watermarks']
+            for event_field, watermark in watermarks.items():
+                if watermark > getattr(offset, OFFSET_FIELDS[event_field]):
+                    # the snapshot is ahead of MySQL, e.g. after a database restore
+                    logging.warning(f'[Snapshot]: {event_field} at {watermark} is ahead of MySQL, ignored')
+                    return False
+            changes = await self.changes_since(watermarks, offset, replays)
+            listing_books.restore(snapshot['listing_books'])
+            offer_books.restore(snapshot['offer_books'])
+            expiry_scheduler.restore(snapshot['expiry'])
+            self.watermarks = dict(watermarks)
+            for change in changes:
+                apply_all(change)
+                self.apply(change)
+        except Exception as err:
+            logging.error(f'[Snapshot]: Failed to restore {config.snapshot_path}: {err}')
+            # left empty for the load from MySQL
+            listing_books.restore({'version': 0, 'books': {}})
+            offer_books.restore({'version': 0, 'offers': [], 'tokens': {}, 'collections': {}, 'offerers': {}})
+            expiry_scheduler.restore({'deadlines': []})
+            return False
+        logging.info(f'[Snapshot]: restored {config.snapshot_path}, replayed {len(changes)} events')
+        return True
+
+    # changes of the events after the watermarks up to the committed offsets,
+    # in chain version order across streams
+    async def changes_since(self, watermarks: Dict[str, int], offset: Offset,
+                            replays: Dict[str, Replay]) -> List[Change]:
+        changes = []
+        for event_field in set(SNAPSHOT_FIELDS.values()):
+            start = watermarks.get(event_field, -1) + 1
+            end = getattr(offset, OFFSET_FIELDS[event_field])
+            if start > end:
+                continue
+            if event_field not in replays:
+                raise Exception(f'[Snapshot]: {event_field} is behind MySQL but its module is not running')
+            (event_handle, subject, observer) = replays[event_field]
+            while start <= end:
+                events = await subject.get_events(
+                    subject.url(event_handle, event_field, start, min(PAGE_SIZE, end - start + 1)))
+                if len(events) == 0:
+                    raise Exception(f'[Snapshot]: {event_field} events from {start} not found')
+                changes.extend(await changes_of_applied(
+                    observer, [event for event in events if int(event.sequence_number) <= end]))
+                start = int(events[-1].sequence_number) + 1
+        changes.sort(key=lambda change: (change.version, change.seqno))
+        return changes
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Snapshot]: written {self.written} ({self.size} bytes), failures {self.failures}')
+
+
+index_snapshots = IndexSnapshots()
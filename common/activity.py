@@ -0,0 +1,38 @@
+from datetime import datetime
+from typing import Optional
+from config import config
+
+ACTIVITY_TABLE = 'AptosActivity'
+ARCHIVE_TABLE = 'AptosActivityArchive'
+ACTIVITY_COLUMNS = ('id, orderId, collectionId, tokenId, `from`, `to`, txHash, txType, quantity, price, priceValue, '
+                    'currency, currencyId, txTimestamp')
+# both tables, for reads reaching past the retention window
+ALL_ACTIVITY = (f'(SELECT {ACTIVITY_COLUMNS} FROM {ACTIVITY_TABLE} '
+                f'UNION ALL SELECT {ACTIVITY_COLUMNS} FROM {ARCHIVE_TABLE})')
+
+
+# first day of the month `months` after the one of `at`
+def month_of(at: datetime, months: int = 0) -> datetime:
+    month = at.year * 12 + at.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+# monthly partition holding the activities of `month`
+def partition_of(month: datetime) -> str:
+    return month.strftime('p%Y%m')
+
+
+# activities older than this are moved to the archive table, None keeps all
+def retention_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    if config.activity_retention_months == 0:
+        return None
+    return month_of(now or datetime.now(), -config.activity_retention_months)
+
+
+# table to read activities from `since` on (local time, None for all of them)
+# in raw queries, aliased by the caller
+def activity_source(since: Optional[datetime] = None) -> str:
+    cutoff = retention_cutoff()
+    if cutoff == None or (since != None and since >= cutoff):
+        return ACTIVITY_TABLE
+    return ALL_ACTIVITY
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from common.redis import group_by_slot, redis_async
+from config import config
+from model.change import Change
+
+# keys updated within this window are flushed in one pipeline,
+# one DEL per hash slot
+FLUSH_INTERVAL = 0.05
+FLUSH_RETRIES = 5
+RETRY_BACKOFF = 0.1
+METRICS_INTERVAL = 60
+
+# sets the payload unless the cached one carries a newer stamp; stamps only
+# grow within a worker, a newer one was written before a restart by a worker
+# that had committed more than this one has seen yet, and is dropped instead
+# of being kept maybe stale
+WRITE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, cached = pcall(cjson.decode, current)
+    if ok and type(cached) == 'table' and tonumber(cached['version']) and tonumber(cached['version']) > tonumber(ARGV[2]) then
+        redis.call('DEL', KEYS[1])
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+Loader = Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class CacheUpdater:
+
+    def __init__(self) -> None:
+        self.deletes: Set[str] = set()
+        self.writes: Dict[str, Loader] = {}
+        # highest chain version committed by any stream, stamps the payloads
+        self.committed = 0
+        self.wakeup = asyncio.Event()
+        self.requested = 0
+        self.deleted = 0
+        self.written = 0
+        self.stale = 0
+        self.flushes = 0
+        self.retries = 0
+        self.dropped = 0
+        self.reported_at = time.monotonic()
+
+    # called after the transaction is committed, never blocks the event loop
+    def invalidate(self, *keys: str):
+        if len(keys) == 0:
+            return
+        self.requested += len(keys)
+        self.deletes.update(keys)
+        self.wakeup.set()
+
+    def apply(self, change: Change):
+        self.committed = max(self.committed, change.version)
+
+    # Writes the payload of the loader, run at flush time, stamped with the
+    # highest version committed across the streams when it is loaded: the
+    # payload reflects all of them, a lagging stream's write is not refused.
+    # Falls back to delete-on-write in `delete` mode.
+    def refresh(self, key: str, version: int, loader: Loader):
+        self.committed = max(self.committed, version)
+        if config.cache_mode != 'write_through':
+            return self.invalidate(key)
+        self.requested += 1
+        self.writes[key] = loader
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            deletes = self.deletes
+            writes = self.writes
+            self.deletes = set()
+            self.writes = {}
+            await self.flush(deletes, writes)
+            self.report()
+
+    async def load(self, deletes: Set[str], writes: Dict[str, Loader]) -> Dict[str, Tuple[int, str]]:
+        values = {}
+        for key, loader in writes.items():
+            # taken before the load, everything committed up to it is read
+            version = self.committed
+            try:
+                payload = await loader()
+            except Exception as err:
+                logging.warning(f'[Cache]: Failed to load {key}, deleting it: {err}')
+                payload = None
+            if payload == None:
+                deletes.add(key)
+                continue
+            values[key] = (version, json.dumps(
+                {**payload, 'version': version}, default=str))
+        return values
+
+    async def flush(self, deletes: Set[str], writes: Dict[str, Loader]):
+        values = await self.load(deletes, writes)
+        deletes = deletes - values.keys()
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                async with redis_async.pipeline(transaction=False) as pipe:
+                    for slot_keys in group_by_slot(deletes).values():
+                        pipe.delete(*slot_keys)
+                    for key, (version, value) in values.items():
+                        pipe.eval(WRITE_SCRIPT, 1, key, value,
+                                  version, config.cache_ttl)
+                    results = await pipe.execute()
+                written = sum(results[len(results) - len(values):])
+                self.deleted += len(deletes)
+                self.written += written
+                self.stale += len(values) - written
+                self.flushes += 1
+                return
+            except Exception as err:
+                self.retries += 1
+                logging.warning(
+                    f'[Cache]: Failed to update {len(deletes) + len(values)} keys (attempt {attempt + 1}): {err}')
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        self.dropped += len(deletes) + len(values)
+        logging.error(
+            f'[Cache]: Gave up updating keys {deletes | values.keys()}')
+
+    def metrics(self) -> dict:
+        return {
+            'requested': self.requested,
+            'deleted': self.deleted,
+            'written': self.written,
+            'stale': self.stale,
+            'flushes': self.flushes,
+            'retries': self.retries,
+            'dropped': self.dropped,
+            'pending': len(self.deletes) + len(self.writes),
+        }
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(f'[Cache]: {self.metrics()}')
+
+
+cache_updater = CacheUpdater()
@@ -0,0 +1,60 @@
+from decimal import Decimal
+from typing import Dict
+from common.db import prisma_client
+
+# Coin types are spelled with and without the leading zeros of their address
+# (0x1::aptos_coin::AptosCoin, 0x0...01::aptos_coin::AptosCoin), each spelling
+# maps to the id of its normalized name in the Currency table.
+
+APTOS_COIN = '0x1::aptos_coin::AptosCoin'
+
+
+# rows written before coin types were recorded hold '', all of them in APT
+def currency_name_of(currency: str) -> str:
+    if currency == '':
+        return APTOS_COIN
+    address, _, rest = currency.partition('::')
+    return f"0x{address.lower().removeprefix('0x').lstrip('0')}::{rest}"
+
+
+def price_value_of(price: str) -> Decimal:
+    return Decimal(price or 0)
+
+
+# same normalization in SQL for the staged and backfilled rows, '' (or NULL) is APT
+CURRENCY_NAME_SQL = (
+    "IF(COALESCE({column}, '') = '', '" + APTOS_COIN + "', "
+    "CONCAT('0x', TRIM(LEADING '0' FROM IF(LOWER(SUBSTRING_INDEX({column}, '::', 1)) LIKE '0x%', "
+    "SUBSTRING(LOWER(SUBSTRING_INDEX({column}, '::', 1)), 3), LOWER(SUBSTRING_INDEX({column}, '::', 1)))), "
+    "'::', SUBSTRING({column}, LENGTH(SUBSTRING_INDEX({column}, '::', 1)) + 3)))")
+
+# for the statements of a mapping, registers the currencies of the staged rows
+STAGE_CURRENCIES = "INSERT IGNORE INTO Currency (name) SELECT DISTINCT " + \
+    CURRENCY_NAME_SQL.format(column='s.currency') + " FROM {stage} s"
+
+# id of the currency of a staged row, registered by STAGE_CURRENCIES
+STAGED_CURRENCY_ID = "(SELECT c.id FROM Currency c WHERE c.name = " + \
+    CURRENCY_NAME_SQL.format(column='s.currency') + ")"
+
+
+class Currencies:
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+
+    # Registered outside the transaction of the event so an id is only cached
+    # once committed, a currency is never removed.
+    async def id_of(self, currency: str) -> int:
+        name = currency_name_of(currency)
+        id = self.ids.get(name)
+        if id != None:
+            return id
+        await prisma_client.execute_raw("INSERT IGNORE INTO Currency (name) VALUES (?)", name)
+        row = await prisma_client.currency.find_unique(where={'name': name})
+        if row == None:
+            raise Exception(f'[Currency]: Failed to register currency {name}')
+        self.ids[name] = row.id
+        return row.id
+
+
+currencies = Currencies()
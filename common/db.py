@@ -1,6 +1,14 @@
 from prisma import Prisma
+from config import env
 
 prisma_client = Prisma()
 
+# optional read replica, lookups fall back to the primary while it lags behind
+prisma_replica = Prisma(datasource={'url': env['DB_READ_URL']}) \
+    if env.get('DB_READ_URL') else None
+
+
 async def connect_db():
-    await prisma_client.connect()
\ No newline at end of file
+    await prisma_client.connect()
+    if prisma_replica != None:
+        await prisma_replica.connect()
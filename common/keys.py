@@ -0,0 +1,63 @@
+from typing import Optional
+from config import config
+
+# With hash tags every cache key of a collection carries `{collectionId}`,
+# so the keys a sale touches hash to one slot and go out in one command.
+# The API reading these keys has to run with the same schema.
+
+
+def collection_tag(collection_id: str) -> str:
+    return f'{{{collection_id}}}:' if config.redis_hash_tags else ''
+
+
+def order_key(token_id: str, collection_id: str) -> str:
+    return f'cache:imart:{collection_tag(collection_id)}aptosOrder:id:{token_id}'
+
+
+def token_key(token_id: str, collection_id: str) -> str:
+    return f'cache:imart:{collection_tag(collection_id)}aptosToken:id:{token_id}'
+
+
+def collection_stats_key(collection_id: str) -> str:
+    return f'cache:imart:{collection_tag(collection_id)}collectionstats:id:{collection_id}'
+
+
+def gallery_stats_key(gallery_index: str) -> str:
+    return f'cache:imart:gallerystats:id:{gallery_index}'
+
+
+def event_stream_key(module: str) -> str:
+    return f'stream:imart:{module}'
+
+
+# HyperLogLogs of a collection are always tagged, its day buckets are
+# counted together with one PFCOUNT
+def unique_key(collection_id: str, kind: str, day: Optional[str] = None) -> str:
+    key = f'hll:imart:{{{collection_id}}}:{kind}'
+    return key if day == None else f'{key}:d:{day}'
+
+
+# Everything a sale updates shares the tag of its UTC day: the hour and day
+# buckets of the three boards and the events seen that day, so one script
+# applies it atomically and the days spread over the cluster. Windows span
+# several days and are merged by the reader. `bucket` is an hour (h,
+# YYYYMMDDHH) or a day (d, YYYYMMDD).
+def leaderboard_tag(day: str) -> str:
+    return f'{{lb:{day}}}'
+
+
+def leaderboard_key(board: str, granularity: str, bucket: str) -> str:
+    return f'lb:imart:{leaderboard_tag(bucket[:8])}:{board}:{granularity}:{bucket}'
+
+
+def leaderboard_seen_key(day: str) -> str:
+    return f'lb:imart:{leaderboard_tag(day)}:seen'
+
+
+def leaderboard_window_key(board: str, window: str) -> str:
+    return f'lb:imart:{{lb:w}}:{board}:{window}'
+
+
+# kind is user, token or collection
+def activity_feed_key(kind: str, id: str) -> str:
+    return f'feed:imart:{kind}:{id}'
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from common.db import prisma_client
+from common.keys import event_stream_key
+from common.redis import redis_async
+from config import config
+
+RELAY_INTERVAL = 0.5
+RELAY_BATCH_SIZE = 500
+METRICS_INTERVAL = 60
+
+
+def fields_of(row) -> dict:
+    fields = {
+        'eventId': row.eventId,
+        'type': row.type,
+        'version': row.version,
+        'seqno': row.seqno,
+        'tokenId': row.tokenId,
+        'collectionId': row.collectionId,
+        'price': row.price,
+        'currency': row.currency,
+        'source': row.source,
+        'destination': row.destination,
+        'timestamp': row.timestamp,
+        'expiration': row.expiration,
+        'curationIndex': row.curationIndex,
+    }
+    return {name: str(value) for name, value in fields.items() if value != None}
+
+
+# Relays committed changes from EventOutbox to one stream per module.
+# Delivery is at least once, consumers dedupe on `eventId`.
+class OutboxRelay:
+
+    def __init__(self) -> None:
+        self.published = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    async def run(self):
+        while True:
+            try:
+                count = await self.relay()
+            except Exception as err:
+                self.failures += 1
+                count = 0
+                logging.error(f'[Outbox]: Failed to relay changes: {err}')
+            self.report()
+            if count < RELAY_BATCH_SIZE:
+                await asyncio.sleep(RELAY_INTERVAL)
+
+    async def relay(self) -> int:
+        rows = await prisma_client.eventoutbox.find_many(
+            take=RELAY_BATCH_SIZE,
+            order={'id': 'asc'}
+        )
+        if len(rows) == 0:
+            return 0
+        async with redis_async.pipeline(transaction=False) as pipe:
+            for row in rows:
+                pipe.xadd(event_stream_key(row.module), fields_of(row),
+                          maxlen=config.stream_maxlen, approximate=True)
+            await pipe.execute()
+        await prisma_client.eventoutbox.delete_many(
+            where={'id': {'in': [row.id for row in rows]}}
+        )
+        self.published += len(rows)
+        return len(rows)
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Outbox]: published {self.published}, failures {self.failures}')
+
+
+outbox_relay = OutboxRelay()
@@ -0,0 +1,48 @@
+from typing import Optional
+from common.currency import APTOS_COIN, currencies
+from common.db import prisma_client
+from stats.collection import collection_stats
+
+# Payloads written through to the cache after commit, read from the primary
+# so they include the events just committed.
+
+
+async def order_payload(token_id: str) -> Optional[dict]:
+    order = await prisma_client.aptosorder.find_first(
+        where={
+            'tokenId': token_id
+        },
+        order={
+            'createTime': 'desc'
+        }
+    )
+    return None if order == None else order.dict(exclude={'token'})
+
+
+async def token_payload(token_id: str) -> Optional[dict]:
+    token = await prisma_client.aptostoken.find_unique(where={'id': token_id})
+    return None if token == None else token.dict(exclude={'AptosOrder'})
+
+
+async def collection_stats_payload(collection_id: str) -> Optional[dict]:
+    materialized = collection_stats.payload(collection_id)
+    if materialized != None:
+        return materialized
+    # floor in APT as the listing book, listed count over every currency;
+    # rows not backfilled yet have no currency id and are in APT
+    aptos_coin_id = await currencies.id_of(APTOS_COIN)
+    listed = await prisma_client.query_raw(
+        "SELECT CAST(MIN(IF(COALESCE(currencyId, ?) = ?, CAST(price AS DECIMAL(38,0)), NULL)) AS CHAR) AS floor_price, "
+        "COUNT(*) AS listed_count FROM AptosOrder WHERE collectionId = ? AND status = 'LISTING'",
+        aptos_coin_id, aptos_coin_id, collection_id)
+    # volume and sales in APT, as the materialized stats
+    sold = await prisma_client.query_raw(
+        "SELECT CAST(v.volume AS CHAR) AS volume, v.sales FROM CollectionVolume v JOIN Currency c ON c.id = v.currencyId "
+        "WHERE v.collectionId = ? AND c.name = ?", collection_id, APTOS_COIN)
+    return {
+        'id': collection_id,
+        'floor_price': listed[0]['floor_price'] or '0',
+        'listed_count': int(listed[0]['listed_count']),
+        'volume': sold[0]['volume'] if len(sold) > 0 else '0',
+        'sales': int(sold[0]['sales']) if len(sold) > 0 else 0,
+    }
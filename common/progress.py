@@ -0,0 +1,88 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from model.event import Event
+from model.state import Offset
+
+# events per page requested by the subjects
+PAGE_SIZE = 100
+
+# executed offset of each event stream
+OFFSET_FIELDS = {
+    "buy_token_events": 'buy_events_excuted_offset',
+    "list_token_events": 'list_events_excuted_offset',
+    "delist_token_events": 'delist_events_excuted_offset',
+    "offer_token_events": 'create_offer_excuted_offset',
+    "accept_offer_events": 'accept_offer_excuted_offset',
+    "cancel_offer_events": 'cancel_offer_excuted_offset',
+    "create_events": 'create_token_excuted_offset',
+    "gallery_created_events": 'gallery_create_excuted_offset',
+    "offer_created_events": 'curation_offer_create_excuted_offset',
+    "offer_accepted_events": 'curation_offer_accept_excuted_offset',
+    "offer_rejected_events": 'curation_offer_reject_excuted_offset',
+    "offer_canceled_events": 'curation_offer_cancel_excuted_offset',
+    "exhibit_listed_events": 'exhibit_list_excuted_offset',
+    "exhibit_canceled_events": 'exhibit_cancel_excuted_offset',
+    "exhibit_sold_events": 'exhibit_buy_excuted_offset',
+    "exhibit_frozen_events": 'exhibit_freeze_excuted_offset',
+    "exhibit_redeemed_events": 'exhibit_redeem_excuted_offset'
+}
+
+
+@dataclass
+class StreamProgress:
+    # sequence number of the last event applied, -1 before the first one
+    offset: int = -1
+    # chain version of the last event fetched
+    version: Optional[int] = None
+    # events of the last page still being applied
+    pending: int = 0
+    # a page shorter than PAGE_SIZE was fetched, the stream is at the head
+    caught_up: bool = False
+    polled_at: Optional[float] = None
+    caught_up_at: Optional[float] = None
+
+    def payload(self, now: float) -> dict:
+        return {
+            'offset': self.offset,
+            'version': self.version,
+            'pending': self.pending,
+            'caughtUp': self.caught_up,
+            # seconds since the stream was last seen at the head
+            'lag': 0 if self.caught_up else
+            None if self.caught_up_at == None else round(now - self.caught_up_at, 3),
+            'polledAt': self.polled_at,
+        }
+
+
+# Progress of each event stream, recorded by the workers around every page
+class StreamTracker:
+
+    def __init__(self) -> None:
+        self.streams: Dict[str, StreamProgress] = {}
+
+    def stream(self, event_field: str) -> StreamProgress:
+        return self.streams.setdefault(event_field, StreamProgress())
+
+    def fetched(self, event_field: str, events: List[Event]):
+        progress = self.stream(event_field)
+        now = time.time()
+        progress.polled_at = now
+        progress.pending = len(events)
+        progress.caught_up = len(events) < PAGE_SIZE
+        if progress.caught_up:
+            progress.caught_up_at = now
+        if len(events) > 0:
+            progress.version = int(events[-1].version)
+
+    def applied(self, event_field: str, offset: Offset):
+        progress = self.stream(event_field)
+        progress.pending = 0
+        progress.offset = int(getattr(offset, OFFSET_FIELDS[event_field]))
+
+    def payload(self) -> dict:
+        now = time.time()
+        return {event_field: progress.payload(now) for event_field, progress in self.streams.items()}
+
+
+stream_tracker = StreamTracker()
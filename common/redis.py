@@ -1,3 +1,23 @@
+from typing import Dict, Iterable, List
 import redis
+from redis import asyncio as aioredis
+from redis.asyncio.cluster import RedisCluster
+from redis.crc import key_slot
 from config import config
-redis_cli = redis.Redis.from_url(config.redis_url)
+
+# `cluster` for the MemoryDB cluster endpoint, `single` for a local stand-in
+if config.redis_mode == 'cluster':
+    redis_cli = redis.RedisCluster.from_url(config.redis_url)
+    redis_async = RedisCluster.from_url(config.redis_url)
+else:
+    redis_cli = redis.Redis.from_url(config.redis_url)
+    redis_async = aioredis.Redis.from_url(config.redis_url)
+
+
+# Multi-key commands only work on keys of one slot in cluster mode,
+# the groups can be sent as one command each in a single pipeline.
+def group_by_slot(keys: Iterable[str]) -> Dict[int, List[str]]:
+    groups = {}
+    for key in keys:
+        groups.setdefault(key_slot(key.encode('utf-8')), []).append(key)
+    return groups
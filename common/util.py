@@ -12,6 +12,12 @@ def primary_key_of_token(creator, collection, name) -> str:
     return sha256(f'{creator}::{collection}::{name}'.encode('utf-8')).hexdigest()
 
 
+def primary_key_of_event(version, guid, seqno) -> str:
+    if isinstance(guid, dict):
+        guid = f"{guid.get('account_address')}::{guid.get('creation_number')}"
+    return sha256(f'{version}::{guid}::{seqno}'.encode('utf-8')).hexdigest()
+
+
 def new_uuid() -> str:
     return uuid.uuid1().hex
 
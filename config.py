@@ -17,6 +17,9 @@ class EventType:
     def address(self) -> str:
         return self.event_handle.split('::')[0]
 
+    def module(self) -> str:
+        return '::'.join(self.event_handle.split('::')[:2])
+
 @dataclass
 class Config:
     node_url: str
@@ -25,6 +28,23 @@ class Config:
     offer: EventType
     creation: EventType
     curation: EventType
+    redis_mode: str = 'single'
+    redis_hash_tags: bool = False
+    cache_mode: str = 'write_through'
+    cache_ttl: int = 3600
+    stream_maxlen: int = 100000
+    # port of the in-process read API, 0 to disable it
+    read_api_port: int = 0
+    # SQLite journal of the fetched events, '' to apply pages as fetched
+    journal_path: str = ''
+    # megabytes of events journaled ahead of apply before fetching pauses
+    journal_budget: int = 1024
+    # directory of the Parquet event archive, '' to disable it (needs pyarrow)
+    archive_path: str = ''
+    # months of activities kept in AptosActivity, older ones move to AptosActivityArchive (0 keeps all)
+    activity_retention_months: int = 0
+    # snapshot of the listing books, offer books and expiry heap to start from, '' to load them from MySQL
+    snapshot_path: str = ''
 
     def __post_init__(self):
         self.offer = EventType(**self.offer)
@@ -32,6 +52,13 @@ class Config:
         self.fixed_market = EventType(**self.fixed_market)
         self.curation = EventType(**self.curation)
 
+    def module_of(self, event_type: str) -> str:
+        module = '::'.join(event_type.split('::')[:2])
+        for name in ['fixed_market', 'offer', 'creation', 'curation']:
+            if getattr(self, name).module() == module:
+                return name
+        return module
+
     def event_types(self):
         event_types = []
         modules = env['MODUELS'].split(',')
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Tuple
+from common.activity import retention_cutoff
+from common.db import prisma_client
+from common.keys import activity_feed_key
+from common.redis import redis_async
+from model.change import Change
+
+USER = 'user'
+TOKEN = 'token'
+COLLECTION = 'collection'
+
+# latest activities kept per feed
+FEED_SIZE = 100
+# feeds not written or read for this long are dropped, and hydrated again
+FEED_TTL = 7 * 24 * 3600
+FLUSH_INTERVAL = 0.2
+METRICS_INTERVAL = 60
+
+TX_TYPES = {
+    'list': 'LIST',
+    'delist': 'CANCEL',
+    'buy': 'SALE',
+    'accept_offer': 'SALE',
+}
+
+# only feeds already hydrated are pushed to, a cold one is loaded on read
+PUSH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, ARGV[2] - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# fills a cold feed unless a concurrent read hydrated it first
+HYDRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def entry_of_change(change: Change) -> str:
+    return json.dumps({
+        'id': change.event_id,
+        'txType': TX_TYPES[change.type],
+        'tokenId': change.token_id,
+        'collectionId': change.collection_id,
+        'from': change.source or '',
+        'to': change.destination or '',
+        'price': change.price or '0',
+        'currency': change.currency or '',
+        'txHash': f'{change.version}',
+        'timestamp': change.timestamp,
+    })
+
+
+def entry_of_activity(activity) -> str:
+    return json.dumps({
+        'id': activity.id,
+        'txType': activity.txType.value,
+        'tokenId': activity.tokenId,
+        'collectionId': activity.collectionId,
+        'from': activity.source or '',
+        'to': activity.destination or '',
+        'price': activity.price or '0',
+        'currency': activity.currency or '',
+        'txHash': activity.txHash or '',
+        # txTimestamp holds the local time of the event
+        'timestamp': round(activity.txTimestamp.replace(tzinfo=None).timestamp() * 1000000),
+    })
+
+
+def where_of(kind: str, id: str) -> dict:
+    if kind == USER:
+        return {'OR': [{'source': id}, {'destination': id}]}
+    if kind == TOKEN:
+        return {'tokenId': id}
+    return {'collectionId': id}
+
+
+# Latest activities per user address, token and collection as capped Redis
+# lists, pushed on write for the feeds someone read lately.
+class ActivityFeeds:
+
+    def __init__(self) -> None:
+        self.pending: List[Tuple[str, str]] = []
+        self.wakeup = asyncio.Event()
+        self.pushed = 0
+        self.hydrated = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    def apply(self, change: Change):
+        if change.type not in TX_TYPES or change.token_id == None:
+            return
+        entry = entry_of_change(change)
+        keys = [activity_feed_key(TOKEN, change.token_id),
+                activity_feed_key(COLLECTION, change.collection_id)]
+        for address in {change.source, change.destination}:
+            if address != None and address != '':
+                keys.append(activity_feed_key(USER, address))
+        self.pending.extend([(key, entry) for key in keys])
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            pending = self.pending
+            self.pending = []
+            try:
+                await self.flush(pending)
+            except Exception as err:
+                # a feed missing entries is dropped, the next read hydrates it
+                self.failures += 1
+                logging.error(f'[Feed]: Failed to push {len(pending)} activities: {err}')
+                await self.drop({key for (key, _) in pending})
+            self.report()
+
+    async def flush(self, pending: List[Tuple[str, str]]):
+        async with redis_async.pipeline(transaction=False) as pipe:
+            for (key, entry) in pending:
+                pipe.eval(PUSH_SCRIPT, 1, key, entry, FEED_SIZE, FEED_TTL)
+            results = await pipe.execute()
+        self.pushed += sum(results)
+
+    async def drop(self, keys):
+        for key in keys:
+            try:
+                await redis_async.delete(key)
+            except Exception as err:
+                logging.error(f'[Feed]: Failed to drop {key}: {err}')
+
+    # latest `n` (at most FEED_SIZE) activities of a feed, newest first
+    async def read(self, kind: str, id: str, n: int = 20) -> List[Dict]:
+        key = activity_feed_key(kind, id)
+        entries = await redis_async.lrange(key, 0, n - 1)
+        if len(entries) == 0 and not await redis_async.exists(key):
+            entries = await self.hydrate(kind, id)
+            entries = entries[:n]
+        else:
+            await redis_async.expire(key, FEED_TTL)
+        return [json.loads(entry) for entry in entries]
+
+    async def hydrate(self, kind: str, id: str) -> List[str]:
+        activities = await prisma_client.aptosactivity.find_many(
+            where=where_of(kind, id),
+            take=FEED_SIZE,
+            order={'txTimestamp': 'desc'}
+        )
+        # a quiet feed may reach past the retention window
+        if len(activities) < FEED_SIZE and retention_cutoff() != None:
+            activities += await prisma_client.aptosactivityarchive.find_many(
+                where=where_of(kind, id),
+                take=FEED_SIZE - len(activities),
+                order={'txTimestamp': 'desc'}
+            )
+        entries = [entry_of_activity(activity) for activity in activities]
+        if len(entries) > 0:
+            await redis_async.eval(HYDRATE_SCRIPT, 1, activity_feed_key(kind, id), FEED_TTL, *entries)
+            self.hydrated += 1
+        return entries
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Feed]: pushed {self.pushed}, hydrated {self.hydrated}, failures {self.failures}, pending {len(self.pending)}')
+
+
+activity_feeds = ActivityFeeds()
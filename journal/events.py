@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import asdict
+from typing import Dict, List, Optional
+from archive.events import event_archive
+from common.progress import PAGE_SIZE, stream_tracker
+from config import config
+from model.event import Event
+from subject.subject import Subject
+
+# seconds between two polls of a stream at the head, as the workers
+POLL_INTERVAL = 5
+RETRY_BACKOFF = 5
+# events read at once from the archive
+ARCHIVE_PAGE_SIZE = 10000
+# seconds between two compactions of the acknowledged events
+COMPACT_INTERVAL = 60
+METRICS_INTERVAL = 60
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS events (field TEXT NOT NULL, seqno INTEGER NOT NULL, body TEXT NOT NULL, "
+    "PRIMARY KEY (field, seqno)) WITHOUT ROWID",
+    # acknowledgments are seeded from the offsets committed in MySQL, the
+    # table kept by earlier versions is never read
+    "DROP TABLE IF EXISTS acks",
+]
+
+
+# Local append-only journal of the pages fetched from the node, in SQLite.
+# Fetching runs ahead of apply, even while MySQL is down, until the journal
+# reaches its disk budget; apply reads the journal and acknowledges by seq no
+# once the events are committed, and acknowledged events are compacted away.
+# After a restart the events journaled but not applied are replayed from disk.
+class EventJournal:
+
+    def __init__(self) -> None:
+        self.db: Optional[sqlite3.Connection] = None
+        self.lock = asyncio.Lock()
+        # new events journaled per stream, wakes its apply loop
+        self.appended: Dict[str, asyncio.Event] = {}
+        self.acked: Dict[str, int] = {}
+        self.journaled = 0
+        self.served = 0
+        self.compacted = 0
+        self.throttled = 0
+        self.reported_at = time.monotonic()
+
+    def enabled(self) -> bool:
+        return config.journal_path != ''
+
+    async def call(self, fn, *args):
+        async with self.lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def connect(self):
+        db = sqlite3.connect(config.journal_path, check_same_thread=False)
+        # only takes effect on a new file, freed pages are then returned by incremental_vacuum
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.commit()
+        return db
+
+    async def open(self):
+        self.db = await asyncio.to_thread(self.connect)
+        rows = await self.call(lambda: self.db.execute(
+            "SELECT field, COUNT(*) FROM events GROUP BY field").fetchall())
+        for (field, count) in rows:
+            logging.info(f'[Journal]: {count} {field} events to replay')
+
+    def stream(self, event_field: str) -> asyncio.Event:
+        return self.appended.setdefault(event_field, asyncio.Event())
+
+    # live pages, the free ones left by compaction are reused first
+    def size(self) -> int:
+        page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.db.execute("PRAGMA page_count").fetchone()[0]
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free) * page_size
+
+    def head(self, event_field: str) -> Optional[int]:
+        return self.db.execute("SELECT MAX(seqno) FROM events WHERE field = ?", (event_field,)).fetchone()[0]
+
+    def write(self, event_field: str, events: List[Event]):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO events (field, seqno, body) VALUES (?, ?, ?)",
+            [(event_field, int(event.sequence_number), json.dumps(asdict(event))) for event in events])
+        self.db.commit()
+
+    def read(self, event_field: str, start: int, limit: int) -> List[Event]:
+        rows = self.db.execute(
+            "SELECT body FROM events WHERE field = ? AND seqno >= ? ORDER BY seqno LIMIT ?",
+            (event_field, start, limit)).fetchall()
+        return [Event(**json.loads(body)) for (body,) in rows]
+
+    def checkpoint(self, acked: Dict[str, int]) -> int:
+        deleted = 0
+        for event_field, seqno in acked.items():
+            deleted += self.db.execute(
+                "DELETE FROM events WHERE field = ? AND seqno <= ?", (event_field, seqno)).rowcount
+        self.db.commit()
+        self.db.execute("PRAGMA incremental_vacuum")
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    # Fetches the pages of a stream after the last one journaled, or after
+    # the offset committed in MySQL, and journals them before any is applied.
+    async def fill(self, subject: Subject, event_handle: str, event_field: str, offset: int):
+        while True:
+            try:
+                if await self.call(self.size) >= config.journal_budget * 1024 * 1024:
+                    self.throttled += 1
+                    await asyncio.sleep(RETRY_BACKOFF)
+                    continue
+                head = await self.call(self.head, event_field)
+                start = max(offset, self.acked.get(event_field, offset), head if head != None else -1) + 1
+                events = await self.archived(event_field, start)
+                if len(events) > 0:
+                    await self.call(self.write, event_field, events)
+                    self.journaled += len(events)
+                    self.stream(event_field).set()
+                    continue
+                events = await subject.get_events(subject.url(event_handle, event_field, start, PAGE_SIZE))
+                stream_tracker.fetched(event_field, events)
+                if len(events) > 0:
+                    await self.call(self.write, event_field, events)
+                    self.journaled += len(events)
+                    self.stream(event_field).set()
+                if len(events) < PAGE_SIZE:
+                    await asyncio.sleep(POLL_INTERVAL)
+            except Exception as err:
+                logging.error(f'[Journal]: Failed to fetch {event_field}: {err}')
+                await asyncio.sleep(RETRY_BACKOFF)
+
+    # events archived from `start` on without a gap, replayed at disk speed
+    async def archived(self, event_field: str, start: int) -> List[Event]:
+        events = await asyncio.to_thread(event_archive.read, event_field, start, ARCHIVE_PAGE_SIZE)
+        for (i, event) in enumerate(events):
+            if int(event.sequence_number) != start + i:
+                return events[:i]
+        return events
+
+    # next page of journaled events after `offset`, waits for one if none
+    async def next(self, event_field: str, offset: int) -> List[Event]:
+        appended = self.stream(event_field)
+        while True:
+            appended.clear()
+            events = await self.call(self.read, event_field, offset + 1, PAGE_SIZE)
+            if len(events) > 0:
+                self.served += len(events)
+                return events
+            try:
+                await asyncio.wait_for(appended.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def ack(self, event_field: str, offset: int):
+        self.acked[event_field] = max(offset, self.acked.get(event_field, offset))
+
+    async def run(self):
+        if not self.enabled():
+            return
+        while True:
+            await asyncio.sleep(COMPACT_INTERVAL)
+            try:
+                self.compacted += await self.call(self.checkpoint, dict(self.acked))
+            except Exception as err:
+                logging.error(f'[Journal]: Failed to compact: {err}')
+            self.report()
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Journal]: journaled {self.journaled}, served {self.served}, compacted {self.compacted}, throttled {self.throttled}')
+
+
+event_journal = EventJournal()
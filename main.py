@@ -78,6 +78,23 @@ import logging
 from typing import Tuple
 from config import config
 from common.db import connect_db
+from common.cache import cache_updater
+from common.outbox import outbox_relay
+from common.progress import OFFSET_FIELDS, stream_tracker
+from journal.events import event_journal
+from archive.events import event_archive
+from scheduler.partitions import activity_partitions
+from book.snapshot import index_snapshots
+from api.read import read_api
+from model.change import on_change
+from book.listing import listing_books
+from book.offer import offer_books
+from feed.activity import activity_feeds
+from scheduler.expiry import expiry_scheduler
+from stats.collection import collection_stats
+from stats.gallery import gallery_stats_mirror
+from stats.leaderboard import leaderboards
+from stats.uniques import unique_counter
 
 subject_to_observer = {
     "BuyEventSubject": BuyEventObserver(),
@@ -149,7 +166,12 @@ async def worker(state: State, event_type: Tuple[str, str]):
 
     while True:
         events = await fire_events.asend(current_state)
+        stream_tracker.fetched(event_field, events)
         new_state = await process_events.asend(events)
+        stream_tracker.applied(event_field, new_state.new_offset)
+        offset = getattr(new_state.new_offset, OFFSET_FIELDS[event_field])
+        event_archive.append(event_field, [event for event in events if int(event.sequence_number) <= offset],
+                             observer.take_committed())
         current_state = new_state
         await anext(fire_events)
         await anext(process_events)
@@ -158,16 +180,75 @@ async def worker(state: State, event_type: Tuple[str, str]):
         await asyncio.sleep(5)
 
 
+# A worker applying the pages journaled by its fetcher, see journal/events.py
+async def journaled_worker(state: State, event_type: Tuple[str, str]):
+    (event_handle, event_field) = event_type
+    current_state = state
+    subject = event_to_subject[event_field]
+    observer = subject_to_observer[type(subject).__name__]
+    offset = getattr(state.new_offset, OFFSET_FIELDS[event_field])
+    event_journal.ack(event_field, offset)
+
+    fetcher = asyncio.create_task(event_journal.fill(subject, event_handle, event_field, offset))
+    while True:
+        events = await event_journal.next(event_field, offset)
+        current_state = await observer.process_all(current_state, events)
+        stream_tracker.applied(event_field, current_state.new_offset)
+        new_offset = getattr(current_state.new_offset, OFFSET_FIELDS[event_field])
+        event_archive.append(event_field, [event for event in events if int(event.sequence_number) <= new_offset],
+                             observer.take_committed())
+        if new_offset == offset:
+            # nothing applied, the database is likely down
+            await asyncio.sleep(5)
+        offset = new_offset
+        event_journal.ack(event_field, offset)
+
+
 async def main():
     await connect_db()
     # init state with excuted seq no
     state = await initial_state()
-    workers = []
     event_types = config.event_types()
+    # in-memory stats are loaded before any event is applied, the books and
+    # the expiry heap from the last snapshot when there is one
+    replays = {event_field: (event_handle, event_to_subject[event_field],
+                             subject_to_observer[type(event_to_subject[event_field]).__name__])
+               for (event_handle, event_field) in event_types}
+    if not await index_snapshots.restore(state.new_offset, replays):
+        await listing_books.load()
+        await offer_books.load()
+        await expiry_scheduler.load()
+        index_snapshots.start(state.new_offset)
+    await collection_stats.load()
+    on_change(listing_books.apply)
+    on_change(offer_books.apply)
+    on_change(collection_stats.apply)
+    on_change(unique_counter.apply)
+    on_change(leaderboards.apply)
+    on_change(activity_feeds.apply)
+    on_change(expiry_scheduler.apply)
+    on_change(gallery_stats_mirror.apply)
+    on_change(index_snapshots.apply)
+    on_change(cache_updater.apply)
+    # flushes cache updates, relays the change feed of committed events and persists stats
+    workers = [cache_updater.run(), outbox_relay.run(),
+               collection_stats.run(), unique_counter.run(),
+               leaderboards.run(), activity_feeds.run(), expiry_scheduler.run(),
+               gallery_stats_mirror.run(), read_api.run(), activity_partitions.run(), index_snapshots.run()]
+
+    # archives the applied events when an archive path is set
+    event_archive.open()
+    workers.append(event_archive.run())
 
     # allocate one worker per event field
+    if event_journal.enabled():
+        await event_journal.open()
+        workers.append(event_journal.run())
     for event_type in event_types:
-        workers.append(worker(state, event_type))
+        if event_journal.enabled():
+            workers.append(journaled_worker(state, event_type))
+        else:
+            workers.append(worker(state, event_type))
     await asyncio.gather(*workers)
 
 
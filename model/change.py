@@ -0,0 +1,88 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from config import config
+from model.event import Event
+from model.token_id import TokenDataId, TokenId
+from common.util import primary_key_of_collection, primary_key_of_event, primary_key_of_token
+
+
+# Compact record of an applied event, published to the change feed
+@dataclass
+class Change:
+    module: str
+    type: str
+    event_id: str
+    version: int
+    seqno: int
+    token_id: Optional[str] = None
+    collection_id: Optional[str] = None
+    price: Optional[str] = None
+    currency: Optional[str] = None
+    source: Optional[str] = None
+    destination: Optional[str] = None
+    # microseconds, as carried by the market events
+    timestamp: Optional[int] = None
+    # microseconds the offer or exhibit expires at
+    expiration: Optional[int] = None
+    # index of the curation gallery, exhibit or offer
+    curation_index: Optional[int] = None
+
+    def outbox(self) -> dict:
+        return {
+            'eventId': self.event_id,
+            'module': self.module,
+            'type': self.type,
+            'version': self.version,
+            'seqno': self.seqno,
+            'tokenId': self.token_id,
+            'collectionId': self.collection_id,
+            'price': self.price,
+            'currency': self.currency,
+            'source': self.source,
+            'destination': self.destination,
+            'timestamp': self.timestamp,
+            'expiration': self.expiration,
+            'curationIndex': self.curation_index,
+        }
+
+
+# `type` names the event stream the change comes from, e.g. buy, list, accept_offer
+def change_of(event: Event, type: str, **fields) -> Change:
+    return Change(
+        module=config.module_of(event.type),
+        type=type,
+        event_id=primary_key_of_event(
+            event.version, event.guid, event.sequence_number),
+        version=int(event.version),
+        seqno=int(event.sequence_number),
+        **fields
+    )
+
+
+# In-process consumers of committed changes, called in commit order per stream
+change_listeners: List[Callable[[Change], None]] = []
+
+
+def on_change(listener: Callable[[Change], None]):
+    change_listeners.append(listener)
+
+
+def dispatch(changes: List[Change]):
+    for change in changes:
+        for listener in change_listeners:
+            try:
+                listener(change)
+            except Exception as err:
+                logging.error(
+                    f'[Change]: Listener failed on {change.type} event {change.event_id}: {err}')
+
+
+# curation events carry the token id only, its rows derive ids from it
+def token_ids_of(token_id: dict) -> dict:
+    token_data_id = TokenDataId(**TokenId(**token_id).token_data_id)
+    return {
+        'token_id': primary_key_of_token(token_data_id.creator, token_data_id.collection, token_data_id.name),
+        'collection_id': primary_key_of_collection(token_data_id.creator, token_data_id.collection),
+    }
+
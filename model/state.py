@@ -1,5 +1,11 @@
+import logging
+import time
 from dataclasses import dataclass
-from common.db import prisma_client
+from prisma import Prisma
+from common.db import prisma_client, prisma_replica
+
+# seconds between two reads of the offsets replicated to the read replica
+REPLICA_CHECK_INTERVAL = 1
 
 
 @dataclass
@@ -33,6 +39,28 @@ def empty_offset() -> Offset:
     return Offset(-1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1)
 
 
+def offset_of(offset) -> Offset:
+    return Offset(
+        offset.buy_event_excuted_offset,
+        offset.list_event_excuted_offset,
+        offset.delist_event_excuted_offset,
+        offset.create_offer_excuted_offset,
+        offset.accept_offer_excuted_offset,
+        offset.cancel_offer_excuted_offset,
+        offset.create_token_excuted_offset,
+        offset.gallery_create_excuted_offset,
+        offset.exhibit_list_excuted_offset,
+        offset.exhibit_cancel_excuted_offset,
+        offset.exhibit_freeze_excuted_offset,
+        offset.exhibit_redeem_excuted_offset,
+        offset.exhibit_buy_excuted_offset,
+        offset.curation_offer_create_excuted_offset,
+        offset.curation_offer_accept_excuted_offset,
+        offset.curation_offer_reject_excuted_offset,
+        offset.curation_offer_cancel_excuted_offset
+    )
+
+
 async def initial_state() -> State:
     offset = await prisma_client.eventoffset.find_first(where={'id': 0})
     if offset == None:
@@ -59,24 +87,31 @@ async def initial_state() -> State:
             }
         )
         return State(new_offset=empty_offset(), old_offset=empty_offset())
-    new_offset = Offset(
-        offset.buy_event_excuted_offset,
-        offset.list_event_excuted_offset,
-        offset.delist_event_excuted_offset,
-        offset.create_offer_excuted_offset,
-        offset.accept_offer_excuted_offset,
-        offset.cancel_offer_excuted_offset,
-        offset.create_token_excuted_offset,
-        offset.gallery_create_excuted_offset,
-        offset.exhibit_list_excuted_offset,
-        offset.exhibit_cancel_excuted_offset,
-        offset.exhibit_freeze_excuted_offset,
-        offset.exhibit_redeem_excuted_offset,
-        offset.exhibit_buy_excuted_offset,
-        offset.curation_offer_create_excuted_offset,
-        offset.curation_offer_accept_excuted_offset,
-        offset.curation_offer_reject_excuted_offset,
-        offset.curation_offer_cancel_excuted_offset
-    )
+    return State(new_offset=offset_of(offset), old_offset=empty_offset())
+
+
+replica_offset: Offset = None
+replica_checked_at = 0.0
+
+
+# Lookups go to the replica only when it has applied every event this worker
+# committed on the streams the lookup depends on (Offset field names).
+async def read_client(state: State, *depends_on: str) -> Prisma:
+    global replica_offset, replica_checked_at
+    if prisma_replica == None:
+        return prisma_client
+
+    now = time.monotonic()
+    if replica_offset == None or now - replica_checked_at >= REPLICA_CHECK_INTERVAL:
+        try:
+            offset = await prisma_replica.eventoffset.find_first(where={'id': 0})
+        except Exception as err:
+            logging.error(f'[Replica]: Failed to read replicated offset: {err}')
+            return prisma_client
+        replica_offset = empty_offset() if offset == None else offset_of(offset)
+        replica_checked_at = now
 
-    return State(new_offset=new_offset, old_offset=empty_offset())
+    for field in depends_on:
+        if getattr(replica_offset, field) < getattr(state.new_offset, field):
+            return prisma_client
+    return prisma_replica
@@ -1,18 +1,67 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from observer.holding import add_token, staged_moves
+from observer.ownership import record_owner
 from model.creation.create_token_event import CreateTokenEvent, CreateTokenEventData
-from model.state import State
+from model.state import State, read_client
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
-from common.util import primary_key_of_token
+from common.util import primary_key_of_collection, primary_key_of_token
 
 DEFAULT_COLLECTION = "Imart Default Collection"
 DEFAULT_CREATOR = "0x94961b26c3541d4be6638913335da22cf3c45aa3d44ff110d9df8890c0c1a34b"
 DEFAULT_RESOURCE_ACCOUNT = "0xe59d3179e6d4598937a33beb71f811b9bad18af1c253014d6b4945e44f710590"
 
 
-class CreateTokenEventObserver(Observer[CreateTokenEvent]):
+class CreateTokenEventObserver(MappedObserver[CreateTokenEvent]):
+    mapping = Mapping(
+        name='Create token',
+        data=CreateTokenEventData,
+        offset_field='create_token_excuted_offset',
+        state_field='create_token_excuted_offset',
+        columns=[
+            Column('tokenId', 'VARCHAR(64)',
+                   lambda event, data: primary_key_of_token(data.user, DEFAULT_COLLECTION, data.name)),
+            Column('owner', 'VARCHAR(191)', lambda event, data: data.user),
+            Column('creator', 'VARCHAR(191)', lambda event, data: DEFAULT_RESOURCE_ACCOUNT),
+            Column('collection', 'VARCHAR(191)', lambda event, data: DEFAULT_COLLECTION),
+            Column('collectionCreator', 'VARCHAR(191)', lambda event, data: DEFAULT_CREATOR),
+            Column('name', 'VARCHAR(191)', lambda event, data: data.name),
+            Column('description', 'TEXT', lambda event, data: data.description),
+            Column('uri', 'TEXT', lambda event, data: data.uri),
+        ],
+        resolves=[('Collection', "Collection r ON r.chain = 'APTOS' AND r.creator = s.collectionCreator AND r.name = s.collection")],
+        statements=[
+            # counted before the insert, for the tokens not created yet only
+            *staged_moves(
+                "SELECT s.owner AS owner, c.id AS collectionId, 1 AS delta FROM {stage} s "
+                "JOIN Collection c ON c.chain = 'APTOS' AND c.creator = s.collectionCreator AND c.name = s.collection "
+                "WHERE NOT EXISTS (SELECT 1 FROM AptosToken t WHERE t.id = s.tokenId)"),
+            # a replayed page leaves the rows written before as they are, the
+            # owner may have changed since; unlike INSERT IGNORE any other
+            # error still fails the page
+            "INSERT INTO AptosToken (id, collectionId, owner, creator, collection, name, description, uri, propertyVersion, seqno) "
+            "SELECT s.tokenId, c.id, s.owner, s.creator, s.collection, s.name, s.description, s.uri, '0', s.seqno FROM {stage} s "
+            "JOIN Collection c ON c.chain = 'APTOS' AND c.creator = s.collectionCreator AND c.name = s.collection "
+            "ON DUPLICATE KEY UPDATE id = id",
+            "INSERT INTO TokenOwnership (id, tokenId, collectionId, owner, fromVersion) "
+            "SELECT s.id, s.tokenId, c.id, s.owner, CAST(s.version AS UNSIGNED) FROM {stage} s "
+            "JOIN Collection c ON c.chain = 'APTOS' AND c.creator = s.collectionCreator AND c.name = s.collection "
+            "ON DUPLICATE KEY UPDATE id = id",
+        ]
+    )
+
+    def change(self, event: Event[CreateTokenEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = CreateTokenEventData(**event.data)
+        return change_of(
+            event,
+            'create_token',
+            token_id=primary_key_of_token(data.user, DEFAULT_COLLECTION, data.name),
+            collection_id=collection_id or primary_key_of_collection(DEFAULT_CREATOR, DEFAULT_COLLECTION),
+            destination=data.user
+        )
 
     async def process_all(self, state: State, events: List[Event[CreateTokenEvent]]) -> State:
         return await super().process_all(state, events)
@@ -22,7 +71,8 @@ class CreateTokenEventObserver(Observer[CreateTokenEvent]):
         seqno = event.sequence_number
         data = CreateTokenEventData(**event.data)
 
-        collection = await prisma_client.collection.find_unique(where={
+        reader = await read_client(state)
+        collection = await reader.collection.find_unique(where={
             'chain_creator_name': {
                 'chain': enums.Chain.APTOS,
                 'creator': DEFAULT_CREATOR,
@@ -35,24 +85,41 @@ class CreateTokenEventObserver(Observer[CreateTokenEvent]):
 
         async with prisma_client.tx(timeout=60000) as transaction:
 
-            result = await transaction.aptostoken.create(
+            # the owner may have changed since, a replayed create event must not reset it
+            tokenId = primary_key_of_token(data.user, DEFAULT_COLLECTION, data.name)
+            existing = await transaction.aptostoken.find_unique(where={'id': tokenId})
+            if existing == None:
+                await add_token(transaction, collection.id, data.user)
+            result = await transaction.aptostoken.upsert(
+                where={
+                    'id': tokenId
+                },
                 data={
-                    'id': primary_key_of_token(data.user, DEFAULT_COLLECTION, data.name),
-                    'collectionId': collection.id,
-                    'owner': data.user,
-                    'creator': DEFAULT_RESOURCE_ACCOUNT,
-                    'collection': DEFAULT_COLLECTION,
-                    'name': data.name,
-                    'description': data.description,
-                    'uri': data.uri,
-                    'propertyVersion': '0',
-                    'seqno': seqno
+                    'create': {
+                        'id': tokenId,
+                        'collectionId': collection.id,
+                        'owner': data.user,
+                        'creator': DEFAULT_RESOURCE_ACCOUNT,
+                        'collection': DEFAULT_COLLECTION,
+                        'name': data.name,
+                        'description': data.description,
+                        'uri': data.uri,
+                        'propertyVersion': '0',
+                        'seqno': seqno
+                    },
+                    'update': {}
                 }
             )
             if result == None:
                 raise Exception(
                     f'[Create token]: Failed to create new token({data})')
 
+            # ownership history, create events carry no timestamp
+            await record_owner(transaction, event, tokenId, collection.id, data.user)
+
+            # change feed
+            await self.publish(transaction, [self.change(event, tokenId, collection.id)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,14 +1,43 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import move_gallery_stats, move_staged_status
 from model.curation.exhibit_buy_event import ExhibitBuyEvent, ExhibitBuyEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from config import config
 
 
-class ExhibitBuyEventObserver(Observer[ExhibitBuyEvent]):
+class ExhibitBuyEventObserver(MappedObserver[ExhibitBuyEvent]):
+    mapping = Mapping(
+        name='Visitor buy exhibit',
+        data=ExhibitBuyEventData,
+        offset_field='exhibit_buy_excuted_offset',
+        state_field='exhibit_buy_excuted_offset',
+        columns=[
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+        ],
+        resolves=[('Exhibit', 'CurationExhibit r ON r.`index` = s.`index` AND r.root = s.root')],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_status('CurationExhibit', 'sold'),
+            "UPDATE CurationExhibit r JOIN {stage} s ON r.`index` = s.`index` AND r.root = s.root SET r.status = 'sold'",
+        ]
+    )
+
+    def change(self, event: Event[ExhibitBuyEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = ExhibitBuyEventData(**event.data)
+        return change_of(
+            event,
+            'exhibit_buy',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            price=data.price,
+            source=data.origin
+        )
 
     async def process_all(self, state: State, events: List[Event[ExhibitBuyEvent]]) -> State:
         return await super().process_all(state, events)
@@ -19,6 +48,14 @@ class ExhibitBuyEventObserver(Observer[ExhibitBuyEvent]):
         data = ExhibitBuyEventData(**event.data)
 
         async with prisma_client.tx(timeout=60000) as transaction:
+            existing = await transaction.curationexhibit.find_unique(
+                where={
+                    'index_root': {
+                        'index': int(data.id),
+                        'root': config.curation.address()
+                    }
+                }
+            )
             result = await transaction.curationexhibit.update(
                 where={
                     'index_root': {
@@ -34,6 +71,12 @@ class ExhibitBuyEventObserver(Observer[ExhibitBuyEvent]):
                 raise Exception(
                     f'[Visitor buy exhibit]: Failed to buy exhibit({data})')
 
+            # gallery stats
+            await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
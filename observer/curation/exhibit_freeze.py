@@ -1,14 +1,42 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import move_gallery_stats, move_staged_status
 from model.curation.exhibit_freeze_event import ExhibitFreezeEvent, ExhibitFreezeEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from config import config
 
 
-class ExhibitFreezeEventObserver(Observer[ExhibitFreezeEvent]):
+class ExhibitFreezeEventObserver(MappedObserver[ExhibitFreezeEvent]):
+    mapping = Mapping(
+        name='System freeze exhibit',
+        data=ExhibitFreezeEventData,
+        offset_field='exhibit_freeze_excuted_offset',
+        state_field='exhibit_freeze_excuted_offset',
+        columns=[
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+        ],
+        resolves=[('Exhibit', 'CurationExhibit r ON r.`index` = s.`index` AND r.root = s.root')],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_status('CurationExhibit', 'frozen'),
+            "UPDATE CurationExhibit r JOIN {stage} s ON r.`index` = s.`index` AND r.root = s.root SET r.status = 'frozen'",
+        ]
+    )
+
+    def change(self, event: Event[ExhibitFreezeEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = ExhibitFreezeEventData(**event.data)
+        return change_of(
+            event,
+            'exhibit_freeze',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            source=data.origin
+        )
 
     async def process_all(self, state: State, events: List[Event[ExhibitFreezeEvent]]) -> State:
         return await super().process_all(state, events)
@@ -19,6 +47,14 @@ class ExhibitFreezeEventObserver(Observer[ExhibitFreezeEvent]):
         data = ExhibitFreezeEventData(**event.data)
 
         async with prisma_client.tx(timeout=60000) as transaction:
+            existing = await transaction.curationexhibit.find_unique(
+                where={
+                    'index_root': {
+                        'index': int(data.id),
+                        'root': config.curation.address()
+                    }
+                }
+            )
             result = await transaction.curationexhibit.update(
                 where={
                     'index_root': {
@@ -34,6 +70,12 @@ class ExhibitFreezeEventObserver(Observer[ExhibitFreezeEvent]):
                 raise Exception(
                     f'[System freeze exhibit]: Failed to freeze exhibit({data})')
 
+            # gallery stats
+            await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,17 +1,79 @@
 from datetime import datetime
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of, newer_event_updates, token_data_id_of
+from stats.gallery import move_gallery_stats, move_staged_writes
 from model.curation.exhibit_list_event import ExhibitListEvent, ExhibitListEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from model.token_id import TokenDataId, TokenId
 from common.db import prisma_client
 from prisma import enums
 from config import config
 from common.util import new_uuid
+from common.currency import price_value_of
 
 
-class ExhibitListEventObserver(Observer[ExhibitListEvent]):
+class ExhibitListEventObserver(MappedObserver[ExhibitListEvent]):
+    mapping = Mapping(
+        name='Curator list exhibit',
+        data=ExhibitListEventData,
+        offset_field='exhibit_list_excuted_offset',
+        state_field='exhibit_list_excuted_offset',
+        columns=[
+            Column('uuid', 'VARCHAR(64)', lambda event, data: new_uuid()),
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+            Column('galleryIndex', 'VARCHAR(191)', lambda event, data: data.gallery_id),
+            Column('collection', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).collection),
+            Column('tokenCreator', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).creator),
+            Column('tokenName', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).name),
+            Column('tokenId', 'VARCHAR(64)', lambda event, data: token_ids_of(data.token_id)['token_id']),
+            Column('collectionId', 'VARCHAR(64)', lambda event, data: token_ids_of(data.token_id)['collection_id']),
+            Column('propertyVersion', 'INT',
+                   lambda event, data: int(TokenId(**data.token_id).property_version)),
+            Column('origin', 'VARCHAR(191)', lambda event, data: data.origin),
+            Column('price', 'VARCHAR(191)', lambda event, data: data.price),
+            Column('commissionFeeRate', 'VARCHAR(191)',
+                   lambda event, data: str(10**8 * int(data.commission_feerate_numerator) //
+                                           int(data.commission_feerate_denominator))),
+            Column('expiredAt', 'DATETIME(6)',
+                   lambda event, data: datetime_of(int(data.expiration) * 1000000)),
+            Column('location', 'VARCHAR(191)', lambda event, data: data.location),
+            Column('url', 'VARCHAR(191)', lambda event, data: event.data.get('url', '')),
+            Column('detail', 'VARCHAR(191)', lambda event, data: event.data.get('detail', '')),
+        ],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_writes('CurationExhibit', 'listing', ('s.galleryIndex', 's.price', 's.commissionFeeRate')),
+            # an exhibit is listed again after a cancel, a replayed event leaves it as it is
+            "INSERT INTO CurationExhibit (id, `index`, root, galleryIndex, collection, tokenCreator, tokenName, tokenId, collectionId, "
+            "provertyVersion, origin, price, priceValue, commissionFeeRate, expiredAt, location, url, detail, status, eventVersion) "
+            "SELECT s.uuid, s.`index`, s.root, s.galleryIndex, s.collection, s.tokenCreator, s.tokenName, s.tokenId, s.collectionId, "
+            "s.propertyVersion, s.origin, s.price, CAST(s.price AS DECIMAL(38,0)), s.commissionFeeRate, s.expiredAt, s.location, s.url, s.detail, 'listing', "
+            "CAST(s.version AS UNSIGNED) "
+            "FROM {stage} s ORDER BY s.seqno " + newer_event_updates([
+                ('galleryIndex', 's.galleryIndex'), ('collection', 's.collection'), ('tokenCreator', 's.tokenCreator'),
+                ('tokenName', 's.tokenName'), ('tokenId', 's.tokenId'), ('collectionId', 's.collectionId'),
+                ('provertyVersion', 's.propertyVersion'), ('origin', 's.origin'), ('price', 's.price'),
+                ('priceValue', 'CAST(s.price AS DECIMAL(38,0))'), ('commissionFeeRate', 's.commissionFeeRate'),
+                ('expiredAt', 's.expiredAt'), ('location', 's.location'), ('url', 's.url'), ('detail', 's.detail'),
+                ('status', "'listing'"),
+            ]),
+        ]
+    )
+
+    def change(self, event: Event[ExhibitListEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = ExhibitListEventData(**event.data)
+        return change_of(
+            event,
+            'exhibit_list',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            price=data.price,
+            source=data.origin,
+            expiration=int(data.expiration) * 1000000
+        )
 
     async def process_all(self, state: State, events: List[Event[ExhibitListEvent]]) -> State:
         return await super().process_all(state, events)
@@ -23,59 +85,63 @@ class ExhibitListEventObserver(Observer[ExhibitListEvent]):
         index = int(data.id)
         token_id = TokenId(**data.token_id)
         token_data_id = TokenDataId(**token_id.token_data_id)
-        expired_at = datetime.timestamp(data.expiration)
+        token_ids = token_ids_of(data.token_id)
+        expired_at = datetime.fromtimestamp(int(data.expiration))
         commission_feerate = str(10**8 *
                                  int(data.commission_feerate_numerator) //
                                  int(data.commission_feerate_denominator))
 
+        where = {
+            'index_root': {
+                'index': index,
+                'root': config.curation.address()
+            }
+        }
+        exhibit = {
+            'galleryIndex': data.gallery_id,
+            'collection': token_data_id.collection,
+            'tokenName': token_data_id.name,
+            'tokenCreator': token_data_id.creator,
+            'tokenId': token_ids['token_id'],
+            'collectionId': token_ids['collection_id'],
+            'provertyVersion': int(token_id.property_version),
+            'origin': data.origin,
+            'price': data.price,
+            'priceValue': price_value_of(data.price),
+            'commissionFeeRate': commission_feerate,
+            'expiredAt': expired_at,
+            'location': data.location,
+            'url': event.data.get('url', ''),
+            'detail': event.data.get('detail', ''),
+            'status': enums.CurationExhibitStatus.listing,
+            'eventVersion': int(event.version)
+        }
+
         async with prisma_client.tx(timeout=60000) as transaction:
-            result = await transaction.curationexhibit.upsert(
-                where={
-                    'index_root': {
-                        'index': index,
-                        'root': config.curation.address()
-                    }
-                },
-                data={
-                    'create': {
-                        'id': new_uuid(),
-                        'index': index,
-                        'root': config.curation.address(),
-                        'galleryIndex': data.gallery_id,
-                        'collection': token_data_id.collection,
-                        'tokenName': token_data_id.name,
-                        'tokenCreator': token_data_id.creator,
-                        'propertyVersion': int(token_id.property_version),
-                        'origin': data.origin,
-                        'price': data.price,
-                        'commissionFeeRate': commission_feerate,
-                        'expiredAt': expired_at,
-                        'location': data.location,
-                        'url': data.url,
-                        'detail': data.detail,
-                        'status': enums.CurationExhibitStatus.listing
-                    },
-                    'update': {
-                        'galleryIndex': data.gallery_id,
-                        'collection': token_data_id.collection,
-                        'tokenName': token_data_id.name,
-                        'tokenCreator': token_data_id.creator,
-                        'propertyVersion': int(token_id.property_version),
-                        'origin': data.origin,
-                        'price': data.price,
-                        'commissionFeeRate': commission_feerate,
-                        'expiredAt': expired_at,
-                        'location': data.location,
-                        'url': data.url,
-                        'detail': data.detail,
-                        'status': enums.CurationExhibitStatus.listing
-                    }
-                }
-            )
-            if result == None or result.status != enums.CurationExhibitStatus.listing:
+            # an exhibit is listed again after a cancel, a replayed event leaves it as it is
+            existing = await transaction.curationexhibit.find_unique(where=where)
+            if existing == None:
+                result = await transaction.curationexhibit.create(data={
+                    'id': new_uuid(),
+                    'index': index,
+                    'root': config.curation.address(),
+                    **exhibit
+                })
+            elif int(event.version) > existing.eventVersion:
+                result = await transaction.curationexhibit.update(where=where, data=exhibit)
+            else:
+                result = existing
+            if result == None:
                 raise Exception(
                     f'[Curator list exhibit]: Failed to list exhibit({data})')
 
+            # gallery stats
+            if result != existing:
+                await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,13 +1,41 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import move_gallery_stats, move_staged_status
 from model.curation.exhibit_redeem_event import ExhibitRedeemEvent, ExhibitRedeemEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from config import config
 
-class ExhibitRedeemEventObserver(Observer[ExhibitRedeemEvent]):
+class ExhibitRedeemEventObserver(MappedObserver[ExhibitRedeemEvent]):
+    mapping = Mapping(
+        name='Owner redeem exhibit',
+        data=ExhibitRedeemEventData,
+        offset_field='exhibit_redeem_excuted_offset',
+        state_field='exhibit_redeem_excuted_offset',
+        columns=[
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+        ],
+        resolves=[('Exhibit', 'CurationExhibit r ON r.`index` = s.`index` AND r.root = s.root')],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_status('CurationExhibit', 'redeemed'),
+            "UPDATE CurationExhibit r JOIN {stage} s ON r.`index` = s.`index` AND r.root = s.root SET r.status = 'redeemed'",
+        ]
+    )
+
+    def change(self, event: Event[ExhibitRedeemEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = ExhibitRedeemEventData(**event.data)
+        return change_of(
+            event,
+            'exhibit_redeem',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            source=data.origin
+        )
 
     async def process_all(self, state: State, events: List[Event[ExhibitRedeemEvent]]) -> State:
         return await super().process_all(state, events)
@@ -18,6 +46,14 @@ class ExhibitRedeemEventObserver(Observer[ExhibitRedeemEvent]):
         data = ExhibitRedeemEventData(**event.data)
 
         async with prisma_client.tx(timeout=60000) as transaction:
+            existing = await transaction.curationexhibit.find_unique(
+                where={
+                    'index_root': {
+                        'index': int(data.id),
+                        'root': config.curation.address()
+                    }
+                }
+            )
             result = await transaction.curationexhibit.update(
                 where={
                     'index_root': {
@@ -33,6 +69,12 @@ class ExhibitRedeemEventObserver(Observer[ExhibitRedeemEvent]):
                 raise Exception(
                     f'[Owner redeem exhibit]: Failed to redeem exhibit({data})')
 
+            # gallery stats
+            await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,14 +1,46 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import ADD_STAGED_GALLERIES, add_gallery
 from model.curation.gallery_create_event import GalleryCreateEvent, GalleryCreateEventData
 from model.state import State
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
 from config import config
 from common.util import new_uuid
 
 
-class GalleryCreateEventObserver(Observer[GalleryCreateEvent]):
+class GalleryCreateEventObserver(MappedObserver[GalleryCreateEvent]):
+    mapping = Mapping(
+        name='Curator create gallery',
+        data=GalleryCreateEventData,
+        offset_field='gallery_create_excuted_offset',
+        state_field='gallery_create_excuted_offset',
+        columns=[
+            Column('uuid', 'VARCHAR(64)', lambda event, data: new_uuid()),
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+            Column('name', 'VARCHAR(191)', lambda event, data: data.name),
+            Column('owner', 'VARCHAR(191)', lambda event, data: data.owner),
+            Column('spaceType', 'VARCHAR(191)', lambda event, data: data.space_type),
+            Column('metadataUri', 'VARCHAR(191)', lambda event, data: data.metadata_uri),
+        ],
+        statements=[
+            "INSERT INTO CurationGallery (id, `index`, root, name, owner, spaceType, metadataUri) "
+            "SELECT s.uuid, s.`index`, s.root, s.name, s.owner, s.spaceType, s.metadataUri FROM {stage} s ORDER BY s.seqno "
+            "ON DUPLICATE KEY UPDATE name = s.name, owner = s.owner, spaceType = s.spaceType, metadataUri = s.metadataUri",
+            ADD_STAGED_GALLERIES,
+        ]
+    )
+
+    def change(self, event: Event[GalleryCreateEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = GalleryCreateEventData(**event.data)
+        return change_of(
+            event,
+            'gallery_create',
+            curation_index=int(data.id),
+            source=data.owner
+        )
 
     async def process_all(self, state: State, events: List[Event[GalleryCreateEvent]]) -> State:
         return await super().process_all(state, events)
@@ -48,6 +80,12 @@ class GalleryCreateEventObserver(Observer[GalleryCreateEvent]):
                 raise Exception(
                     f'[Curator create gallery]: Failed to create gallery({data})')
 
+            # gallery stats
+            await add_gallery(transaction, index)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
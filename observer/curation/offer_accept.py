@@ -1,14 +1,44 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import move_gallery_stats, move_staged_status
 from model.curation.offer_accept_event import OfferAcceptEvent, OfferAcceptEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from config import config
 
 
-class OfferAcceptEventObserver(Observer[OfferAcceptEvent]):
+class OfferAcceptEventObserver(MappedObserver[OfferAcceptEvent]):
+    mapping = Mapping(
+        name='Invitee accept offer',
+        data=OfferAcceptEventData,
+        offset_field='curation_offer_accept_excuted_offset',
+        state_field='curation_offer_accept_excuted_offset',
+        columns=[
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+        ],
+        resolves=[('Offer', 'CurationOffer r ON r.`index` = s.`index` AND r.root = s.root')],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_status('CurationOffer', 'accepted'),
+            "UPDATE CurationOffer r JOIN {stage} s ON r.`index` = s.`index` AND r.root = s.root SET r.status = 'accepted'",
+        ]
+    )
+
+    def change(self, event: Event[OfferAcceptEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = OfferAcceptEventData(**event.data)
+        return change_of(
+            event,
+            'curation_offer_accept',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            price=data.price,
+            source=data.source,
+            destination=data.destination
+        )
 
     async def process_all(self, state: State, events: List[Event[OfferAcceptEvent]]) -> State:
         return await super().process_all(state, events)
@@ -19,6 +49,14 @@ class OfferAcceptEventObserver(Observer[OfferAcceptEvent]):
         data = OfferAcceptEventData(**event.data)
 
         async with prisma_client.tx(timeout=60000) as transaction:
+            existing = await transaction.curationoffer.find_unique(
+                where={
+                    'index_root': {
+                        'index': int(data.id),
+                        'root': config.curation.address()
+                    }
+                }
+            )
             result = await transaction.curationoffer.update(
                 where={
                     'index_root': {
@@ -34,6 +72,12 @@ class OfferAcceptEventObserver(Observer[OfferAcceptEvent]):
                 raise Exception(
                     f'[Invitee accept offer]: Failed to accept curation offer({data})')
 
+            # gallery stats
+            await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,13 +1,42 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver
+from stats.gallery import move_gallery_stats, move_staged_status
 from model.curation.offer_cancel_event import OfferCancelEvent, OfferCancelEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from config import config
 
-class OfferCancelEventObserver(Observer[OfferCancelEvent]):
+class OfferCancelEventObserver(MappedObserver[OfferCancelEvent]):
+    mapping = Mapping(
+        name='Curator cancel offer',
+        data=OfferCancelEventData,
+        offset_field='curation_offer_cancel_excuted_offset',
+        state_field='curation_offer_cancel_excuted_offset',
+        columns=[
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+        ],
+        resolves=[('Offer', 'CurationOffer r ON r.`index` = s.`index` AND r.root = s.root')],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_status('CurationOffer', 'canceled'),
+            "UPDATE CurationOffer r JOIN {stage} s ON r.`index` = s.`index` AND r.root = s.root SET r.status = 'canceled'",
+        ]
+    )
+
+    def change(self, event: Event[OfferCancelEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = OfferCancelEventData(**event.data)
+        return change_of(
+            event,
+            'curation_offer_cancel',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            source=data.source,
+            destination=data.destination
+        )
 
     async def process_all(self, state: State, events: List[Event[OfferCancelEvent]]) -> State:
         return await super().process_all(state, events)
@@ -18,6 +47,14 @@ class OfferCancelEventObserver(Observer[OfferCancelEvent]):
         data = OfferCancelEventData(**event.data)
 
         async with prisma_client.tx(timeout=60000) as transaction:
+            existing = await transaction.curationoffer.find_unique(
+                where={
+                    'index_root': {
+                        'index': int(data.id),
+                        'root': config.curation.address()
+                    }
+                }
+            )
             result = await transaction.curationoffer.update(
                 where={
                     'index_root': {
@@ -33,6 +70,12 @@ class OfferCancelEventObserver(Observer[OfferCancelEvent]):
                 raise Exception(
                     f'[Curator cancel offer]: Failed to cancel curation offer({data})')
 
+            # gallery stats
+            await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,7 +1,9 @@
-from typing import List, Tuple
-from observer.observer import Observer
+from typing import List, Optional, Tuple
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of, newer_event_updates, token_data_id_of
+from stats.gallery import move_gallery_stats, move_staged_writes
 from model.curation.offer_create_event import OfferCreateEvent, OfferCreateEventData
 from model.state import State
+from model.change import Change, change_of, token_ids_of
 from model.event import Event
 from model.token_id import TokenDataId, TokenId
 from common.db import prisma_client
@@ -11,7 +13,65 @@ from common.util import new_uuid
 from config import config
 
 
-class OfferCreateEventObserver(Observer[OfferCreateEvent]):
+class OfferCreateEventObserver(MappedObserver[OfferCreateEvent]):
+    mapping = Mapping(
+        name='Curator send offer',
+        data=OfferCreateEventData,
+        offset_field='curation_offer_create_excuted_offset',
+        state_field='curation_offer_create_excuted_offset',
+        columns=[
+            Column('uuid', 'VARCHAR(64)', lambda event, data: new_uuid()),
+            Column('index', 'BIGINT', lambda event, data: int(data.id)),
+            Column('root', 'VARCHAR(191)', lambda event, data: config.curation.address()),
+            Column('galleryIndex', 'VARCHAR(191)', lambda event, data: data.gallery_id),
+            Column('collection', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).collection),
+            Column('tokenCreator', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).creator),
+            Column('tokenName', 'VARCHAR(191)', lambda event, data: token_data_id_of(data).name),
+            Column('tokenId', 'VARCHAR(64)', lambda event, data: token_ids_of(data.token_id)['token_id']),
+            Column('collectionId', 'VARCHAR(64)', lambda event, data: token_ids_of(data.token_id)['collection_id']),
+            Column('source', 'VARCHAR(191)', lambda event, data: data.source),
+            Column('destination', 'VARCHAR(191)', lambda event, data: data.destination),
+            Column('price', 'VARCHAR(191)', lambda event, data: data.price),
+            Column('commissionFeeRate', 'VARCHAR(191)',
+                   lambda event, data: str(10**8 * int(data.commission_feerate_numerator) //
+                                           int(data.commission_feerate_denominator))),
+            Column('offerStartAt', 'DATETIME(6)',
+                   lambda event, data: datetime_of(int(data.offer_start_at) * 1000000)),
+            Column('offerExpiredAt', 'DATETIME(6)',
+                   lambda event, data: datetime_of(int(data.offer_expired_at) * 1000000)),
+            Column('exhibitDuration', 'INT', lambda event, data: int(data.exhibit_duration)),
+        ],
+        latest_by=lambda event, data: int(data.id),
+        statements=[
+            move_staged_writes('CurationOffer', 'pending', ('s.galleryIndex', 's.price', 's.commissionFeeRate')),
+            # an offer is sent again under the same index, a replayed event leaves it as it is
+            "INSERT INTO CurationOffer (id, `index`, root, galleryIndex, collection, tokenCreator, tokenName, tokenId, collectionId, "
+            "propertyVersion, `from`, `to`, price, commissionFeeRate, offerStartAt, offerExpiredAt, exhibitDuration, status, eventVersion) "
+            "SELECT s.uuid, s.`index`, s.root, s.galleryIndex, s.collection, s.tokenCreator, s.tokenName, s.tokenId, s.collectionId, "
+            "0, s.source, s.destination, s.price, s.commissionFeeRate, s.offerStartAt, s.offerExpiredAt, s.exhibitDuration, 'pending', "
+            "CAST(s.version AS UNSIGNED) "
+            "FROM {stage} s ORDER BY s.seqno " + newer_event_updates([
+                ('galleryIndex', 's.galleryIndex'), ('collection', 's.collection'), ('tokenCreator', 's.tokenCreator'),
+                ('tokenName', 's.tokenName'), ('tokenId', 's.tokenId'), ('collectionId', 's.collectionId'),
+                ('propertyVersion', '0'), ('`from`', 's.source'), ('`to`', 's.destination'), ('price', 's.price'),
+                ('commissionFeeRate', 's.commissionFeeRate'), ('offerStartAt', 's.offerStartAt'),
+                ('offerExpiredAt', 's.offerExpiredAt'), ('exhibitDuration', 's.exhibitDuration'), ('status', "'pending'"),
+            ]),
+        ]
+    )
+
+    def change(self, event: Event[OfferCreateEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = OfferCreateEventData(**event.data)
+        return change_of(
+            event,
+            'curation_offer_create',
+            **token_ids_of(data.token_id),
+            curation_index=int(data.id),
+            price=data.price,
+            source=data.source,
+            destination=data.destination,
+            expiration=int(data.offer_expired_at) * 1000000
+        )
 
     async def process_all(self, state: State, events: List[Event[OfferCreateEvent]]) -> State:
         return await super().process_all(state, events)
@@ -23,6 +83,7 @@ class OfferCreateEventObserver(Observer[OfferCreateEvent]):
         index = int(data.id)
         token_id = TokenId(**data.token_id)
         token_data_id = TokenDataId(**token_id.token_data_id)
+        token_ids = token_ids_of(data.token_id)
         offer_start_at = datetime.fromtimestamp(int(data.offer_start_at))
         offer_expired_at = datetime.fromtimestamp(int(data.offer_expired_at))
         exhibit_duration = int(data.exhibit_duration)
@@ -30,54 +91,56 @@ class OfferCreateEventObserver(Observer[OfferCreateEvent]):
             int(data.commission_feerate_numerator) // \
             int(data.commission_feerate_denominator)
 
+        where = {
+            'index_root': {
+                'index': index,
+                'root': config.curation.address()
+            }
+        }
+        offer = {
+            'galleryIndex': data.gallery_id,
+            'collection': token_data_id.collection,
+            'tokenName': token_data_id.name,
+            'tokenCreator': token_data_id.creator,
+            'tokenId': token_ids['token_id'],
+            'collectionId': token_ids['collection_id'],
+            'propertyVersion': 0,
+            'source': data.source,
+            'destination': data.destination,
+            'price': data.price,
+            'commissionFeeRate': str(commission_feerate),
+            'offerStartAt': offer_start_at,
+            'offerExpiredAt': offer_expired_at,
+            'exhibitDuration': exhibit_duration,
+            'status': enums.CurationOfferStatus.pending,
+            'eventVersion': int(event.version)
+        }
+
         async with prisma_client.tx(timeout=60000) as transaction:
-            result = await transaction.curationoffer.upsert(
-                where={
-                    'index_root': {
-                        'index': index,
-                        'root': config.curation.address()
-                    }
-                },
-                data={
-                    'create': {
-                        'id': new_uuid(),
-                        'index': index,
-                        'root': config.curation.address(),
-                        'galleryIndex': data.gallery_id,
-                        'collection': token_data_id.collection,
-                        'tokenName': token_data_id.name,
-                        'tokenCreator': token_data_id.creator,
-                        'propertyVersion': 0,
-                        'source': data.source,
-                        'destination': data.destination,
-                        'price': data.price,
-                        'commissionFeeRate': str(commission_feerate),
-                        'offerStartAt': offer_start_at,
-                        'offerExpiredAt': offer_expired_at,
-                        'exhibitDuration': exhibit_duration,
-                        'status': enums.CurationOfferStatus.pending,
-                    },
-                    'update': {
-                        'galleryIndex': data.gallery_id,
-                        'collection': token_data_id.collection,
-                        'tokenName': token_data_id.name,
-                        'tokenCreator': token_data_id.creator,
-                        'propertyVersion': 0,
-                        'source': data.source,
-                        'destination': data.destination,
-                        'price': data.price,
-                        'commissionFeeRate': str(commission_feerate),
-                        'offerStartAt': offer_start_at,
-                        'offerExpiredAt': offer_expired_at,
-                        'exhibitDuration': exhibit_duration,
-                        'status': enums.CurationOfferStatus.pending,
-                    }
-                }
-            )
-            if result == None or result.status != enums.CurationOfferStatus.pending:
+            # an offer is sent again under the same index, a replayed event leaves it as it is
+            existing = await transaction.curationoffer.find_unique(where=where)
+            if existing == None:
+                result = await transaction.curationoffer.create(data={
+                    'id': new_uuid(),
+                    'index': index,
+                    'root': config.curation.address(),
+                    **offer
+                })
+            elif int(event.version) > existing.eventVersion:
+                result = await transaction.curationoffer.update(where=where, data=offer)
+            else:
+                result = existing
+            if result == None:
                 raise Exception(
                     f'[Curator send offer]: Failed to create curation offer({data})')
 
+            # gallery stats
+            if result != existing:
+                await move_gallery_stats(transaction, existing, result)
+
+            # change feed
+            await self.publish(transaction, [self.change(event)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
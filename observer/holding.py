@@ -0,0 +1,59 @@
+from typing import List
+from prisma import Prisma
+
+# Tokens held per owner and collection in OwnerHolding, and per owner in
+# OwnerPortfolio with the number of collections held, moved by deltas in the
+# transaction that changes AptosToken.owner. `{moves}` selects rows of
+# (owner, collectionId, delta); the holdings are moved first, the portfolio
+# then counts the collections from them.
+MOVE_HOLDINGS = (
+    "INSERT INTO OwnerHolding (owner, collectionId, count) "
+    "SELECT m.owner, m.collectionId, SUM(m.delta) FROM ({moves}) m GROUP BY m.owner, m.collectionId "
+    "ON DUPLICATE KEY UPDATE count = count + VALUES(count)")
+
+MOVE_PORTFOLIOS = (
+    "INSERT INTO OwnerPortfolio (owner, tokens, collections) "
+    "SELECT m.owner, SUM(m.delta), (SELECT COUNT(*) FROM OwnerHolding h WHERE h.owner = m.owner AND h.count > 0) "
+    "FROM ({moves}) m GROUP BY m.owner "
+    "ON DUPLICATE KEY UPDATE tokens = tokens + VALUES(tokens), collections = VALUES(collections)")
+
+
+# Version of the transfer that set the current owner of token `t`: its
+# interval is the latest in TokenOwnership, 0 for a token without any. Buy and
+# accept offer are separate streams, a transfer older than it was applied late
+# and leaves the owner and the holdings alone.
+OWNER_VERSION = "(SELECT COALESCE(MAX(o.fromVersion), 0) FROM TokenOwnership o WHERE o.tokenId = t.id)"
+
+# for the statements of a mapping, the staged transfer sets the owner
+NEWER_STAGED_OWNER = "CAST(s.version AS UNSIGNED) > " + OWNER_VERSION
+
+
+# for the statements of a mapping, run before the owners are overwritten
+def staged_moves(*moves: str) -> List[str]:
+    return [MOVE_HOLDINGS.format(moves=move) for move in moves] + \
+        [MOVE_PORTFOLIOS.format(moves=move) for move in moves]
+
+
+# Gives the token to `owner` by the transfer at `version`, run before its
+# interval is recorded. False when a later transfer set the owner already.
+async def move_token(transaction: Prisma, token_id: str, collection_id: str, owner: str, version: int) -> bool:
+    rows = await transaction.query_raw(
+        f"SELECT t.owner AS owner, {OWNER_VERSION} AS ownerVersion FROM AptosToken t WHERE t.id = ? FOR UPDATE", token_id)
+    if len(rows) == 0:
+        raise Exception(f'[Holdings]: Token {token_id} not found')
+    if version <= int(rows[0]['ownerVersion']):
+        return False
+    previous = rows[0]['owner']
+    if previous != owner:
+        moves = "SELECT ? AS owner, ? AS collectionId, -1 AS delta UNION ALL SELECT ?, ?, 1"
+        args = [previous, collection_id, owner, collection_id]
+        await transaction.execute_raw(MOVE_HOLDINGS.format(moves=moves), *args)
+        await transaction.execute_raw(MOVE_PORTFOLIOS.format(moves=moves), *args)
+    await transaction.execute_raw("UPDATE AptosToken SET owner = ? WHERE id = ?", owner, token_id)
+    return True
+
+
+async def add_token(transaction: Prisma, collection_id: str, owner: str):
+    moves = "SELECT ? AS owner, ? AS collectionId, 1 AS delta"
+    await transaction.execute_raw(MOVE_HOLDINGS.format(moves=moves), owner, collection_id)
+    await transaction.execute_raw(MOVE_PORTFOLIOS.format(moves=moves), owner, collection_id)
@@ -0,0 +1,234 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+from common.db import prisma_client
+from common.util import flatten, primary_key_of_event
+from model.change import Change
+from model.event import T, Event
+from model.state import State
+from model.token_id import TokenDataId, TokenId
+from observer.observer import Observer
+
+# pages with fewer events are applied one by one by Observer.process
+BATCH_MIN_EVENTS = 10
+# rows per multi-row insert into the staging table
+STAGE_CHUNK_SIZE = 500
+
+TOKEN_JOIN = 'JOIN AptosToken t ON t.creator = s.creator AND t.collection = s.collection AND t.name = s.name'
+
+
+def token_data_id_of(data: Any) -> TokenDataId:
+    return TokenDataId(**TokenId(**data.token_id).token_data_id)
+
+
+def datetime_of(microseconds: str) -> str:
+    return datetime.fromtimestamp(float(microseconds) / 1000000).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+# ON DUPLICATE KEY UPDATE of a row the staged event writes as a whole: the
+# (column, value) assignments are applied only by an event newer than the one
+# that last wrote the row, whose version is kept in eventVersion, assigned last
+def newer_event_updates(assignments: List[Tuple[str, str]]) -> str:
+    version = 'CAST(s.version AS UNSIGNED)'
+    return 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+        [f'{column} = IF({version} > eventVersion, {value}, {column})' for (column, value) in assignments] +
+        [f'eventVersion = GREATEST(eventVersion, {version})'])
+
+
+# Changes of events applied earlier, with the ids the observer published: a
+# market event names its token by creator, collection and name, looked up in
+# AptosToken as the observers do, as the id of a minted token derives from its
+# minter and not from the resource account creating it on chain.
+async def changes_of_applied(observer, events: List[Event]) -> List[Change]:
+    changes = [observer.change(event) for event in events]
+    names = {}
+    for (change, event) in zip(changes, events):
+        if change.token_id == None and isinstance(event.data, dict) and 'token_id' in event.data:
+            token_data_id = TokenDataId(**TokenId(**event.data['token_id']).token_data_id)
+            names[change.event_id] = (token_data_id.creator, token_data_id.collection, token_data_id.name)
+    if len(names) == 0:
+        return changes
+    distinct = list(set(names.values()))
+    rows = await prisma_client.query_raw(
+        "SELECT id, collectionId, creator, collection, name FROM AptosToken "
+        f"WHERE (creator, collection, name) IN ({', '.join(['(?, ?, ?)'] * len(distinct))})",
+        *flatten([list(name) for name in distinct]))
+    tokens = {(row['creator'], row['collection'], row['name']): (row['id'], row['collectionId']) for row in rows}
+    for change in changes:
+        name = names.get(change.event_id)
+        if name == None:
+            continue
+        if name not in tokens:
+            raise Exception(f'[Change]: Token {name} of applied {change.type} event {change.event_id} not found')
+        (change.token_id, change.collection_id) = tokens[name]
+    return changes
+
+
+@dataclass
+class Column:
+    name: str
+    sql_type: str
+    value: Callable[[Event, Any], Any]
+
+
+# Describes how a page of one event type lands in the tables: the columns
+# staged per event and the set-based statements merging the staged page.
+# Statements are formatted with {stage} (the staging table, alias it `s`)
+# and {token} (join of the staged token names to AptosToken `t`).
+@dataclass
+class Mapping:
+    name: str
+    data: type
+    offset_field: str
+    state_field: str
+    columns: List[Column]
+    statements: List[str]
+    # stage creator/collection/name of data.token_id to resolve AptosToken
+    token: bool = False
+    # (name, join) of the rows every staged event must find, the join aliases
+    # the row `r`; a page with an event missing one is applied one by one
+    resolves: List[Tuple[str, str]] = field(default_factory=list)
+    # flags the last event of the page per key in the `latest` column
+    latest_by: Optional[Callable[[Event, Any], Any]] = None
+    # called after commit with (tokenId, collectionId, version) of each token of the page
+    refresh_cache: Optional[Callable[[str, str, int], None]] = None
+
+    def stage(self) -> str:
+        return f'stage_{self.offset_field}'
+
+    def stage_columns(self) -> List[Column]:
+        columns = [
+            Column('seqno', 'BIGINT',
+                   lambda event, data: int(event.sequence_number)),
+            Column('id', 'VARCHAR(64)',
+                   lambda event, data: primary_key_of_event(event.version, event.guid, event.sequence_number)),
+            Column('version', 'VARCHAR(78)',
+                   lambda event, data: f'{event.version}'),
+        ]
+        if self.token:
+            columns.extend([
+                Column('creator', 'VARCHAR(191)',
+                       lambda event, data: token_data_id_of(data).creator),
+                Column('collection', 'VARCHAR(191)',
+                       lambda event, data: token_data_id_of(data).collection),
+                Column('name', 'VARCHAR(191)',
+                       lambda event, data: token_data_id_of(data).name),
+            ])
+        return columns + self.columns
+
+    def rows(self, events: List[Event]) -> List[List[Any]]:
+        decoded = [(event, self.data(**event.data)) for event in events]
+        latest = {}
+        if self.latest_by != None:
+            for (event, data) in decoded:
+                latest[self.latest_by(event, data)] = event.sequence_number
+        columns = self.stage_columns()
+        rows = []
+        for (event, data) in decoded:
+            is_latest = self.latest_by == None or \
+                latest[self.latest_by(event, data)] == event.sequence_number
+            rows.append([column.value(event, data) for column in columns] +
+                        [1 if is_latest else 0])
+        return rows
+
+    def staging(self, events: List[Event]) -> List[Tuple[str, List[Any]]]:
+        stage = self.stage()
+        columns = self.stage_columns()
+        definition = ', '.join(
+            [f'`{column.name}` {column.sql_type}' for column in columns])
+        names = ', '.join([f'`{column.name}`' for column in columns])
+        statements = [
+            (f'DROP TEMPORARY TABLE IF EXISTS {stage}', []),
+            (f'CREATE TEMPORARY TABLE {stage} ({definition}, `latest` TINYINT NOT NULL, PRIMARY KEY (`seqno`))', []),
+        ]
+        rows = self.rows(events)
+        for i in range(0, len(rows), STAGE_CHUNK_SIZE):
+            chunk = rows[i:i + STAGE_CHUNK_SIZE]
+            values = ', '.join(
+                ['(' + ', '.join(['?'] * (len(columns) + 1)) + ')'] * len(chunk))
+            statements.append(
+                (f'INSERT INTO {stage} ({names}, `latest`) VALUES {values}', flatten(chunk)))
+        return statements
+
+    def merges(self) -> List[str]:
+        return [statement.format(stage=self.stage(), token=TOKEN_JOIN) for statement in self.statements]
+
+
+class MappedObserver(Observer[T]):
+    mapping: Mapping = None
+
+    async def process_all(self, state: State, events: List[Event[T]]) -> State:
+        if len(events) < BATCH_MIN_EVENTS:
+            return await super().process_all(state, events)
+        logging.info(
+            f"[Observer]: received events from seq no {events[0].sequence_number} to {events[-1].sequence_number}, applying as a batch")
+        try:
+            return await self.process_page(state, events)
+        except Exception as err:
+            self.rollback()
+            # one by one the page is applied up to the event that fails
+            logging.error(
+                f'[{self.mapping.name}]: Failed to apply events as a batch, falling back to one by one: {err}')
+            return await super().process_all(state, events)
+
+    async def process_page(self, state: State, events: List[Event[T]]) -> State:
+        new_state = state
+        mapping = self.mapping
+        stage = mapping.stage()
+        seqno = int(events[-1].sequence_number)
+
+        async with prisma_client.tx(timeout=60000) as transaction:
+            for (sql, args) in mapping.staging(events):
+                await transaction.execute_raw(sql, *args)
+
+            if mapping.token:
+                unresolved = await transaction.query_raw(
+                    f'SELECT MIN(s.seqno) AS seqno FROM {stage} s LEFT JOIN AptosToken t ON t.creator = s.creator AND t.collection = s.collection AND t.name = s.name WHERE t.id IS NULL')
+                if len(unresolved) > 0 and unresolved[0]['seqno'] != None:
+                    raise Exception(
+                        f"[{mapping.name}]: Token not found for the event of seq no {unresolved[0]['seqno']}")
+            for (name, join) in mapping.resolves:
+                unresolved = await transaction.query_raw(
+                    f'SELECT MIN(s.seqno) AS seqno FROM {stage} s LEFT JOIN {join} WHERE r.id IS NULL')
+                if len(unresolved) > 0 and unresolved[0]['seqno'] != None:
+                    raise Exception(
+                        f"[{mapping.name}]: {name} not found for the event of seq no {unresolved[0]['seqno']}")
+
+            for sql in mapping.merges():
+                await transaction.execute_raw(sql)
+
+            # token ids the staged events resolved to, by seq no
+            tokens = {}
+            if mapping.token:
+                resolved = await transaction.query_raw(
+                    f'SELECT s.seqno AS seqno, t.id AS tokenId, t.collectionId AS collectionId FROM {stage} s {TOKEN_JOIN}')
+                tokens = {int(row['seqno']): (row['tokenId'], row['collectionId'])
+                          for row in resolved}
+            changes = [self.change(event, *tokens.get(int(event.sequence_number), (None, None)))
+                       for event in events]
+            await self.publish(transaction, changes)
+            await transaction.execute_raw(f'DROP TEMPORARY TABLE {stage}')
+
+            updated_offset = await transaction.eventoffset.update(
+                where={'id': 0},
+                data={
+                    mapping.offset_field: seqno
+                }
+            )
+            if updated_offset == None or getattr(updated_offset, mapping.offset_field) != seqno:
+                raise Exception(f'[{mapping.name}]: Failed to update offset')
+
+        setattr(new_state.new_offset, mapping.state_field,
+                getattr(updated_offset, mapping.offset_field))
+        self.commit()
+
+        # refresh cache once committed
+        if mapping.refresh_cache != None:
+            versions = {}
+            for change in changes:
+                key = (change.token_id, change.collection_id)
+                versions[key] = max(versions.get(key, change.version), change.version)
+            for (token_id, collection_id), version in versions.items():
+                mapping.refresh_cache(token_id, collection_id, version)
+        return new_state
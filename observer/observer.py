@@ -1,5 +1,7 @@
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from prisma import Prisma
+from model.change import Change, dispatch
 from model.event import T, Event
 from model.state import State
 
@@ -7,7 +9,10 @@ from model.state import State
 class Observer(Event[T]):
 
     def __init__(self) -> None:
-        pass
+        # published in the open transaction, dispatched once it commits
+        self.pending: List[Change] = []
+        # committed since the worker last took them, for the event archive
+        self.committed: List[Change] = []
 
     async def process_all(self, state: State, events: List[Event[T]]) -> State:
         if len(events) == 0:
@@ -19,12 +24,40 @@ class Observer(Event[T]):
             try:
                 (new_state, success) = await self.process(current_state, event)
                 if not success:
+                    self.rollback()
                     return current_state
+                self.commit()
                 current_state = new_state
             except Exception as err:
+                self.rollback()
                 logging.error(err)
                 return current_state
         return current_state
 
     async def process(self, state: State, event: Event[T]) -> Tuple[State, bool]:
         pass
+
+    def change(self, event: Event[T], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        pass
+
+    # written in the transaction of the events, relayed to the change feed once committed
+    async def publish(self, transaction: Prisma, changes: List[Change]):
+        await transaction.eventoutbox.create_many(
+            data=[change.outbox() for change in changes],
+            skip_duplicates=True
+        )
+        self.pending.extend(changes)
+
+    def commit(self):
+        changes = self.pending
+        self.pending = []
+        self.committed.extend(changes)
+        dispatch(changes)
+
+    def take_committed(self) -> List[Change]:
+        changes = self.committed
+        self.committed = []
+        return changes
+
+    def rollback(self):
+        self.pending = []
@@ -1,17 +1,39 @@
 from datetime import datetime
-from typing import List, Tuple
-from common.util import new_uuid
+from typing import List, Optional, Tuple
+from common.util import primary_key_of_event
 from model.token_id import TokenId, TokenDataId
 from observer.observer import Observer
+from observer.holding import move_token
+from observer.ownership import record_owner
+from observer.volume import add_sale
+from stats.rollup import add_rollup
 from model.offer.accept_offer_event import AcceptOfferEvent, AcceptOfferEventData
-from model.state import State
+from model.state import State, read_client
+from model.coin_type_info import CoinTypeInfo
+from model.change import Change, change_of
 from model.event import Event
+from book.offer import offer_books
 from common.db import prisma_client
+from common.currency import currencies, price_value_of
 from prisma import enums
 
 
 class AcceptOfferEventObserver(Observer[AcceptOfferEvent]):
 
+    def change(self, event: Event[AcceptOfferEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = AcceptOfferEventData(**event.data)
+        return change_of(
+            event,
+            'accept_offer',
+            token_id=token_id,
+            collection_id=collection_id,
+            price=data.coin_amount_per_token,
+            currency=CoinTypeInfo(**data.coin_type_info).currency(),
+            source=data.token_owner,
+            destination=data.coin_owner,
+            timestamp=int(data.timestamp)
+        )
+
     async def process_all(self, state: State, events: List[Event[AcceptOfferEvent]]) -> State:
         return await super().process_all(state, events)
 
@@ -20,8 +42,10 @@ class AcceptOfferEventObserver(Observer[AcceptOfferEvent]):
         seqno = event.sequence_number
         data = AcceptOfferEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
+        currency_id = await currencies.id_of(CoinTypeInfo(**data.coin_type_info).currency())
 
-        token = await prisma_client.aptostoken.find_unique(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -30,15 +54,24 @@ class AcceptOfferEventObserver(Observer[AcceptOfferEvent]):
             raise Exception(
                 f'[Accept Offer]: Token ({token_data_id}) not found but the offer ({data}) was existed.')
 
-        offer = await prisma_client.aptosoffer.find_first(
-            where={
-                'offerer': data.coin_owner,
-                'tokenId': token.id
-            },
-            order={
-                "openedAt": "desc"
-            }
-        )
+        # open offers are resolved from the book, the ones it misses (closed
+        # by an event replayed after a crash, or expired at start) from the table
+        offer = offer_books.resolve(token.id, data.coin_owner, int(data.timestamp))
+        if offer == None:
+            reader = await read_client(state, 'create_offer_excuted_offset')
+            offer = await reader.aptosoffer.find_first(
+                where={
+                    'offerer': data.coin_owner,
+                    'tokenId': token.id,
+                    # a replayed event must not pick an offer opened after it
+                    'openedAt': {
+                        'lte': datetime.fromtimestamp(float(data.timestamp) / 1000000)
+                    }
+                },
+                order={
+                    "openedAt": "desc"
+                }
+            )
         if offer == None:
             raise Exception(
                 f'[Accept Offer]: Offer ({token}) not found but the accepted event of offer ({data}) was existed.')
@@ -59,39 +92,52 @@ class AcceptOfferEventObserver(Observer[AcceptOfferEvent]):
                 raise Exception(
                     f'[Accept Offer]: Failed to update offer status to ACCEPTED')
 
-            # token
-            updated = await transaction.aptostoken.update(
-                where={
-                    "id": token.id
-                },
-                data={
-                    'owner': data.coin_owner
-                }
-            )
-            if updated == None:
-                raise Exception(
-                    f"[Accept Offer]: Failed to update token owner to buyer")
+            # token, unless a buy applied first moved it later on chain
+            await move_token(transaction, token.id, token.collectionId, data.coin_owner, int(event.version))
+
+            # ownership history
+            await record_owner(transaction, event, token.id, token.collectionId, data.coin_owner, timestamp)
 
             # activity
-            result = await transaction.aptosactivity.create(
+            activityId = primary_key_of_event(event.version, event.guid, seqno)
+            await add_sale(transaction, activityId, token.collectionId, currency_id,
+                           price_value_of(data.coin_amount_per_token))
+            await add_rollup(transaction, activityId, 'SALE', token.collectionId, currency_id,
+                             price_value_of(data.coin_amount_per_token), data.timestamp)
+            result = await transaction.aptosactivity.upsert(
+                where={
+                    'id_txTimestamp': {
+                        'id': activityId,
+                        'txTimestamp': timestamp
+                    }
+                },
                 data={
-                    'id': new_uuid(),
-                    'orderId': "",
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'source': data.token_owner,
-                    'destination': data.coin_owner,
-                    'txHash': f'{event.version}',
-                    'txType': enums.TxType.SALE,
-                    'quantity': data.token_amount,
-                    'price': data.coin_amount_per_token,
-                    'txTimestamp': timestamp
+                    'create': {
+                        'id': activityId,
+                        'orderId': "",
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'source': data.token_owner,
+                        'destination': data.coin_owner,
+                        'txHash': f'{event.version}',
+                        'txType': enums.TxType.SALE,
+                        'quantity': data.token_amount,
+                        'price': data.coin_amount_per_token,
+                        'priceValue': price_value_of(data.coin_amount_per_token),
+                        'currency': CoinTypeInfo(**data.coin_type_info).currency(),
+                        'currencyId': currency_id,
+                        'txTimestamp': timestamp
+                    },
+                    'update': {}
                 }
             )
             if result == None or result.txType != enums.TxType.SALE:
                 raise Exception(
                     f"[Token Activity]: Failed to create new activity with buy event")
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             # seqno
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
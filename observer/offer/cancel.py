@@ -1,15 +1,31 @@
-from typing import List, Tuple
+from datetime import datetime
+from typing import List, Optional, Tuple
 from model.token_id import TokenId, TokenDataId
 from observer.observer import Observer
 from model.offer.cancel_offer_event import CancelOfferEvent, CancelOfferEventData
-from model.state import State
+from model.state import State, read_client
+from model.coin_type_info import CoinTypeInfo
+from model.change import Change, change_of
 from model.event import Event
+from book.offer import offer_books
 from common.db import prisma_client
 from prisma import enums
 
 
 class CancelOfferEventObserver(Observer[CancelOfferEvent]):
 
+    def change(self, event: Event[CancelOfferEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = CancelOfferEventData(**event.data)
+        return change_of(
+            event,
+            'cancel_offer',
+            token_id=token_id,
+            collection_id=collection_id,
+            currency=CoinTypeInfo(**data.coin_type_info).currency(),
+            source=data.coin_owner,
+            timestamp=int(data.timestamp)
+        )
+
     async def process_all(self, state: State, events: List[Event[CancelOfferEvent]]) -> State:
         return await super().process_all(state, events)
 
@@ -19,7 +35,8 @@ class CancelOfferEventObserver(Observer[CancelOfferEvent]):
         data = CancelOfferEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
 
-        token = await prisma_client.aptostoken.find_first(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -28,15 +45,24 @@ class CancelOfferEventObserver(Observer[CancelOfferEvent]):
             raise Exception(
                 f'[Cancel Offer]: Token ({token_data_id}) not found but the offer ({data}) was existed.')
 
-        offer = await prisma_client.aptosoffer.find_first(
-            where={
-                'offerer': data.coin_owner,
-                'tokenId': token.id
-            },
-            order={
-                "openedAt": "desc"
-            }
-        )
+        # open offers are resolved from the book, the ones it misses (closed
+        # by an event replayed after a crash, or expired at start) from the table
+        offer = offer_books.resolve(token.id, data.coin_owner, int(data.timestamp))
+        if offer == None:
+            reader = await read_client(state, 'create_offer_excuted_offset')
+            offer = await reader.aptosoffer.find_first(
+                where={
+                    'offerer': data.coin_owner,
+                    'tokenId': token.id,
+                    # a replayed event must not pick an offer opened after it
+                    'openedAt': {
+                        'lte': datetime.fromtimestamp(float(data.timestamp) / 1000000)
+                    }
+                },
+                order={
+                    "openedAt": "desc"
+                }
+            )
         if offer == None:
             raise Exception(
                 f'[Cancel Offer]: Offer ({token}) not found but the canceled event of offer ({data}) was existed.')
@@ -54,6 +80,9 @@ class CancelOfferEventObserver(Observer[CancelOfferEvent]):
                 raise Exception(
                     f'[Cancel Offer]: Failed to update offer status to CANCELED')
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,17 +1,57 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from model.coin_type_info import CoinTypeInfo
 from model.token_id import TokenId, TokenDataId
-from observer.observer import Observer
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of
 from model.offer.create_offer_event import CreateOfferEvent, CreateOfferEventData
-from model.state import State
+from model.state import State, read_client
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from datetime import datetime
-from common.util import new_uuid
+from common.util import primary_key_of_event
+from common.currency import STAGE_CURRENCIES, STAGED_CURRENCY_ID, currencies, price_value_of
 
 
-class CreateOfferEventObserver(Observer[CreateOfferEvent]):
+class CreateOfferEventObserver(MappedObserver[CreateOfferEvent]):
+    mapping = Mapping(
+        name='Create Offer',
+        data=CreateOfferEventData,
+        offset_field='create_offer_excuted_offset',
+        state_field='create_offer_excuted_offset',
+        token=True,
+        columns=[
+            Column('offerer', 'VARCHAR(191)', lambda event, data: data.coin_owner),
+            Column('price', 'VARCHAR(78)', lambda event, data: data.coin_amount_per_token),
+            Column('quantity', 'VARCHAR(78)', lambda event, data: data.token_amount),
+            Column('currency', 'VARCHAR(191)',
+                   lambda event, data: CoinTypeInfo(**data.coin_type_info).currency()),
+            Column('openedAt', 'DATETIME(6)', lambda event, data: datetime_of(data.timestamp)),
+            Column('endedAt', 'DATETIME(6)',
+                   lambda event, data: datetime_of(float(data.timestamp) + float(data.expiration_time) * 1000000)),
+        ],
+        statements=[
+            STAGE_CURRENCIES,
+            "INSERT IGNORE INTO AptosOffer (id, collectionId, tokenId, price, priceValue, currency, currencyId, quantity, openedAt, endedAt, "
+            "offerer, status) "
+            "SELECT s.id, t.collectionId, t.id, s.price, CAST(s.price AS DECIMAL(38,0)), s.currency, "
+            f"{STAGED_CURRENCY_ID}, s.quantity, s.openedAt, s.endedAt, s.offerer, 'CREATED' FROM {{stage}} s {{token}}",
+        ]
+    )
+
+    def change(self, event: Event[CreateOfferEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = CreateOfferEventData(**event.data)
+        return change_of(
+            event,
+            'create_offer',
+            token_id=token_id,
+            collection_id=collection_id,
+            price=data.coin_amount_per_token,
+            currency=CoinTypeInfo(**data.coin_type_info).currency(),
+            source=data.coin_owner,
+            timestamp=int(data.timestamp),
+            expiration=int(data.timestamp) + int(data.expiration_time) * 1000000
+        )
 
     async def process_all(self, state: State, events: List[Event[CreateOfferEvent]]) -> State:
         return await super().process_all(state, events)
@@ -22,8 +62,10 @@ class CreateOfferEventObserver(Observer[CreateOfferEvent]):
         data = CreateOfferEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
         coin_type_info = CoinTypeInfo(**data.coin_type_info)
+        currency_id = await currencies.id_of(coin_type_info.currency())
 
-        token = await prisma_client.aptostoken.find_first(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -40,24 +82,36 @@ class CreateOfferEventObserver(Observer[CreateOfferEvent]):
             endedAt = datetime.fromtimestamp(
                 float(data.timestamp) / 1000000 + float(data.expiration_time)
             )
-            result = await transaction.aptosoffer.create(
+            offerId = primary_key_of_event(event.version, event.guid, seqno)
+            result = await transaction.aptosoffer.upsert(
+                where={
+                    'id': offerId
+                },
                 data={
-                    'id': new_uuid(),
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'price': data.coin_amount_per_token,
-                    'quantity': data.token_amount,
-                    'currency': coin_type_info.currency(),
-                    'offerer': data.coin_owner,
-                    'openedAt': openedAt,
-                    'endedAt': endedAt,
-                    'status':  enums.OfferStatus.CREATED
+                    'create': {
+                        'id': offerId,
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'price': data.coin_amount_per_token,
+                        'priceValue': price_value_of(data.coin_amount_per_token),
+                        'quantity': data.token_amount,
+                        'currency': coin_type_info.currency(),
+                        'currencyId': currency_id,
+                        'offerer': data.coin_owner,
+                        'openedAt': openedAt,
+                        'endedAt': endedAt,
+                        'status':  enums.OfferStatus.CREATED
+                    },
+                    'update': {}
                 }
             )
-            if result == None or result.status != enums.OfferStatus.CREATED:
+            if result == None:
                 raise Exception(
                     f'[Create Offer]: Failed to create new offer({data}) for the token({token})')
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
                 data={
@@ -1,17 +1,91 @@
+from dataclasses import astuple
 from datetime import datetime
-from typing import List, Tuple
-from common.util import new_uuid
-from common.redis import redis_cli
+from typing import List, Optional, Tuple
+from common.util import primary_key_of_event
+from common.cache import cache_updater
+from common.keys import collection_stats_key, order_key, token_key
+from common.payload import collection_stats_payload, order_payload, token_payload
 from model.token_id import TokenId, TokenDataId
-from observer.observer import Observer
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of, token_data_id_of
+from observer.holding import NEWER_STAGED_OWNER, move_token, staged_moves
+from observer.ownership import CLOSE_STAGED_INTERVALS, record_owner
+from observer.volume import STAGED_VOLUMES, add_sale
+from stats.rollup import add_rollup, rollup_time_of, staged_rollups
 from model.order.buy_event import BuyEvent, BuyEventData
-from model.state import State
+from model.state import State, read_client
+from model.coin_type_info import CoinTypeInfo
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
+from common.currency import STAGE_CURRENCIES, STAGED_CURRENCY_ID, currencies, price_value_of
 from prisma import enums
 
 
-class BuyEventObserver(Observer[BuyEvent]):
+def refresh_cache(token_id: str, collection_id: str, version: int):
+    cache_updater.refresh(order_key(token_id, collection_id), version,
+                          lambda: order_payload(token_id))
+    cache_updater.refresh(token_key(token_id, collection_id), version,
+                          lambda: token_payload(token_id))
+    cache_updater.refresh(collection_stats_key(collection_id), version,
+                          lambda: collection_stats_payload(collection_id))
+
+
+class BuyEventObserver(MappedObserver[BuyEvent]):
+    mapping = Mapping(
+        name='Buy order',
+        data=BuyEventData,
+        offset_field='buy_event_excuted_offset',
+        state_field='buy_events_excuted_offset',
+        token=True,
+        latest_by=lambda event, data: astuple(token_data_id_of(data)),
+        columns=[
+            Column('offer_id', 'VARCHAR(78)', lambda event, data: data.offer_id),
+            Column('seller', 'VARCHAR(66)', lambda event, data: data.seller),
+            Column('buyer', 'VARCHAR(66)', lambda event, data: data.buyer),
+            Column('quantity', 'VARCHAR(78)', lambda event, data: data.token_amount),
+            Column('price', 'VARCHAR(78)', lambda event, data: data.coin_amount),
+            Column('currency', 'VARCHAR(191)',
+                   lambda event, data: CoinTypeInfo(**data.coin_type_info).currency()),
+            Column('timestamp', 'DATETIME(6)', lambda event, data: datetime_of(data.timestamp)),
+            Column('at', 'DATETIME(6)', lambda event, data: rollup_time_of(data.timestamp)),
+        ],
+        statements=[
+            "UPDATE {stage} s {token} JOIN AptosOrder o ON o.tokenId = t.id AND o.seqno = s.offer_id "
+            "SET o.status = 'SOLD', o.buyer = s.buyer WHERE o.status = 'LISTING'",
+            # holdings move from the owner before the page to the last buyer
+            *staged_moves(
+                "SELECT t.owner AS owner, t.collectionId, -1 AS delta FROM {stage} s {token} "
+                "WHERE s.latest = 1 AND t.owner <> s.buyer AND " + NEWER_STAGED_OWNER,
+                "SELECT s.buyer AS owner, t.collectionId, 1 AS delta FROM {stage} s {token} "
+                "WHERE s.latest = 1 AND t.owner <> s.buyer AND " + NEWER_STAGED_OWNER),
+            "UPDATE {stage} s {token} SET t.owner = s.buyer WHERE s.latest = 1 AND " + NEWER_STAGED_OWNER,
+            STAGE_CURRENCIES,
+            STAGED_VOLUMES,
+            staged_rollups('SALE'),
+            "INSERT IGNORE INTO AptosActivity (id, orderId, collectionId, tokenId, `from`, `to`, txHash, txType, quantity, price, priceValue, "
+            "currency, currencyId, txTimestamp) "
+            "SELECT s.id, '', t.collectionId, t.id, s.seller, s.buyer, s.version, 'SALE', s.quantity, s.price, CAST(s.price AS DECIMAL(38,0)), "
+            f"s.currency, {STAGED_CURRENCY_ID}, s.timestamp FROM {{stage}} s {{token}}",
+            "INSERT IGNORE INTO TokenOwnership (id, tokenId, collectionId, owner, fromVersion, fromTime) "
+            "SELECT s.id, t.id, t.collectionId, s.buyer, CAST(s.version AS UNSIGNED), s.timestamp FROM {stage} s {token}",
+            CLOSE_STAGED_INTERVALS,
+        ],
+        refresh_cache=refresh_cache
+    )
+
+    def change(self, event: Event[BuyEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = BuyEventData(**event.data)
+        return change_of(
+            event,
+            'buy',
+            token_id=token_id,
+            collection_id=collection_id,
+            price=data.coin_amount,
+            currency=CoinTypeInfo(**data.coin_type_info).currency(),
+            source=data.seller,
+            destination=data.buyer,
+            timestamp=int(data.timestamp)
+        )
 
     async def process_all(self, state: State, events: List[Event[BuyEvent]]) -> State:
         return await super().process_all(state, events)
@@ -21,8 +95,10 @@ class BuyEventObserver(Observer[BuyEvent]):
         seqno = event.sequence_number
         data = BuyEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
+        currency_id = await currencies.id_of(CoinTypeInfo(**data.coin_type_info).currency())
 
-        token = await prisma_client.aptostoken.find_first(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -39,7 +115,8 @@ class BuyEventObserver(Observer[BuyEvent]):
             updated = await transaction.aptosorder.update_many(
                 where={
                     'status': enums.OrderStatus.LISTING,
-                    'tokenId': token.id
+                    'tokenId': token.id,
+                    'seqno': data.offer_id
                 },
                 data={
                     'buyer': data.buyer,
@@ -50,39 +127,51 @@ class BuyEventObserver(Observer[BuyEvent]):
                 raise Exception(
                     f"[Buy order]: Failed to update order status to SOLD")
 
-            # token
-            updated = await transaction.aptostoken.update(
-                where={
-                    "id": token.id
-                },
-                data={
-                    'owner': data.buyer
-                }
-            )
-            if updated == None:
-                raise Exception(
-                    f"[Buy order]: Failed to update token owner to buyer")
+            # token, unless an accept offer applied first moved it later on chain
+            await move_token(transaction, token.id, token.collectionId, data.buyer, int(event.version))
+
+            # ownership history
+            await record_owner(transaction, event, token.id, token.collectionId, data.buyer, timestamp)
 
             # activity
-            result = await transaction.aptosactivity.create(
+            activityId = primary_key_of_event(event.version, event.guid, seqno)
+            await add_sale(transaction, activityId, token.collectionId, currency_id, price_value_of(data.coin_amount))
+            await add_rollup(transaction, activityId, 'SALE', token.collectionId, currency_id,
+                             price_value_of(data.coin_amount), data.timestamp)
+            result = await transaction.aptosactivity.upsert(
+                where={
+                    'id_txTimestamp': {
+                        'id': activityId,
+                        'txTimestamp': timestamp
+                    }
+                },
                 data={
-                    'id': new_uuid(),
-                    'orderId': "",
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'source': data.seller,
-                    'destination': data.buyer,
-                    'txHash': f'{event.version}',
-                    'txType': enums.TxType.SALE,
-                    'quantity': data.token_amount,
-                    'price': data.coin_amount,
-                    'txTimestamp': timestamp
+                    'create': {
+                        'id': activityId,
+                        'orderId': "",
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'source': data.seller,
+                        'destination': data.buyer,
+                        'txHash': f'{event.version}',
+                        'txType': enums.TxType.SALE,
+                        'quantity': data.token_amount,
+                        'price': data.coin_amount,
+                        'priceValue': price_value_of(data.coin_amount),
+                        'currency': CoinTypeInfo(**data.coin_type_info).currency(),
+                        'currencyId': currency_id,
+                        'txTimestamp': timestamp
+                    },
+                    'update': {}
                 }
             )
             if result == None or result.txType != enums.TxType.SALE:
                 raise Exception(
                     f"[Token Activity]: Failed to create new activity with buy event")
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             # seqno
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
@@ -94,9 +183,7 @@ class BuyEventObserver(Observer[BuyEvent]):
                 raise Exception(f"[Buy order]: Failed to update offset")
 
             new_state.new_offset.buy_events_excuted_offset = updated_offset.buy_event_excuted_offset
-            
-            # delete cache
-            redis_cli.delete(f"cache:imart:aptosOrder:id:{token.id}")
-            redis_cli.delete(f"cache:imart:aptosToken:id:{token.id}")
-            redis_cli.delete(f"cache:imart:collectionstats:id:{token.collectionId}")
-            return new_state, True
+
+        # refresh cache once committed
+        refresh_cache(token.id, token.collectionId, int(event.version))
+        return new_state, True
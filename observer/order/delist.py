@@ -1,17 +1,61 @@
 from datetime import datetime
-from typing import List, Tuple
-from common.util import new_uuid
-from common.redis import redis_cli
+from typing import List, Optional, Tuple
+from common.util import primary_key_of_event
+from common.cache import cache_updater
+from common.keys import collection_stats_key, order_key
+from common.payload import collection_stats_payload, order_payload
 from model.token_id import TokenId, TokenDataId
-from observer.observer import Observer
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of
 from model.order.delist_event import DelistEvent, DelistEventData
-from model.state import State
+from model.state import State, read_client
+from model.coin_type_info import CoinTypeInfo
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
+from common.currency import price_value_of
 from prisma import enums
 
 
-class DelistEventObserver(Observer[DelistEvent]):
+def refresh_cache(token_id: str, collection_id: str, version: int):
+    cache_updater.refresh(order_key(token_id, collection_id), version,
+                          lambda: order_payload(token_id))
+    cache_updater.refresh(collection_stats_key(collection_id), version,
+                          lambda: collection_stats_payload(collection_id))
+
+
+class DelistEventObserver(MappedObserver[DelistEvent]):
+    mapping = Mapping(
+        name='Delist Order',
+        data=DelistEventData,
+        offset_field='delist_event_excuted_offset',
+        state_field='delist_events_excuted_offset',
+        token=True,
+        columns=[
+            Column('offer_id', 'VARCHAR(78)', lambda event, data: data.offer_id),
+            Column('seller', 'VARCHAR(66)', lambda event, data: data.seller),
+            Column('quantity', 'VARCHAR(78)', lambda event, data: data.token_amount),
+            Column('timestamp', 'DATETIME(6)', lambda event, data: datetime_of(data.timestamp)),
+        ],
+        statements=[
+            "UPDATE {stage} s {token} JOIN AptosOrder o ON o.tokenId = t.id AND o.seqno = s.offer_id "
+            "SET o.status = 'CANCELED' WHERE o.status = 'LISTING'",
+            "INSERT IGNORE INTO AptosActivity (id, orderId, collectionId, tokenId, `from`, `to`, txHash, txType, quantity, price, priceValue, "
+            "txTimestamp) "
+            "SELECT s.id, '', t.collectionId, t.id, s.seller, '', s.version, 'CANCEL', s.quantity, '0', 0, s.timestamp FROM {stage} s {token}",
+        ],
+        refresh_cache=refresh_cache
+    )
+
+    def change(self, event: Event[DelistEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = DelistEventData(**event.data)
+        return change_of(
+            event,
+            'delist',
+            token_id=token_id,
+            collection_id=collection_id,
+            source=data.seller,
+            timestamp=int(data.timestamp)
+        )
 
     async def process_all(self, state: State, events: List[Event[DelistEvent]]) -> State:
         return await super().process_all(state, events)
@@ -22,7 +66,8 @@ class DelistEventObserver(Observer[DelistEvent]):
         data = DelistEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
 
-        token = await prisma_client.aptostoken.find_first(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -39,7 +84,8 @@ class DelistEventObserver(Observer[DelistEvent]):
             updated = await transaction.aptosorder.update_many(
                 where={
                     'status': enums.OrderStatus.LISTING,
-                    'tokenId': token.id
+                    'tokenId': token.id,
+                    'seqno': data.offer_id
                 },
                 data={
                     'status': enums.OrderStatus.CANCELED,
@@ -50,25 +96,39 @@ class DelistEventObserver(Observer[DelistEvent]):
                     f"[Delist Order]: Failed to update order status to CANCELED")
 
             # activity
-            result = await transaction.aptosactivity.create(
+            activityId = primary_key_of_event(event.version, event.guid, seqno)
+            result = await transaction.aptosactivity.upsert(
+                where={
+                    'id_txTimestamp': {
+                        'id': activityId,
+                        'txTimestamp': timestamp
+                    }
+                },
                 data={
-                    'id': new_uuid(),
-                    'orderId': "",
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'source': data.seller,
-                    'destination': "",
-                    'txHash': f'{event.version}',
-                    'txType': enums.TxType.CANCEL,
-                    'quantity': data.token_amount,
-                    'price': "0",
-                    'txTimestamp': timestamp
+                    'create': {
+                        'id': activityId,
+                        'orderId': "",
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'source': data.seller,
+                        'destination': "",
+                        'txHash': f'{event.version}',
+                        'txType': enums.TxType.CANCEL,
+                        'quantity': data.token_amount,
+                        'price': "0",
+                        'priceValue': price_value_of("0"),
+                        'txTimestamp': timestamp
+                    },
+                    'update': {}
                 }
             )
             if result == None or result.txType != enums.TxType.CANCEL:
                 raise Exception(
                     f"[Token Activity]: Failed to create new activity with delist event")
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             # seqno
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
@@ -80,8 +140,7 @@ class DelistEventObserver(Observer[DelistEvent]):
                 raise Exception(f"[Delist Order]: Failed to update offset")
 
             new_state.new_offset.delist_events_excuted_offset = updated_offset.delist_event_excuted_offset
-            
-            # delete cache
-            redis_cli.delete(f"cache:imart:aptosOrder:id:{token.id}")
-            redis_cli.delete(f"cache:imart:collectionstats:id:{token.collectionId}")
-            return new_state, True
+
+        # refresh cache once committed
+        refresh_cache(token.id, token.collectionId, int(event.version))
+        return new_state, True
@@ -1,17 +1,62 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from model.coin_type_info import CoinTypeInfo
 from model.token_id import TokenId, TokenDataId
-from observer.observer import Observer
+from observer.mapping import Column, Mapping, MappedObserver, datetime_of
 from model.order.list_event import ListEvent, ListEventData
-from model.state import State
+from model.state import State, read_client
+from model.change import Change, change_of
 from model.event import Event
 from common.db import prisma_client
 from prisma import enums
 from datetime import datetime
-from common.util import new_uuid
+from common.util import primary_key_of_event
+from common.currency import STAGE_CURRENCIES, STAGED_CURRENCY_ID, currencies, price_value_of
+from stats.rollup import add_rollup, rollup_time_of, staged_rollups
 
 
-class ListEventObserver(Observer[ListEvent]):
+class ListEventObserver(MappedObserver[ListEvent]):
+    mapping = Mapping(
+        name='List Order',
+        data=ListEventData,
+        offset_field='list_event_excuted_offset',
+        state_field='list_events_excuted_offset',
+        token=True,
+        columns=[
+            Column('offer_id', 'VARCHAR(78)', lambda event, data: data.offer_id),
+            Column('seller', 'VARCHAR(66)', lambda event, data: data.seller),
+            Column('price', 'VARCHAR(78)', lambda event, data: data.price),
+            Column('quantity', 'VARCHAR(78)', lambda event, data: data.token_amount),
+            Column('currency', 'VARCHAR(191)',
+                   lambda event, data: CoinTypeInfo(**data.coin_type_info).currency()),
+            Column('timestamp', 'DATETIME(6)', lambda event, data: datetime_of(data.timestamp)),
+            Column('at', 'DATETIME(6)', lambda event, data: rollup_time_of(data.timestamp)),
+        ],
+        statements=[
+            STAGE_CURRENCIES,
+            "INSERT IGNORE INTO AptosOrder (id, collectionId, tokenId, price, priceValue, quantity, seqno, seller, buyer, currency, currencyId, "
+            "status, createTime) "
+            "SELECT s.id, t.collectionId, t.id, s.price, CAST(s.price AS DECIMAL(38,0)), s.quantity, s.offer_id, s.seller, '', s.currency, "
+            f"{STAGED_CURRENCY_ID}, 'LISTING', s.timestamp FROM {{stage}} s {{token}}",
+            staged_rollups('LIST'),
+            "INSERT IGNORE INTO AptosActivity (id, orderId, collectionId, tokenId, `from`, `to`, txHash, txType, quantity, price, priceValue, "
+            "currency, currencyId, txTimestamp) "
+            "SELECT s.id, s.id, t.collectionId, t.id, s.seller, '', s.version, 'LIST', s.quantity, s.price, CAST(s.price AS DECIMAL(38,0)), "
+            f"s.currency, {STAGED_CURRENCY_ID}, s.timestamp FROM {{stage}} s {{token}}",
+        ]
+    )
+
+    def change(self, event: Event[ListEvent], token_id: Optional[str] = None, collection_id: Optional[str] = None) -> Change:
+        data = ListEventData(**event.data)
+        return change_of(
+            event,
+            'list',
+            token_id=token_id,
+            collection_id=collection_id,
+            price=data.price,
+            currency=CoinTypeInfo(**data.coin_type_info).currency(),
+            source=data.seller,
+            timestamp=int(data.timestamp)
+        )
 
     async def process_all(self, state: State, events: List[Event[ListEvent]]) -> State:
         return await super().process_all(state, events)
@@ -22,8 +67,10 @@ class ListEventObserver(Observer[ListEvent]):
         data = ListEventData(**event.data)
         token_data_id = TokenDataId(**TokenId(**data.token_id).token_data_id)
         coin_type_info = CoinTypeInfo(**data.coin_type_info)
+        currency_id = await currencies.id_of(coin_type_info.currency())
 
-        token = await prisma_client.aptostoken.find_first(where={
+        reader = await read_client(state, 'create_token_excuted_offset')
+        token = await reader.aptostoken.find_first(where={
             'name': token_data_id.name,
             'creator': token_data_id.creator,
             'collection': token_data_id.collection,
@@ -37,46 +84,73 @@ class ListEventObserver(Observer[ListEvent]):
             # order
             create_time = datetime.fromtimestamp(
                 float(data.timestamp) / 1000000)
-            orderId = new_uuid()
-            result = await transaction.aptosorder.create(
+            # keyed on the chain identity of the event, a replayed list event
+            # leaves the order as it is even if it was sold or canceled since
+            orderId = primary_key_of_event(event.version, event.guid, seqno)
+            result = await transaction.aptosorder.upsert(
+                where={
+                    'id': orderId
+                },
                 data={
-                    'id': orderId,
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'price': data.price,
-                    'quantity': data.token_amount,
-                    'seqno': data.offer_id,
-                    'seller': data.seller,
-                    'buyer': "",
-                    'currency': coin_type_info.currency(),
-                    'status': enums.OrderStatus.LISTING,
-                    'createTime': create_time
+                    'create': {
+                        'id': orderId,
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'price': data.price,
+                        'priceValue': price_value_of(data.price),
+                        'quantity': data.token_amount,
+                        'seqno': data.offer_id,
+                        'seller': data.seller,
+                        'buyer': "",
+                        'currency': coin_type_info.currency(),
+                        'currencyId': currency_id,
+                        'status': enums.OrderStatus.LISTING,
+                        'createTime': create_time
+                    },
+                    'update': {}
                 }
             )
-            if result == None or result.status != enums.OrderStatus.LISTING:
+            if result == None:
                 raise Exception(
                     f"[List Order]: Failed to create new order with list event({data})")
 
             # activity
-            result = await transaction.aptosactivity.create(
+            await add_rollup(transaction, orderId, 'LIST', token.collectionId, currency_id,
+                             price_value_of(data.price), data.timestamp)
+            result = await transaction.aptosactivity.upsert(
+                where={
+                    'id_txTimestamp': {
+                        'id': orderId,
+                        'txTimestamp': create_time
+                    }
+                },
                 data={
-                    'id': new_uuid(),
-                    'orderId': orderId,
-                    'collectionId': token.collectionId,
-                    'tokenId': token.id,
-                    'source': data.seller,
-                    'destination': "",
-                    'txHash': f'{event.version}',
-                    'txType': enums.TxType.LIST,
-                    'quantity': data.token_amount,
-                    'price': data.price,
-                    'txTimestamp': create_time
+                    'create': {
+                        'id': orderId,
+                        'orderId': orderId,
+                        'collectionId': token.collectionId,
+                        'tokenId': token.id,
+                        'source': data.seller,
+                        'destination': "",
+                        'txHash': f'{event.version}',
+                        'txType': enums.TxType.LIST,
+                        'quantity': data.token_amount,
+                        'price': data.price,
+                        'priceValue': price_value_of(data.price),
+                        'currency': coin_type_info.currency(),
+                        'currencyId': currency_id,
+                        'txTimestamp': create_time
+                    },
+                    'update': {}
                 }
             )
             if result == None or result.txType != enums.TxType.LIST:
                 raise Exception(
                     f"[Token Activity]: Failed to create new activity with list event({data})")
 
+            # change feed
+            await self.publish(transaction, [self.change(event, token.id, token.collectionId)])
+
             # seqno
             updated_offset = await transaction.eventoffset.update(
                 where={'id': 0},
@@ -0,0 +1,43 @@
+from datetime import datetime
+from typing import Optional
+from prisma import Prisma
+from common.util import primary_key_of_event
+from model.event import Event
+
+# Owners of a token over [fromVersion, toVersion), the current one open with
+# a NULL toVersion. Every transfer opens an interval keyed by its event id,
+# then each open interval of the token is closed at the next one by version,
+# whichever order the buy and accept offer streams apply them in.
+CLOSE_INTERVALS = (
+    "UPDATE TokenOwnership o JOIN ("
+    "SELECT prev.id, MIN(next.fromVersion) AS toVersion, MIN(next.fromTime) AS toTime FROM TokenOwnership prev "
+    "JOIN TokenOwnership next ON next.tokenId = prev.tokenId AND next.fromVersion > prev.fromVersion "
+    "WHERE prev.toVersion IS NULL AND prev.tokenId IN ({tokens}) GROUP BY prev.id"
+    ") n ON n.id = o.id SET o.toVersion = n.toVersion, o.toTime = n.toTime")
+
+# for the statements of a mapping, closes the intervals of the staged tokens
+CLOSE_STAGED_INTERVALS = CLOSE_INTERVALS.format(tokens='SELECT t.id FROM {stage} s {token}')
+
+
+async def record_owner(transaction: Prisma, event: Event, token_id: str, collection_id: str, owner: str, timestamp: Optional[datetime] = None):
+    interval_id = primary_key_of_event(event.version, event.guid, event.sequence_number)
+    result = await transaction.tokenownership.upsert(
+        where={
+            'id': interval_id
+        },
+        data={
+            'create': {
+                'id': interval_id,
+                'tokenId': token_id,
+                'collectionId': collection_id,
+                'owner': owner,
+                'fromVersion': int(event.version),
+                'fromTime': timestamp
+            },
+            'update': {}
+        }
+    )
+    if result == None:
+        raise Exception(
+            f'[Ownership]: Failed to record owner {owner} of token {token_id}')
+    await transaction.execute_raw(CLOSE_INTERVALS.format(tokens='?'), token_id)
@@ -0,0 +1,27 @@
+from decimal import Decimal
+from prisma import Prisma
+from common.currency import STAGED_CURRENCY_ID
+
+# All-time sales volume and count per collection and currency in
+# CollectionVolume, added in the transaction that records the SALE activity so
+# they commit with the event offset. `{sales}` selects rows of (collectionId,
+# currencyId, price); a sale whose activity exists already was counted before.
+ADD_VOLUMES = (
+    "INSERT INTO CollectionVolume (collectionId, currencyId, volume, sales) "
+    "SELECT v.collectionId, v.currencyId, SUM(v.price), COUNT(*) FROM ({sales}) v GROUP BY v.collectionId, v.currencyId "
+    "ON DUPLICATE KEY UPDATE volume = volume + VALUES(volume), sales = sales + VALUES(sales)")
+
+# for the statements of a mapping, run after STAGE_CURRENCIES and before the activities are inserted
+STAGED_VOLUMES = ADD_VOLUMES.format(sales=(
+    f"SELECT t.collectionId, {STAGED_CURRENCY_ID} AS currencyId, CAST(s.price AS DECIMAL(38,0)) AS price "
+    "FROM {stage} s {token} WHERE NOT EXISTS (SELECT 1 FROM AptosActivity a WHERE a.id = s.id)"))
+
+
+# run before the activity `activity_id` is inserted
+async def add_sale(transaction: Prisma, activity_id: str, collection_id: str, currency_id: int, price: Decimal):
+    rows = await transaction.query_raw("SELECT 1 AS found FROM AptosActivity WHERE id = ?", activity_id)
+    if len(rows) > 0:
+        return
+    await transaction.execute_raw(
+        ADD_VOLUMES.format(sales="SELECT ? AS collectionId, ? AS currencyId, CAST(? AS DECIMAL(38,0)) AS price"),
+        collection_id, currency_id, f'{price}')
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+from book.offer import offer_books
+from common.cache import cache_updater
+from common.db import prisma_client
+from common.keys import token_key
+from common.util import primary_key_of_collection, primary_key_of_token
+from config import config
+from model.change import Change
+from stats.gallery import ADD_GALLERY_MOVES, gallery_stats_mirror
+
+OFFER = 'offer'
+EXHIBIT = 'exhibit'
+CURATION_OFFER = 'curation_offer'
+
+# statuses flipped per kind, guarded by the status and the deadline stored so
+# a row closed, or listed again with a later expiry, since it was scheduled is kept
+EXPIRE_STATEMENTS = {
+    OFFER: "UPDATE AptosOffer SET status = 'EXPIRED' "
+           "WHERE id IN ({keys}) AND status = 'CREATED' AND endedAt <= ?",
+    EXHIBIT: "UPDATE CurationExhibit SET status = 'expired' "
+             "WHERE root = ? AND `index` IN ({keys}) AND status = 'listing' AND expiredAt <= ?",
+    CURATION_OFFER: "UPDATE CurationOffer SET status = 'expired' "
+                    "WHERE root = ? AND `index` IN ({keys}) AND status = 'pending' AND offerExpiredAt <= ?",
+}
+# the rows about to expire leave the figures of their gallery, run before
+# the statement above with the same arguments; expired rows are not counted
+GALLERY_MOVES = {
+    EXHIBIT: ADD_GALLERY_MOVES.format(
+        moves="SELECT root, galleryIndex, status, price, commissionFeeRate, -1 AS delta FROM CurationExhibit "
+              "WHERE root = ? AND `index` IN ({keys}) AND status = 'listing' AND expiredAt <= ?"),
+    CURATION_OFFER: ADD_GALLERY_MOVES.format(
+        moves="SELECT root, galleryIndex, status, price, commissionFeeRate, -1 AS delta FROM CurationOffer "
+              "WHERE root = ? AND `index` IN ({keys}) AND status = 'pending' AND offerExpiredAt <= ?"),
+}
+# curation tables whose galleries are mirrored once their rows expire
+GALLERY_TABLES = {
+    EXHIBIT: 'CurationExhibit',
+    CURATION_OFFER: 'CurationOffer',
+}
+# deadlines due within this window are flipped together
+BATCH_WINDOW = 1
+BATCH_SIZE = 500
+# upper bound of a sleep, so the clock is checked again now and then
+MAX_SLEEP = 60
+RETRY_BACKOFF = 5
+METRICS_INTERVAL = 60
+
+# (deadline in seconds, kind, key, token id, collection id)
+Expiry = Tuple[float, str, str, str, str]
+
+
+def seconds_of(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+# Moves market offers, curation offers and exhibits to their expired status
+# at their deadline. Upcoming deadlines are kept in a heap, loaded from the
+# open rows at start and fed by the committed create offer, exhibit list and
+# curation offer create changes.
+class ExpiryScheduler:
+
+    def __init__(self) -> None:
+        self.deadlines: List[Expiry] = []
+        self.wakeup = asyncio.Event()
+        self.scheduled = 0
+        self.expired = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    def schedule(self, expiry: Expiry):
+        heapq.heappush(self.deadlines, expiry)
+        self.scheduled += 1
+        if self.deadlines[0] is expiry:
+            self.wakeup.set()
+
+    def apply(self, change: Change):
+        if change.expiration == None:
+            return
+        deadline = change.expiration / 1000000
+        if change.type == 'create_offer':
+            self.schedule((deadline, OFFER, change.event_id, change.token_id, change.collection_id))
+        elif change.type == 'exhibit_list':
+            self.schedule((deadline, EXHIBIT, f'{change.curation_index}', change.token_id, change.collection_id))
+        elif change.type == 'curation_offer_create':
+            self.schedule((deadline, CURATION_OFFER, f'{change.curation_index}', change.token_id, change.collection_id))
+
+    async def load(self):
+        offers = await prisma_client.query_raw(
+            "SELECT id, tokenId, collectionId, CAST(endedAt AS CHAR) AS endedAt FROM AptosOffer WHERE status = 'CREATED'")
+        for row in offers:
+            self.schedule((seconds_of(row['endedAt']), OFFER, row['id'], row['tokenId'], row['collectionId']))
+        exhibits = await prisma_client.query_raw(
+            "SELECT `index`, collection, tokenCreator, tokenName, CAST(expiredAt AS CHAR) AS expiredAt FROM CurationExhibit "
+            "WHERE root = ? AND status = 'listing'", config.curation.address())
+        for row in exhibits:
+            self.schedule((seconds_of(row['expiredAt']), EXHIBIT, f"{row['index']}",
+                           primary_key_of_token(row['tokenCreator'], row['collection'], row['tokenName']),
+                           primary_key_of_collection(row['tokenCreator'], row['collection'])))
+        curation_offers = await prisma_client.query_raw(
+            "SELECT `index`, collection, tokenCreator, tokenName, CAST(offerExpiredAt AS CHAR) AS offerExpiredAt FROM CurationOffer "
+            "WHERE root = ? AND status = 'pending'", config.curation.address())
+        for row in curation_offers:
+            self.schedule((seconds_of(row['offerExpiredAt']), CURATION_OFFER, f"{row['index']}",
+                           primary_key_of_token(row['tokenCreator'], row['collection'], row['tokenName']),
+                           primary_key_of_collection(row['tokenCreator'], row['collection'])))
+        logging.info(
+            f'[Expiry]: scheduled {len(offers)} offers, {len(exhibits)} exhibits, {len(curation_offers)} curation offers')
+
+    # plain values for book/snapshot.py
+    def dump(self) -> dict:
+        return {'deadlines': self.deadlines}
+
+    def restore(self, dumped: dict):
+        self.deadlines = dumped['deadlines']
+        self.wakeup.set()
+
+    def due(self, now: float) -> List[Expiry]:
+        expiries = []
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now and len(expiries) < BATCH_SIZE:
+            expiries.append(heapq.heappop(self.deadlines))
+        return expiries
+
+    async def run(self):
+        while True:
+            # set again by a deadline scheduled from here on
+            self.wakeup.clear()
+            now = time.time()
+            expiries = self.due(now)
+            if len(expiries) > 0:
+                try:
+                    await self.expire(expiries)
+                except Exception as err:
+                    self.failures += 1
+                    for expiry in expiries:
+                        heapq.heappush(self.deadlines, expiry)
+                    logging.error(f'[Expiry]: Failed to expire {len(expiries)} rows: {err}')
+                    await asyncio.sleep(RETRY_BACKOFF)
+                self.report()
+                continue
+            timeout = MAX_SLEEP if len(self.deadlines) == 0 else \
+                min(MAX_SLEEP, self.deadlines[0][0] - now + BATCH_WINDOW)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def expire(self, expiries: List[Expiry]):
+        by_kind: Dict[str, List[Expiry]] = {}
+        for expiry in expiries:
+            by_kind.setdefault(expiry[1], []).append(expiry)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        async with prisma_client.tx(timeout=60000) as transaction:
+            for kind, kind_expiries in by_kind.items():
+                keys = [expiry[2] for expiry in kind_expiries]
+                sql = EXPIRE_STATEMENTS[kind].format(keys=', '.join(['?'] * len(keys)))
+                if kind == OFFER:
+                    args = [*keys, now]
+                else:
+                    args = [config.curation.address(), *[int(key) for key in keys], now]
+                if kind in GALLERY_MOVES:
+                    await transaction.execute_raw(
+                        GALLERY_MOVES[kind].format(keys=', '.join(['?'] * len(keys))), *args)
+                self.expired += await transaction.execute_raw(sql, *args)
+
+        # once committed
+        for kind, kind_expiries in by_kind.items():
+            if kind in GALLERY_TABLES:
+                gallery_stats_mirror.expired(GALLERY_TABLES[kind], [int(expiry[2]) for expiry in kind_expiries])
+        for (_, kind, key, token_id, collection_id) in expiries:
+            if kind == OFFER:
+                offer_books.close(key)
+            if token_id != None:
+                cache_updater.invalidate(token_key(token_id, collection_id))
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Expiry]: scheduled {self.scheduled}, expired {self.expired}, failures {self.failures}, pending {len(self.deadlines)}')
+
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import List
+from common.activity import (ACTIVITY_COLUMNS, ACTIVITY_TABLE, ARCHIVE_TABLE, month_of, partition_of,
+                             retention_cutoff)
+from common.db import prisma_client
+
+# monthly partitions kept ready ahead of the current month
+PARTITIONS_AHEAD = 3
+# catch-all partition, split when a new month is added
+MAX_PARTITION = 'pmax'
+CHECK_INTERVAL = 3600
+METRICS_INTERVAL = 60
+
+PARTITIONS = (
+    "SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS "
+    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND PARTITION_NAME IS NOT NULL "
+    "ORDER BY PARTITION_ORDINAL_POSITION")
+
+
+def bound_of(month: datetime) -> str:
+    return month_of(month, 1).strftime('%Y-%m-%d')
+
+
+def definition_of(month: datetime) -> str:
+    return f"PARTITION {partition_of(month)} VALUES LESS THAN ('{bound_of(month)}')"
+
+
+# Keeps AptosActivity partitioned by month of txTimestamp, see
+# bin/activity_partitions.py for the conversion. New activities always land in
+# the partition of the current month; partitions are added ahead of time by
+# splitting the catch-all one, and the months past the retention window are
+# copied to AptosActivityArchive then dropped, a cheap metadata change instead
+# of a large DELETE. A copy interrupted halfway is run again, duplicates are
+# ignored by the primary key.
+class ActivityPartitions:
+
+    def __init__(self) -> None:
+        self.added = 0
+        self.archived = 0
+        self.dropped = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    async def partitions(self) -> List[str]:
+        rows = await prisma_client.query_raw(PARTITIONS, ACTIVITY_TABLE)
+        return [row['name'] for row in rows]
+
+    async def run(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as err:
+                self.failures += 1
+                logging.error(f'[Partitions]: Failed to maintain {ACTIVITY_TABLE} partitions: {err}')
+            self.report()
+            await asyncio.sleep(CHECK_INTERVAL)
+
+    async def maintain(self):
+        names = await self.partitions()
+        if len(names) == 0:
+            # not partitioned yet
+            return
+        monthly = [datetime.strptime(name, 'p%Y%m') for name in names if name != MAX_PARTITION]
+        now = datetime.now()
+        # months after the last partition, the earlier ones are covered already
+        missing = [month_of(now, i) for i in range(PARTITIONS_AHEAD + 1)
+                   if len(monthly) == 0 or month_of(now, i) > max(monthly)]
+        if len(missing) > 0 and MAX_PARTITION in names:
+            await prisma_client.execute_raw(
+                f"ALTER TABLE {ACTIVITY_TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO "
+                f"({', '.join(definition_of(month) for month in missing)}, "
+                f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE))")
+            self.added += len(missing)
+            logging.info(f'[Partitions]: added {", ".join(partition_of(month) for month in missing)}')
+
+        cutoff = retention_cutoff(now)
+        if cutoff == None:
+            return
+        # months entirely before the cutoff, always the oldest partitions
+        for month in monthly:
+            if month_of(month, 1) <= cutoff:
+                await self.archive(partition_of(month))
+
+    async def archive(self, name: str):
+        copied = await prisma_client.execute_raw(
+            f"INSERT IGNORE INTO {ARCHIVE_TABLE} ({ACTIVITY_COLUMNS}) "
+            f"SELECT {ACTIVITY_COLUMNS} FROM {ACTIVITY_TABLE} PARTITION ({name})")
+        await prisma_client.execute_raw(f"ALTER TABLE {ACTIVITY_TABLE} DROP PARTITION {name}")
+        self.archived += copied
+        self.dropped += 1
+        logging.info(f'[Partitions]: archived {copied} activities of {name}')
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Partitions]: added {self.added}, dropped {self.dropped}, archived {self.archived}, failures {self.failures}')
+
+
+activity_partitions = ActivityPartitions()
@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from book.listing import listing_books
+from common.currency import APTOS_COIN, currencies, currency_name_of, price_value_of
+from common.db import prisma_client
+from model.change import Change
+
+DAY = 24 * 3600
+WEEK = 7 * DAY
+# stats changed within this window are persisted in one transaction
+PERSIST_INTERVAL = 5
+METRICS_INTERVAL = 60
+
+
+def amount_of(value: Optional[str]) -> int:
+    return int(value or 0)
+
+
+def datetime_since(seconds: int) -> str:
+    return datetime.fromtimestamp(time.time() - seconds).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+@dataclass
+class CollectionStats:
+    collection_id: str
+    # all-time (volume, sales) by currency, as committed in CollectionVolume
+    totals: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    # windows of the sales in APT
+    volume_24h: int = 0
+    volume_7d: int = 0
+    # (seconds, price) of the sales still inside each window, oldest on top
+    day: List[Tuple[float, int]] = field(default_factory=list)
+    week: List[Tuple[float, int]] = field(default_factory=list)
+
+    # stats in CollectionStats and Collection.volume are in APT
+    @property
+    def volume(self) -> int:
+        return self.totals.get(APTOS_COIN, (0, 0))[0]
+
+    @property
+    def sales(self) -> int:
+        return self.totals.get(APTOS_COIN, (0, 0))[1]
+
+    def floor_price(self) -> Optional[int]:
+        return listing_books.floor(self.collection_id)
+
+    def listed_count(self) -> int:
+        return listing_books.count(self.collection_id)
+
+    def sell(self, seconds: float, currency: str, price: int, total: bool = True):
+        if total:
+            (volume, sales) = self.totals.get(currency, (0, 0))
+            self.totals[currency] = (volume + price, sales + 1)
+        if currency != APTOS_COIN:
+            return
+        now = time.time()
+        if seconds > now - WEEK:
+            heapq.heappush(self.week, (seconds, price))
+            self.volume_7d += price
+        if seconds > now - DAY:
+            heapq.heappush(self.day, (seconds, price))
+            self.volume_24h += price
+
+    # drops the sales that left the windows, True when a volume changed
+    def expire(self, now: float) -> bool:
+        expired = False
+        while len(self.day) > 0 and self.day[0][0] <= now - DAY:
+            self.volume_24h -= heapq.heappop(self.day)[1]
+            expired = True
+        while len(self.week) > 0 and self.week[0][0] <= now - WEEK:
+            self.volume_7d -= heapq.heappop(self.week)[1]
+            expired = True
+        return expired
+
+    def payload(self) -> dict:
+        return {
+            'id': self.collection_id,
+            'floor_price': f'{self.floor_price() or 0}',
+            'listed_count': self.listed_count(),
+            'volume': f'{self.volume}',
+            'volume_24h': f'{self.volume_24h}',
+            'volume_7d': f'{self.volume_7d}',
+            'sales': self.sales,
+            'volumes': {currency: {'volume': f'{volume}', 'sales': sales}
+                        for currency, (volume, sales) in self.totals.items()},
+        }
+
+
+# Keeps the stats of every collection up to date from committed list, delist,
+# buy and accept offer changes, persisting the changed ones every interval.
+# The all-time totals are committed with each sale in CollectionVolume (see
+# observer/volume.py) and loaded from it at start, the windows from the sales
+# of the week, so a restart loses nothing; bin/collection_stats.py rebuilds
+# them from history.
+class CollectionStatsMaterializer:
+
+    def __init__(self) -> None:
+        self.stats: Dict[str, CollectionStats] = {}
+        self.dirty: Set[str] = set()
+        self.loaded = False
+        self.applied = 0
+        self.persisted = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    def of(self, collection_id: str) -> CollectionStats:
+        stats = self.stats.get(collection_id)
+        if stats == None:
+            stats = CollectionStats(collection_id)
+            self.stats[collection_id] = stats
+        return stats
+
+    def apply(self, change: Change):
+        if change.collection_id == None:
+            return
+        # floor and listed count are read from the listing book
+        if change.type == 'buy' or change.type == 'accept_offer':
+            self.of(change.collection_id).sell(
+                change.timestamp / 1000000, currency_name_of(change.currency or ''), amount_of(change.price))
+        elif change.type != 'list' and change.type != 'delist':
+            return
+        self.applied += 1
+        self.dirty.add(change.collection_id)
+
+    # totals from CollectionVolume, windows from the sales of the week
+    async def load(self):
+        totals = await prisma_client.query_raw(
+            "SELECT v.collectionId, c.name, CAST(v.volume AS CHAR) AS volume, v.sales "
+            "FROM CollectionVolume v JOIN Currency c ON c.id = v.currencyId")
+        for row in totals:
+            self.of(row['collectionId']).totals[row['name']] = (amount_of(row['volume']), row['sales'])
+        # activities without a currency id predate them, all in APT
+        aptos_coin_id = await currencies.id_of(APTOS_COIN)
+        sales = await prisma_client.query_raw(
+            "SELECT collectionId, price, CAST(txTimestamp AS CHAR) AS txTimestamp FROM AptosActivity "
+            "WHERE txType = 'SALE' AND txTimestamp > ? AND COALESCE(currencyId, ?) = ?",
+            datetime_since(WEEK), aptos_coin_id, aptos_coin_id)
+        for row in sales:
+            seconds = datetime.fromisoformat(row['txTimestamp']).timestamp()
+            self.of(row['collectionId']).sell(seconds, APTOS_COIN, amount_of(row['price']), total=False)
+        self.loaded = True
+        logging.info(
+            f'[Collection stats]: loaded {len(self.stats)} collections, {len(sales)} sales of the week')
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(PERSIST_INTERVAL)
+            now = time.time()
+            for stats in self.stats.values():
+                if stats.expire(now):
+                    self.dirty.add(stats.collection_id)
+            try:
+                await self.persist()
+            except Exception as err:
+                self.failures += 1
+                logging.error(f'[Collection stats]: Failed to persist stats: {err}')
+            self.report()
+
+    async def persist(self):
+        if len(self.dirty) == 0:
+            return
+        # changes applied while persisting stay dirty for the next round
+        dirty = self.dirty
+        self.dirty = set()
+        try:
+            async with prisma_client.tx(timeout=60000) as transaction:
+                for collection_id in dirty:
+                    stats = self.of(collection_id)
+                    floor_price = f'{stats.floor_price() or 0}'
+                    data = {
+                        'floorPrice': floor_price,
+                        'volume': f'{stats.volume}',
+                        'volume24h': f'{stats.volume_24h}',
+                        'volume7d': f'{stats.volume_7d}',
+                        'sales': stats.sales,
+                        'listedCount': stats.listed_count(),
+                    }
+                    await transaction.collectionstats.upsert(
+                        where={'collectionId': collection_id},
+                        data={
+                            'create': {'collectionId': collection_id, **data},
+                            'update': data
+                        }
+                    )
+                    await transaction.collection.update_many(
+                        where={'id': collection_id},
+                        data={
+                            'volume': f'{stats.volume}',
+                            'floorPrice': floor_price,
+                            'floorPriceValue': price_value_of(floor_price),
+                        }
+                    )
+        except Exception:
+            self.dirty.update(dirty)
+            raise
+        self.persisted += len(dirty)
+
+    def payload(self, collection_id: str) -> Optional[dict]:
+        if not self.loaded:
+            return None
+        return self.of(collection_id).payload()
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Collection stats]: applied {self.applied}, persisted {self.persisted}, failures {self.failures}, pending {len(self.dirty)}')
+
+
+collection_stats = CollectionStatsMaterializer()
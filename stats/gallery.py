@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from prisma import Prisma
+from common.cache import cache_updater
+from common.db import prisma_client
+from common.keys import gallery_stats_key
+from config import config
+from model.change import Change
+
+# Exhibit and pending offer counts, sales volume and commission of a gallery,
+# moved in the transaction of each curation event by the rows it changes:
+# every row leaves the figures of its old status (delta -1) and enters those
+# of its new one (delta +1), read from the rows before they are written.
+# bin/gallery_stats.py recomputes them from scratch. `moves` selects (root,
+# galleryIndex, status, price, commissionFeeRate, delta); offers are never
+# sold, so their price adds to no volume.
+ADD_GALLERY_MOVES = (
+    "INSERT INTO GalleryStats (root, galleryIndex, listing, frozen, sold, redeemed, pendingOffers, volume, commission) "
+    "SELECT m.root, m.galleryIndex, SUM(m.delta * (m.status = 'listing')), SUM(m.delta * (m.status = 'frozen')), "
+    "SUM(m.delta * (m.status = 'sold')), SUM(m.delta * (m.status = 'redeemed')), SUM(m.delta * (m.status = 'pending')), "
+    "CAST(SUM(m.delta * (m.status = 'sold') * CAST(m.price AS DECIMAL(38,0))) AS CHAR), "
+    # commissionFeeRate is the fee rate times 10^8
+    "CAST(SUM(m.delta * (m.status = 'sold') * FLOOR(CAST(m.price AS DECIMAL(38,0)) * CAST(m.commissionFeeRate AS DECIMAL(38,0)) / 100000000)) AS CHAR) "
+    "FROM ({moves}) m GROUP BY m.root, m.galleryIndex "
+    "ON DUPLICATE KEY UPDATE listing = listing + VALUES(listing), frozen = frozen + VALUES(frozen), sold = sold + VALUES(sold), "
+    "redeemed = redeemed + VALUES(redeemed), pendingOffers = pendingOffers + VALUES(pendingOffers), "
+    "volume = CAST(CAST(volume AS DECIMAL(38,0)) + CAST(VALUES(volume) AS DECIMAL(38,0)) AS CHAR), "
+    "commission = CAST(CAST(commission AS DECIMAL(38,0)) + CAST(VALUES(commission) AS DECIMAL(38,0)) AS CHAR)")
+
+# joined to a row to emit it once leaving (-1) and once entering (+1)
+BOTH_DELTAS = "(SELECT -1 AS delta UNION ALL SELECT 1 AS delta) d"
+
+MOVE = "SELECT ? AS root, ? AS galleryIndex, ? AS status, ? AS price, ? AS commissionFeeRate, ? AS delta"
+
+# an empty row for a new gallery, so it is read back before its first exhibit
+ADD_GALLERY = "INSERT IGNORE INTO GalleryStats (root, galleryIndex) VALUES (?, ?)"
+ADD_STAGED_GALLERIES = "INSERT IGNORE INTO GalleryStats (root, galleryIndex) SELECT s.root, CAST(s.`index` AS CHAR) FROM {stage} s"
+
+# gallery of the rows of each curation table
+GALLERY_OF = {
+    'CurationExhibit': 'r.galleryIndex',
+    'CurationOffer': 'r.galleryIndex',
+    'CurationGallery': 'CAST(r.`index` AS CHAR)',
+}
+
+TABLE_OF_CHANGE = {
+    'exhibit_list': 'CurationExhibit',
+    'exhibit_cancel': 'CurationExhibit',
+    'exhibit_freeze': 'CurationExhibit',
+    'exhibit_buy': 'CurationExhibit',
+    'exhibit_redeem': 'CurationExhibit',
+    'curation_offer_create': 'CurationOffer',
+    'curation_offer_accept': 'CurationOffer',
+    'curation_offer_reject': 'CurationOffer',
+    'curation_offer_cancel': 'CurationOffer',
+    'gallery_create': 'CurationGallery',
+}
+
+MIRROR_INTERVAL = 0.5
+
+
+# for the statements of a mapping, run before the rows of the last staged
+# event per index are set to `status`
+def move_staged_status(table: str, status: str) -> str:
+    return ADD_GALLERY_MOVES.format(moves=(
+        f"SELECT r.root, r.galleryIndex, IF(d.delta = 1, '{status}', r.status) AS status, r.price, r.commissionFeeRate, d.delta "
+        f"FROM {table} r JOIN {{stage}} s ON r.`index` = s.`index` AND r.root = s.root JOIN {BOTH_DELTAS} "
+        f"WHERE s.latest = 1 AND r.status <> '{status}'"))
+
+
+# for the statements of a mapping, run before the staged events are written
+# to `table` with `status` when newer than the row; `values` are the staged
+# (galleryIndex, price, commissionFeeRate) of the row written
+def move_staged_writes(table: str, status: str, values: Tuple[str, str, str]) -> str:
+    (gallery_index, price, commission_fee_rate) = values
+    return ADD_GALLERY_MOVES.format(moves=(
+        f"SELECT s.root, IF(d.delta = 1, {gallery_index}, r.galleryIndex) AS galleryIndex, "
+        f"IF(d.delta = 1, '{status}', r.status) AS status, IF(d.delta = 1, {price}, r.price) AS price, "
+        f"IF(d.delta = 1, {commission_fee_rate}, r.commissionFeeRate) AS commissionFeeRate, d.delta "
+        f"FROM {{stage}} s LEFT JOIN {table} r ON r.`index` = s.`index` AND r.root = s.root JOIN {BOTH_DELTAS} "
+        f"WHERE s.latest = 1 AND (r.id IS NULL AND d.delta = 1 OR CAST(s.version AS UNSIGNED) > r.eventVersion)"))
+
+
+# a curation exhibit or offer went from `old` to `new`, None when it did not
+# exist before
+async def move_gallery_stats(transaction: Prisma, old, new):
+    moves = [(row, delta) for (row, delta) in ((old, -1), (new, 1)) if row != None]
+    await transaction.execute_raw(
+        ADD_GALLERY_MOVES.format(moves=' UNION ALL '.join([MOVE] * len(moves))),
+        *[value for (row, delta) in moves
+          for value in (row.root, row.galleryIndex, row.status.value, row.price, row.commissionFeeRate, delta)])
+
+
+async def add_gallery(transaction: Prisma, index: int):
+    await transaction.execute_raw(ADD_GALLERY, config.curation.address(), f'{index}')
+
+
+async def gallery_stats_payload(gallery_index: str) -> dict:
+    stats = await prisma_client.gallerystats.find_unique(where={
+        'root_galleryIndex': {
+            'root': config.curation.address(),
+            'galleryIndex': gallery_index
+        }
+    })
+    return None if stats == None else stats.dict()
+
+
+# Mirrors the stats of the galleries touched by committed curation changes to
+# the cache. Offer cancel and reject events carry no gallery, so the galleries
+# are looked up by the indexes of the changed rows.
+class GalleryStatsMirror:
+
+    def __init__(self) -> None:
+        # curation index and chain version per table, no version for the
+        # rows expired off chain, whose galleries are invalidated instead
+        self.pending: Dict[str, List[Tuple[int, Optional[int]]]] = {}
+        self.wakeup = asyncio.Event()
+
+    def apply(self, change: Change):
+        table = TABLE_OF_CHANGE.get(change.type)
+        if table == None or change.curation_index == None:
+            return
+        self.pending.setdefault(table, []).append((change.curation_index, change.version))
+        self.wakeup.set()
+
+    def expired(self, table: str, indexes: List[int]):
+        self.pending.setdefault(table, []).extend([(index, None) for index in indexes])
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(MIRROR_INTERVAL)
+            self.wakeup.clear()
+            pending = self.pending
+            self.pending = {}
+            try:
+                await self.mirror(pending)
+            except Exception as err:
+                logging.error(f'[Gallery stats]: Failed to mirror stats: {err}')
+
+    async def mirror(self, pending: Dict[str, List[Tuple[int, Optional[int]]]]):
+        versions: Dict[str, int] = {}
+        invalidated = set()
+        for table, changed in pending.items():
+            indexes = list({index for (index, _) in changed})
+            rows = await prisma_client.query_raw(
+                f"SELECT r.`index` AS idx, {GALLERY_OF[table]} AS galleryIndex FROM {table} r "
+                f"WHERE r.root = ? AND r.`index` IN ({', '.join(['?'] * len(indexes))})",
+                config.curation.address(), *indexes)
+            gallery_of = {int(row['idx']): row['galleryIndex'] for row in rows}
+            for (index, version) in changed:
+                gallery_index = gallery_of.get(index)
+                if gallery_index == None:
+                    continue
+                if version == None:
+                    invalidated.add(gallery_index)
+                else:
+                    versions[gallery_index] = max(versions.get(gallery_index, version), version)
+        cache_updater.invalidate(*[gallery_stats_key(gallery_index) for gallery_index in invalidated])
+        for gallery_index, version in versions.items():
+            if gallery_index in invalidated:
+                continue
+            cache_updater.refresh(gallery_stats_key(gallery_index), version,
+                                  lambda gallery_index=gallery_index: gallery_stats_payload(gallery_index))
+
+
+gallery_stats_mirror = GalleryStatsMirror()
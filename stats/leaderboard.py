@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from common.currency import APTOS_COIN, currency_name_of
+from common.keys import leaderboard_key, leaderboard_seen_key, leaderboard_window_key
+from common.redis import redis_async
+from model.change import Change
+
+COLLECTIONS = 'collections'
+BUYERS = 'buyers'
+SELLERS = 'sellers'
+
+# window: (granularity, buckets merged)
+WINDOWS = {
+    '24h': ('h', 24),
+    '7d': ('d', 7),
+    '30d': ('d', 30),
+}
+BUCKET_PATTERNS = {'h': '%Y%m%d%H', 'd': '%Y%m%d'}
+BUCKET_TTL = {'h': 25 * 3600, 'd': 31 * 24 * 3600}
+# a merged window is reused for this long
+WINDOW_TTL = 60
+# a sale applied twice within this long is counted once
+SEEN_TTL = 7 * 24 * 3600
+FLUSH_INTERVAL = 0.2
+FLUSH_RETRIES = 5
+RETRY_BACKOFF = 0.1
+METRICS_INTERVAL = 60
+
+# KEYS: events seen that day, then hour and day bucket of collections, buyers, sellers
+# ARGV: event id, price, collection id, buyer, seller, seen ttl, hour ttl, day ttl
+SALE_SCRIPT = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+local members = {ARGV[3], ARGV[3], ARGV[4], ARGV[4], ARGV[5], ARGV[5]}
+for i = 1, 6 do
+    redis.call('ZINCRBY', KEYS[i + 1], ARGV[2], members[i])
+    redis.call('EXPIRE', KEYS[i + 1], i % 2 == 1 and ARGV[7] or ARGV[8])
+end
+return 1
+"""
+
+
+def bucket_of(granularity: str, at: datetime) -> str:
+    return at.strftime(BUCKET_PATTERNS[granularity])
+
+
+# Sales volume rankings of collections, buyers and sellers over rolling
+# windows, kept in hour and day bucketed sorted sets that expire on their own.
+class Leaderboards:
+
+    def __init__(self) -> None:
+        self.sales: List[Change] = []
+        self.wakeup = asyncio.Event()
+        self.applied = 0
+        self.duplicates = 0
+        self.retries = 0
+        self.dropped = 0
+        self.reported_at = time.monotonic()
+
+    # prices of other coins are not comparable, the boards rank APT sales only
+    def apply(self, change: Change):
+        if change.collection_id == None or change.timestamp == None:
+            return
+        if change.type != 'buy' and change.type != 'accept_offer':
+            return
+        if currency_name_of(change.currency or '') != APTOS_COIN:
+            return
+        self.sales.append(change)
+        self.wakeup.set()
+
+    def keys_of(self, change: Change) -> List[str]:
+        at = datetime.utcfromtimestamp(change.timestamp / 1000000)
+        keys = [leaderboard_seen_key(bucket_of('d', at))]
+        for board in (COLLECTIONS, BUYERS, SELLERS):
+            for granularity in ('h', 'd'):
+                keys.append(leaderboard_key(board, granularity, bucket_of(granularity, at)))
+        return keys
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            sales = self.sales
+            self.sales = []
+            await self.flush(sales)
+            self.report()
+
+    async def flush(self, sales: List[Change]):
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                async with redis_async.pipeline(transaction=False) as pipe:
+                    for change in sales:
+                        pipe.eval(SALE_SCRIPT, 7, *self.keys_of(change),
+                                  change.event_id, change.price or 0, change.collection_id,
+                                  change.destination or '', change.source or '',
+                                  SEEN_TTL, BUCKET_TTL['h'], BUCKET_TTL['d'])
+                    results = await pipe.execute()
+                self.applied += sum(results)
+                self.duplicates += len(results) - sum(results)
+                return
+            except Exception as err:
+                # sales already applied are skipped by the seen set of their day
+                self.retries += 1
+                logging.warning(
+                    f'[Leaderboard]: Failed to apply {len(sales)} sales (attempt {attempt + 1}): {err}')
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        self.dropped += len(sales)
+        logging.error(f'[Leaderboard]: Gave up applying {len(sales)} sales')
+
+    # top `n` members of `board` by volume over `window`, best first; the
+    # buckets sit in the slots of their days, they are summed here
+    async def top(self, board: str, window: str, n: int) -> List[Tuple[str, float]]:
+        key = leaderboard_window_key(board, window)
+        if not await redis_async.exists(key):
+            (granularity, count) = WINDOWS[window]
+            delta = timedelta(hours=1) if granularity == 'h' else timedelta(days=1)
+            now = datetime.utcnow()
+            async with redis_async.pipeline(transaction=False) as pipe:
+                for i in range(count):
+                    pipe.zrange(leaderboard_key(board, granularity, bucket_of(granularity, now - delta * i)),
+                                0, -1, withscores=True)
+                buckets = await pipe.execute()
+            scores: Dict[bytes, float] = {}
+            for members in buckets:
+                for (member, score) in members:
+                    scores[member] = scores.get(member, 0) + score
+            async with redis_async.pipeline(transaction=False) as pipe:
+                pipe.delete(key)
+                if len(scores) > 0:
+                    pipe.zadd(key, scores)
+                pipe.expire(key, WINDOW_TTL)
+                await pipe.execute()
+        members = await redis_async.zrevrange(key, 0, n - 1, withscores=True)
+        return [(member.decode('utf-8'), score) for (member, score) in members]
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Leaderboard]: applied {self.applied}, duplicates {self.duplicates}, retries {self.retries}, dropped {self.dropped}, pending {len(self.sales)}')
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,58 @@
+from datetime import datetime
+from decimal import Decimal
+from prisma import Prisma
+from common.currency import STAGED_CURRENCY_ID
+
+# bucket of each granularity in UTC, as DATE_FORMAT patterns of MySQL and strftime's
+GRANULARITIES = {
+    'MINUTE': ('%Y-%m-%d %H:%i:00', '%Y-%m-%d %H:%M:00'),
+    'HOUR': ('%Y-%m-%d %H:00:00', '%Y-%m-%d %H:00:00'),
+    'DAY': ('%Y-%m-%d 00:00:00', '%Y-%m-%d 00:00:00'),
+}
+
+ROLLUP_GRANULARITIES = ' UNION ALL '.join(
+    [f"SELECT '{granularity}' AS granularity, '{pattern}' AS pattern" for granularity, (pattern, _) in GRANULARITIES.items()])
+
+# Minute, hour and day rollups of sales and listings per collection and
+# currency id in CollectionRollup, added in the transaction that records the
+# SALE or LIST activity so they commit with the event offset, and rebuilt by
+# bin/collection_rollups.py. `{activities}` selects rows of (collectionId,
+# currencyId, txType, price, at), `at` in UTC; an activity that exists already
+# was counted before. Average price is volume / sales.
+ADD_ROLLUPS = (
+    "INSERT INTO CollectionRollup (collectionId, currencyId, granularity, bucket, volume, sales, minPrice, maxPrice, listings) "
+    "SELECT v.collectionId, v.currencyId, g.granularity, DATE_FORMAT(v.at, g.pattern) AS rollupBucket, "
+    "COALESCE(SUM(IF(v.txType = 'SALE', v.price, NULL)), 0), SUM(v.txType = 'SALE'), "
+    "MIN(IF(v.txType = 'SALE', v.price, NULL)), MAX(IF(v.txType = 'SALE', v.price, NULL)), SUM(v.txType = 'LIST') "
+    f"FROM ({{activities}}) v JOIN ({ROLLUP_GRANULARITIES}) g "
+    "GROUP BY v.collectionId, v.currencyId, g.granularity, rollupBucket "
+    "ON DUPLICATE KEY UPDATE volume = volume + VALUES(volume), sales = sales + VALUES(sales), "
+    "minPrice = COALESCE(LEAST(minPrice, VALUES(minPrice)), minPrice, VALUES(minPrice)), "
+    "maxPrice = COALESCE(GREATEST(maxPrice, VALUES(maxPrice)), maxPrice, VALUES(maxPrice)), "
+    "listings = listings + VALUES(listings)")
+
+
+# UTC time of the microseconds carried by the market events, staged as `at`
+def rollup_time_of(microseconds: str) -> str:
+    return datetime.utcfromtimestamp(float(microseconds) / 1000000).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+# for the statements of a mapping, run after STAGE_CURRENCIES and before the
+# `tx_type` activities are inserted
+def staged_rollups(tx_type: str) -> str:
+    return ADD_ROLLUPS.format(activities=(
+        f"SELECT t.collectionId, {STAGED_CURRENCY_ID} AS currencyId, '{tx_type}' AS txType, "
+        "CAST(s.price AS DECIMAL(38,0)) AS price, s.at FROM {stage} s {token} "
+        "WHERE NOT EXISTS (SELECT 1 FROM AptosActivity a WHERE a.id = s.id)"))
+
+
+# run before the activity `activity_id` is inserted
+async def add_rollup(transaction: Prisma, activity_id: str, tx_type: str, collection_id: str, currency_id: int,
+                     price: Decimal, microseconds: str):
+    rows = await transaction.query_raw("SELECT 1 AS found FROM AptosActivity WHERE id = ?", activity_id)
+    if len(rows) > 0:
+        return
+    await transaction.execute_raw(
+        ADD_ROLLUPS.format(activities="SELECT ? AS collectionId, ? AS currencyId, ? AS txType, "
+                           "CAST(? AS DECIMAL(38,0)) AS price, CAST(? AS DATETIME(6)) AS at"),
+        collection_id, currency_id, tx_type, f'{price}', rollup_time_of(microseconds))
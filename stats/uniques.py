@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+from common.keys import unique_key
+from common.redis import redis_async
+from model.change import Change
+
+OWNERS = 'owners'
+BUYERS = 'buyers'
+SELLERS = 'sellers'
+
+# addresses added within this window go out in one pipeline
+FLUSH_INTERVAL = 0.5
+# day buckets are kept for the longest window counted
+DAY_BUCKETS = 30
+METRICS_INTERVAL = 60
+
+
+def day_of(seconds: float) -> str:
+    return datetime.utcfromtimestamp(seconds).strftime('%Y%m%d')
+
+
+# Approximate unique owners, buyers and sellers per collection, all time and
+# per UTC day, kept in Redis HyperLogLogs. Owners count every address a token
+# of the collection was minted or sold to, HyperLogLogs can not forget one.
+class UniqueCounter:
+
+    def __init__(self) -> None:
+        self.pending: Dict[str, Set[str]] = {}
+        self.wakeup = asyncio.Event()
+        self.added = 0
+        self.flushes = 0
+        self.failures = 0
+        self.reported_at = time.monotonic()
+
+    def add(self, collection_id: str, kind: str, address: Optional[str], seconds: float):
+        if address == None or address == '':
+            return
+        for key in (unique_key(collection_id, kind), unique_key(collection_id, kind, day_of(seconds))):
+            self.pending.setdefault(key, set()).add(address)
+        self.added += 1
+        self.wakeup.set()
+
+    def apply(self, change: Change):
+        if change.collection_id == None:
+            return
+        seconds = change.timestamp / 1000000 if change.timestamp != None else time.time()
+        if change.type == 'create_token':
+            self.add(change.collection_id, OWNERS, change.destination, seconds)
+        elif change.type == 'buy' or change.type == 'accept_offer':
+            self.add(change.collection_id, OWNERS, change.destination, seconds)
+            self.add(change.collection_id, BUYERS, change.destination, seconds)
+            self.add(change.collection_id, SELLERS, change.source, seconds)
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            pending = self.pending
+            self.pending = {}
+            try:
+                await self.flush(pending)
+            except Exception as err:
+                # adding twice is harmless, the next flush retries them
+                self.failures += 1
+                for key, addresses in pending.items():
+                    self.pending.setdefault(key, set()).update(addresses)
+                self.wakeup.set()
+                logging.error(f'[Uniques]: Failed to add to {len(pending)} HyperLogLogs: {err}')
+            self.report()
+
+    async def flush(self, pending: Dict[str, Set[str]]):
+        async with redis_async.pipeline(transaction=False) as pipe:
+            for key, addresses in pending.items():
+                pipe.pfadd(key, *addresses)
+                if ':d:' in key:
+                    pipe.expire(key, (DAY_BUCKETS + 1) * 24 * 3600)
+            await pipe.execute()
+        self.flushes += 1
+
+    # all time when `days` is None, else the last `days` UTC days including today
+    async def count(self, collection_id: str, kind: str, days: Optional[int] = None) -> int:
+        if days == None:
+            return await redis_async.pfcount(unique_key(collection_id, kind))
+        today = datetime.utcnow()
+        keys = [unique_key(collection_id, kind, (today - timedelta(days=i)).strftime('%Y%m%d'))
+                for i in range(min(days, DAY_BUCKETS))]
+        return await redis_async.pfcount(*keys)
+
+    def report(self):
+        now = time.monotonic()
+        if now - self.reported_at >= METRICS_INTERVAL:
+            self.reported_at = now
+            logging.info(
+                f'[Uniques]: added {self.added}, flushes {self.flushes}, failures {self.failures}, pending {len(self.pending)}')
+
+
+unique_counter = UniqueCounter()
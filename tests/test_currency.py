@@ -0,0 +1,36 @@
+from common.currency import APTOS_COIN, CURRENCY_NAME_SQL, STAGE_CURRENCIES, STAGED_CURRENCY_ID, currency_name_of
+from model.coin_type_info import CoinTypeInfo
+
+
+def test_empty_currency_is_apt():
+    assert currency_name_of('') == APTOS_COIN
+
+
+def test_leading_zeros_and_case_are_normalized():
+    assert currency_name_of('0x0000000000000000000000000000000000000000000000000000000000000001::aptos_coin::AptosCoin') == APTOS_COIN
+    assert currency_name_of('0X00ABC::coin::USDC') == '0xabc::coin::USDC'
+
+
+def test_address_without_0x_prefix():
+    assert currency_name_of('1::aptos_coin::AptosCoin') == APTOS_COIN
+    assert currency_name_of('abc::coin::USDC') == '0xabc::coin::USDC'
+
+
+def test_module_and_struct_keep_their_case():
+    assert currency_name_of('0x1::Coin::MyCoin') == '0x1::Coin::MyCoin'
+
+
+def test_coin_type_info_of_apt():
+    info = CoinTypeInfo(account_address='0x1', module_name='0x6170746f735f636f696e', struct_name='0x4170746f73436f696e')
+    assert currency_name_of(info.currency()) == APTOS_COIN
+
+
+def test_sql_maps_empty_currency_to_apt():
+    sql = CURRENCY_NAME_SQL.format(column='r.currency')
+    assert sql.startswith("IF(COALESCE(r.currency, '') = '', '" + APTOS_COIN + "', ")
+    assert '{' not in sql
+
+
+def test_staged_statements_keep_the_stage_placeholder():
+    assert STAGE_CURRENCIES.format(stage='stage_x').endswith('FROM stage_x s')
+    assert 's.currency' in STAGED_CURRENCY_ID
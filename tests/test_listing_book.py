@@ -0,0 +1,89 @@
+from book.listing import ListingBook, ListingBooks
+from common.currency import APTOS_COIN
+from model.change import Change
+
+USDC = '0xabc::coin::USDC'
+
+
+def change_of(type: str, token_id: str, price: str = None, currency: str = None, version: int = 1) -> Change:
+    return Change(module='fixed_market', type=type, event_id=f'{type}-{token_id}-{version}', version=version,
+                  seqno=version, token_id=token_id, collection_id='collection', price=price,
+                  currency=currency, source='seller')
+
+
+def test_book_is_sorted_by_price():
+    book = ListingBook('collection', APTOS_COIN)
+    book.add('b', 'seller', 300)
+    book.add('a', 'seller', 100)
+    book.add('c', 'seller', 200)
+    assert book.floor() == 100
+    assert book.top(2) == [(100, 'a', 'seller'), (200, 'c', 'seller')]
+    assert book.depth(200) == 2
+
+
+def test_relisting_replaces_the_price():
+    book = ListingBook('collection', APTOS_COIN)
+    book.add('a', 'seller', 100)
+    book.add('a', 'seller', 500)
+    assert len(book) == 1
+    assert book.floor() == 500
+    assert book.remove('a', 'seller')
+    assert not book.remove('a', 'seller')
+    assert book.floor() == None
+
+
+def test_floor_ignores_other_currencies():
+    books = ListingBooks()
+    books.apply(change_of('list', 'a', '5', USDC, 1))
+    books.apply(change_of('list', 'b', '100', '0x1::aptos_coin::AptosCoin', 2))
+    assert books.floor('collection') == 100
+    assert books.floor('collection', USDC) == 5
+    assert books.count('collection') == 2
+    assert books.version == 2
+
+
+def test_legacy_listings_without_currency_are_apt():
+    books = ListingBooks()
+    books.apply(change_of('list', 'a', '7', None))
+    assert books.floor('collection') == 7
+    assert books.floor('collection', '0x00001::aptos_coin::AptosCoin') == 7
+
+
+def test_relisting_in_another_currency_moves_the_listing():
+    books = ListingBooks()
+    books.apply(change_of('list', 'a', '5', USDC, 1))
+    books.apply(change_of('list', 'a', '100', APTOS_COIN, 2))
+    assert books.floor('collection', USDC) == None
+    assert books.floor('collection') == 100
+    assert books.count('collection') == 1
+
+
+def test_delist_and_buy_remove_from_any_currency():
+    books = ListingBooks()
+    books.apply(change_of('list', 'a', '5', USDC, 1))
+    books.apply(change_of('list', 'b', '100', APTOS_COIN, 2))
+    books.apply(change_of('delist', 'a', version=3))
+    books.apply(change_of('buy', 'b', '100', APTOS_COIN, 4))
+    assert books.count('collection') == 0
+    assert books.top('collection', 10) == []
+    assert books.version == 4
+
+
+def test_unknown_collection_reads_empty():
+    books = ListingBooks()
+    assert books.floor('missing') == None
+    assert books.depth('missing', 100) == 0
+    assert books.count('missing') == 0
+
+
+def test_dump_and_restore():
+    books = ListingBooks()
+    books.apply(change_of('list', 'a', '5', USDC, 1))
+    books.apply(change_of('list', 'b', '100', APTOS_COIN, 2))
+    restored = ListingBooks()
+    restored.restore(books.dump())
+    assert restored.version == 2
+    assert restored.floor('collection') == 100
+    assert restored.floor('collection', USDC) == 5
+    restored.apply(change_of('delist', 'a', version=3))
+    assert restored.floor('collection', USDC) == None
@@ -0,0 +1,82 @@
+from common.util import primary_key_of_token
+from model.event import Event
+from observer.creation.token import DEFAULT_COLLECTION, DEFAULT_RESOURCE_ACCOUNT, CreateTokenEventObserver
+from observer.curation.exhibit_buy import ExhibitBuyEventObserver
+from observer.curation.exhibit_list import ExhibitListEventObserver
+from observer.curation.offer_create import OfferCreateEventObserver
+from observer.mapping import TOKEN_JOIN, newer_event_updates
+from observer.order.buy import BuyEventObserver
+from observer.order.list import ListEventObserver
+
+MAPPINGS = [ListEventObserver.mapping, BuyEventObserver.mapping, CreateTokenEventObserver.mapping,
+            ExhibitListEventObserver.mapping, ExhibitBuyEventObserver.mapping, OfferCreateEventObserver.mapping]
+
+
+def exhibit_buy_event_of(seqno: int, id: str) -> Event:
+    return Event(sequence_number=f'{seqno}', type='0x1::curation::ExhibitBuyEvent', version=f'{100 + seqno}',
+                 guid={'account_address': '0x1', 'creation_number': '9'}, data={
+                     'id': id, 'gallery_id': '1', 'token_id': {'property_version': '0', 'token_data_id': {
+                         'creator': 'creator', 'collection': 'collection', 'name': 'name'}},
+                     'origin': 'origin', 'price': '1', 'commission_feerate_numerator': '1',
+                     'commission_feerate_denominator': '100'})
+
+
+def create_token_event_of(seqno: int) -> Event:
+    return Event(sequence_number=f'{seqno}', type='0x1::creation::CreateTokenEvent', version=f'{100 + seqno}',
+                 guid={'account_address': '0x1', 'creation_number': '3'}, data={
+                     'description': '', 'name': 'Token #1', 'uri': '', 'user': 'minter'})
+
+
+def test_newer_event_updates_guard_every_column():
+    sql = newer_event_updates([('price', 's.price'), ('status', "'listing'")])
+    assert sql == ("ON DUPLICATE KEY UPDATE "
+                   "price = IF(CAST(s.version AS UNSIGNED) > eventVersion, s.price, price), "
+                   "status = IF(CAST(s.version AS UNSIGNED) > eventVersion, 'listing', status), "
+                   "eventVersion = GREATEST(eventVersion, CAST(s.version AS UNSIGNED))")
+
+
+def test_merges_substitute_the_stage_and_token_join():
+    for mapping in MAPPINGS:
+        for sql in mapping.merges():
+            assert '{' not in sql and '}' not in sql, sql
+            if 's.' in sql:
+                assert mapping.stage() in sql, sql
+        if mapping.token:
+            assert any([TOKEN_JOIN in sql for sql in mapping.merges()])
+
+
+def test_gallery_moves_run_before_the_rows_are_written():
+    merges = ExhibitBuyEventObserver.mapping.merges()
+    assert merges[0].startswith('INSERT INTO GalleryStats')
+    assert merges[1].startswith('UPDATE CurationExhibit')
+    merges = ExhibitListEventObserver.mapping.merges()
+    assert merges[0].startswith('INSERT INTO GalleryStats')
+    assert merges[1].startswith('INSERT INTO CurationExhibit')
+
+
+def test_staging_flags_the_latest_event_per_key():
+    mapping = ExhibitBuyEventObserver.mapping
+    rows = mapping.rows([exhibit_buy_event_of(0, '7'), exhibit_buy_event_of(1, '8'), exhibit_buy_event_of(2, '7')])
+    assert [row[-1] for row in rows] == [0, 1, 1]
+    statements = mapping.staging([exhibit_buy_event_of(0, '7')])
+    assert statements[0][0] == f'DROP TEMPORARY TABLE IF EXISTS {mapping.stage()}'
+    assert statements[1][0].startswith(f'CREATE TEMPORARY TABLE {mapping.stage()} (`seqno` BIGINT')
+    assert statements[2][1][-1] == 1
+
+
+def test_minted_token_is_keyed_by_its_minter():
+    mapping = CreateTokenEventObserver.mapping
+    event = create_token_event_of(0)
+    row = mapping.rows([event])[0]
+    names = [column.name for column in mapping.stage_columns()]
+    token_id = primary_key_of_token('minter', DEFAULT_COLLECTION, 'Token #1')
+    assert row[names.index('tokenId')] == token_id
+    assert row[names.index('creator')] == DEFAULT_RESOURCE_ACCOUNT
+    assert token_id != primary_key_of_token(DEFAULT_RESOURCE_ACCOUNT, DEFAULT_COLLECTION, 'Token #1')
+    assert CreateTokenEventObserver().change(event).token_id == token_id
+
+
+def test_replayed_token_pages_do_not_fail_on_duplicates():
+    for sql in CreateTokenEventObserver.mapping.merges():
+        if sql.startswith('INSERT INTO AptosToken') or sql.startswith('INSERT INTO TokenOwnership'):
+            assert sql.endswith('ON DUPLICATE KEY UPDATE id = id')
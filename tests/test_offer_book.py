@@ -0,0 +1,78 @@
+import time
+from book.offer import Offer, OfferBooks
+from model.change import Change
+
+HOUR = 3600 * 1000000
+
+
+def now() -> int:
+    return round(time.time() * 1000000)
+
+
+def offer_of(id: str, price: int, opened_at: int, token_id: str = 'token', offerer: str = 'offerer') -> Offer:
+    return Offer(id=id, token_id=token_id, collection_id='collection', offerer=offerer, price=price,
+                 opened_at=opened_at, ended_at=now() + HOUR)
+
+
+def test_best_offer_is_the_highest_price():
+    books = OfferBooks()
+    start = now()
+    books.add(offer_of('a', 100, start))
+    books.add(offer_of('b', 300, start + 1, offerer='other'))
+    books.add(offer_of('c', 200, start + 2, token_id='another'))
+    assert books.best_of_token('token').id == 'b'
+    assert books.best_of_collection('collection').id == 'b'
+
+
+def test_closed_offers_leave_the_top():
+    books = OfferBooks()
+    start = now()
+    books.add(offer_of('a', 100, start))
+    books.add(offer_of('b', 300, start + 1, offerer='other'))
+    books.close('b')
+    assert books.best_of_token('token').id == 'a'
+    books.close('a')
+    assert books.best_of_token('token') == None
+
+
+def test_expired_offers_are_dropped():
+    books = OfferBooks()
+    expired = offer_of('a', 500, now() - 2 * HOUR)
+    expired.ended_at = now() - HOUR
+    books.add(expired)
+    books.add(offer_of('b', 100, now()))
+    assert books.best_of_collection('collection').id == 'b'
+    assert 'a' not in books.offers
+
+
+def test_resolve_picks_the_last_offer_opened_before_the_event():
+    books = OfferBooks()
+    start = now()
+    books.add(offer_of('a', 100, start))
+    books.add(offer_of('b', 200, start + 10))
+    assert books.resolve('token', 'offerer', start + 5).id == 'a'
+    assert books.resolve('token', 'offerer', start + 10).id == 'b'
+    assert books.resolve('token', 'offerer', start - 1) == None
+
+
+def test_cancel_change_closes_the_offer():
+    books = OfferBooks()
+    start = now()
+    books.apply(Change(module='offer', type='create_offer', event_id='a', version=1, seqno=1, token_id='token',
+                       collection_id='collection', price='100', source='offerer', timestamp=start,
+                       expiration=start + HOUR))
+    books.apply(Change(module='offer', type='cancel_offer', event_id='c', version=2, seqno=1, token_id='token',
+                       collection_id='collection', source='offerer', timestamp=start + 1))
+    assert books.best_of_token('token') == None
+    assert books.version == 2
+
+
+def test_dump_and_restore():
+    books = OfferBooks()
+    start = now()
+    books.add(offer_of('a', 100, start))
+    books.add(offer_of('b', 200, start + 1, offerer='other'))
+    restored = OfferBooks()
+    restored.restore(books.dump())
+    assert restored.best_of_token('token').id == 'b'
+    assert restored.resolve('token', 'offerer', start + 1).id == 'a'
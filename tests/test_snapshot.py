@@ -0,0 +1,108 @@
+import asyncio
+from book.listing import listing_books
+from book.offer import offer_books
+from book.snapshot import FORMAT, IndexSnapshots
+from common.currency import APTOS_COIN
+from common.db import prisma_client
+from common.util import primary_key_of_token
+from config import config
+from model.event import Event
+from model.state import empty_offset
+from observer.creation.token import DEFAULT_COLLECTION, DEFAULT_RESOURCE_ACCOUNT
+from observer.order.list import ListEventObserver
+from scheduler.expiry import expiry_scheduler
+
+APT = {'account_address': '0x1', 'module_name': '0x6170746f735f636f696e', 'struct_name': '0x4170746f73436f696e'}
+
+
+def list_event_of(seqno: int, name: str) -> Event:
+    return Event(sequence_number=f'{seqno}', type='0x1::FixedMarket::ListEvent', version=f'{100 + seqno}',
+                 guid={'account_address': '0x1', 'creation_number': '2'}, data={
+                     'coin_type_info': APT,
+                     'offer_id': f'{seqno}',
+                     'price': '1000',
+                     'seller': 'seller',
+                     'timestamp': '1670000000000000',
+                     'token_amount': '1',
+                     'token_id': {'property_version': '0', 'token_data_id': {
+                         'creator': DEFAULT_RESOURCE_ACCOUNT, 'collection': DEFAULT_COLLECTION, 'name': name}},
+                     'locked_until_secs': '0',
+                 })
+
+
+# serves the events of one stream as the node would
+class Node:
+
+    def __init__(self, events) -> None:
+        self.events = events
+
+    def url(self, event_handle: str, event_field: str, start: int, limit: int = 100) -> str:
+        return f'{start}:{limit}'
+
+    async def get_events(self, url: str):
+        (start, limit) = [int(value) for value in url.split(':')]
+        return [event for event in self.events if start <= int(event.sequence_number) < start + limit]
+
+
+def reset():
+    listing_books.restore({'version': 0, 'books': {}})
+    offer_books.restore({'version': 0, 'offers': [], 'tokens': {}, 'collections': {}, 'offerers': {}})
+    expiry_scheduler.restore({'deadlines': []})
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'snapshot_path', str(tmp_path / 'indexes.snapshot'))
+    reset()
+    listing_books.add('collection', APTOS_COIN, 'token', 'seller', 1000)
+    snapshots = IndexSnapshots()
+    offset = empty_offset()
+    snapshots.start(offset)
+    snapshots.write(snapshots.capture())
+    reset()
+
+    assert asyncio.run(snapshots.restore(offset, {}))
+    assert listing_books.floor('collection') == 1000
+
+
+def test_snapshot_of_another_format_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / 'indexes.snapshot'
+    path.write_bytes(b'imart-snapshot-0\n')
+    monkeypatch.setattr(config, 'snapshot_path', str(path))
+    assert FORMAT != b'imart-snapshot-0\n'
+    assert IndexSnapshots().read() == None
+
+
+def test_snapshot_ahead_of_mysql_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'snapshot_path', str(tmp_path / 'indexes.snapshot'))
+    reset()
+    snapshots = IndexSnapshots()
+    offset = empty_offset()
+    snapshots.start(offset)
+    snapshots.watermarks['list_token_events'] = 5
+    snapshots.write(snapshots.capture())
+    assert not asyncio.run(snapshots.restore(offset, {}))
+
+
+def test_replay_resolves_minted_tokens_through_aptos_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'snapshot_path', str(tmp_path / 'indexes.snapshot'))
+    reset()
+    snapshots = IndexSnapshots()
+    offset = empty_offset()
+    snapshots.start(offset)
+    snapshots.write(snapshots.capture())
+
+    # the minted token is keyed by its minter, not by the resource account creating it
+    token_id = primary_key_of_token('minter', DEFAULT_COLLECTION, 'Token #1')
+
+    async def query_raw(sql, *args):
+        assert 'FROM AptosToken' in sql
+        return [{'id': token_id, 'collectionId': 'collection', 'creator': args[0], 'collection': args[1], 'name': args[2]}]
+    monkeypatch.setattr(prisma_client, 'query_raw', query_raw)
+
+    offset.list_events_excuted_offset = 0
+    replays = {'list_token_events': ('0x1::FixedMarket::FixedMarketEvents', Node([list_event_of(0, 'Token #1')]),
+                                     ListEventObserver())}
+    assert asyncio.run(snapshots.restore(offset, replays))
+    assert listing_books.top('collection', 1) == [(1000, token_id, 'seller')]
+    assert snapshots.watermarks['list_token_events'] == 0
+